@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pandas import DataFrame
+
+
+@dataclass
+class _Entry:
+    df: DataFrame
+    requested: frozenset  # every column name asked for, including ones the file doesn't have
+    complete: bool        # True when the frame holds the whole file
+    nbytes: int
+
+
+class DatasetCache:
+    """
+    In-process LRU cache of parsed datasets keyed by upload content hash, so every
+    file_id sharing the same bytes shares one entry. Bounded by the deep memory
+    size of the cached frames.
+
+    Entries can hold a column subset; a request is a hit when the entry is complete
+    or already covers every requested column. Frames are copied on the way out
+    because the ML helpers mutate their input (dropna(inplace=True), new columns).
+
+    It also remembers which content hash each file_id points at, so a hit needs
+    no database round trip. A file_id's hash never changes while the row exists;
+    forget_file drops the mapping when the upload is deleted.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._file_hashes: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, content_hash: str, columns: list[str] | None = None) -> DataFrame | None:
+        key = content_hash
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not (entry.complete or (columns is not None and entry.requested.issuperset(columns))):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            df = entry.df
+        if columns is not None:
+            df = df[[c for c in dict.fromkeys(columns) if c in df.columns]]
+        return df.copy()
+
+    def columns_to_load(self, content_hash: str, columns: list[str] | None) -> list[str] | None:
+        """Widen a missed request with the columns already cached, so the entry only grows."""
+        if columns is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(content_hash)
+            if entry is None:
+                return list(dict.fromkeys(columns))
+            return list(dict.fromkeys([*entry.requested, *columns]))
+
+    def put(self, content_hash: str, df: DataFrame, columns: list[str] | None = None):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        key = content_hash
+        entry = _Entry(
+            df=df.copy(),
+            requested=frozenset(columns if columns is not None else df.columns),
+            complete=columns is None,
+            nbytes=nbytes,
+        )
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.nbytes
+            self._entries[key] = entry
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def invalidate(self, content_hash: str):
+        with self._lock:
+            entry = self._entries.pop(content_hash, None)
+            if entry is not None:
+                self.current_bytes -= entry.nbytes
+
+    def file_hash(self, file_id: int) -> str | None:
+        with self._lock:
+            return self._file_hashes.get(file_id)
+
+    def remember_file(self, file_id: int, content_hash: str):
+        with self._lock:
+            self._file_hashes[file_id] = content_hash
+
+    def forget_file(self, file_id: int):
+        with self._lock:
+            self._file_hashes.pop(file_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
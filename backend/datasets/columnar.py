@@ -0,0 +1,69 @@
+import io
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas import DataFrame
+
+
+EXCEL_EXTENSIONS = (".xlsx", ".xls")
+
+# Row group size of the stored Parquet copy; small enough that a column subset
+# of a large upload can be streamed group by group.
+PARQUET_ROW_GROUP_SIZE = 50_000
+
+# What to_parquet_bytes raises for frames Parquet can't represent
+PARQUET_ERRORS = (pa.ArrowException, ValueError, TypeError)
+
+
+def decode_text(raw: bytes) -> str:
+    """Decode uploaded bytes as UTF-8, falling back to latin1 for legacy exports."""
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin1")
+
+
+def parse_upload(file_name: str | None, raw: bytes) -> DataFrame:
+    """
+    Parse an uploaded file into a DataFrame based on its extension.
+    .xlsx/.xls go through read_excel, everything else is treated as CSV.
+    """
+    ext = os.path.splitext(file_name or "")[1].lower()
+    if ext in EXCEL_EXTENSIONS:
+        return pd.read_excel(io.BytesIO(raw), engine=None)
+    return pd.read_csv(io.StringIO(decode_text(raw)))
+
+
+def to_parquet_bytes(df: DataFrame) -> bytes:
+    """
+    Serialise a parsed upload into Parquet bytes.
+    Raises one of PARQUET_ERRORS when the frame can't be represented (e.g.
+    mixed-type object columns); callers then keep using the raw bytes.
+    """
+    frame = df.copy()
+    frame.columns = [str(c) for c in frame.columns]
+    buf = io.BytesIO()
+    frame.to_parquet(buf, engine="pyarrow", index=False, row_group_size=PARQUET_ROW_GROUP_SIZE)
+    return buf.getvalue()
+
+
+def read_columnar(data: bytes, columns: list[str] | None = None) -> DataFrame:
+    """
+    Load the stored Parquet copy, reading only `columns` when given.
+    Requested columns that don't exist are ignored so callers raise their
+    usual 'missing column' errors downstream.
+    """
+    buf = io.BytesIO(data)
+    if columns is not None:
+        names = pq.read_schema(buf).names
+        columns = [c for c in dict.fromkeys(columns) if c in names]
+        buf.seek(0)
+    return pd.read_parquet(buf, engine="pyarrow", columns=columns)
+
+
+def select_columns(df: DataFrame, columns: list[str] | None = None) -> DataFrame:
+    """Same projection as read_columnar, for frames parsed from the raw bytes."""
+    if columns is None:
+        return df
+    return df[[c for c in dict.fromkeys(columns) if c in df.columns]]
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+
+HISTOGRAM_BINS = 10
+TOP_VALUES = 10
+
+
+def _scalar(value):
+    """Convert numpy/pandas scalars into JSON-serialisable Python values."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(value)
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def profile_column(s: pd.Series, bins: int = HISTOGRAM_BINS) -> dict:
+    """
+    Stats for one column:
+      - numeric: min/max and an equal-width histogram (edges + counts)
+      - everything else: min/max of the string values and the most frequent values
+    """
+    out = {
+        "name": str(s.name),
+        "dtype": str(s.dtype),
+        "null_count": int(s.isna().sum()),
+        "min": None,
+        "max": None,
+        "histogram": None,
+    }
+    values = s.dropna()
+    if values.empty:
+        return out
+
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        finite = values.to_numpy(dtype=float)
+        finite = finite[np.isfinite(finite)]
+        if finite.size:
+            counts, edges = np.histogram(finite, bins=bins)
+            out["min"] = _scalar(values.min())
+            out["max"] = _scalar(values.max())
+            out["histogram"] = {"edges": edges.tolist(), "counts": counts.tolist()}
+        return out
+
+    as_text = values.astype(str)
+    top = as_text.value_counts().head(TOP_VALUES)
+    out["min"] = as_text.min()
+    out["max"] = as_text.max()
+    out["histogram"] = {"values": top.index.tolist(), "counts": top.to_numpy().tolist()}
+    return out
+
+
+def build_profile(df: DataFrame) -> dict:
+    """Upload-time profile: row count plus per-column dtype, nulls, range and histogram."""
+    return {
+        "row_count": int(len(df)),
+        "columns": [profile_column(df.iloc[:, i]) for i in range(df.shape[1])],
+    }
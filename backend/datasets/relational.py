@@ -0,0 +1,135 @@
+import io
+import pandas as pd
+from pandas import DataFrame
+from psycopg2 import sql
+
+
+# Aggregates that can be pushed down to an ingested table
+AGGREGATES = {"count": "COUNT", "sum": "SUM", "avg": "AVG", "min": "MIN", "max": "MAX"}
+
+
+def table_name_for(content_hash: str) -> str:
+    return f"dataset_{content_hash[:16]}"
+
+
+def sql_type(dtype) -> str:
+    """Map a pandas dtype to the Postgres column type used for ingestion."""
+    if pd.api.types.is_bool_dtype(dtype):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "BIGINT"
+    if pd.api.types.is_float_dtype(dtype):
+        return "DOUBLE PRECISION"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def infer_schema(df: DataFrame) -> list[dict]:
+    """
+    Catalog entry for each column: original header, positional SQL column (c0, c1, ...)
+    and SQL type. Positional names avoid Postgres' 63-byte identifier limit and
+    quoting issues with arbitrary CSV headers; queries alias them back.
+    """
+    return [
+        {"name": str(name), "column": f"c{i}", "type": sql_type(df[name].dtype)}
+        for i, name in enumerate(df.columns)
+    ]
+
+
+def ingest_table(cur, table_name: str, df: DataFrame, schema: list[dict]):
+    """Create the typed table for an upload and COPY the parsed rows into it."""
+    columns = sql.SQL(", ").join(
+        sql.SQL("{} {}").format(sql.Identifier(c["column"]), sql.SQL(c["type"])) for c in schema
+    )
+    cur.execute(sql.SQL("CREATE TABLE {} (_row_id BIGSERIAL PRIMARY KEY, {})").format(
+        sql.Identifier(table_name), columns
+    ))
+
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cur.copy_expert(
+        sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+            sql.Identifier(table_name),
+            sql.SQL(", ").join(sql.Identifier(c["column"]) for c in schema),
+        ),
+        buf,
+    )
+
+
+def drop_table(cur, table_name: str):
+    cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(table_name)))
+
+
+def _projection(schema: list[dict], columns: list[str] | None):
+    by_name = {c["name"]: c for c in schema}
+    if columns is None:
+        picked = schema
+    else:
+        picked = [by_name[name] for name in dict.fromkeys(columns) if name in by_name]
+    return picked, sql.SQL(", ").join(
+        sql.SQL("{} AS {}").format(sql.Identifier(c["column"]), sql.Identifier(c["name"])) for c in picked
+    )
+
+
+def read_table(
+    cur,
+    table_name: str,
+    schema: list[dict],
+    columns: list[str] | None = None,
+    offset: int | None = None,
+    limit: int | None = None,
+) -> DataFrame:
+    """
+    SELECT only the requested columns (and optionally a row window) of an ingested upload.
+    Unknown columns are ignored, matching read_columnar.
+    """
+    picked, projection = _projection(schema, columns)
+    if not picked:
+        return DataFrame()
+    query = sql.SQL("SELECT {} FROM {} ORDER BY _row_id").format(projection, sql.Identifier(table_name))
+    params = []
+    if limit is not None:
+        query += sql.SQL(" LIMIT %s")
+        params.append(limit)
+    if offset:
+        query += sql.SQL(" OFFSET %s")
+        params.append(offset)
+    cur.execute(query, params)
+    df = DataFrame(cur.fetchall(), columns=[c["name"] for c in picked])
+    for c in picked:
+        if c["type"] in ("BIGINT", "DOUBLE PRECISION"):
+            df[c["name"]] = pd.to_numeric(df[c["name"]])
+    return df
+
+
+def aggregate_table(
+    cur,
+    table_name: str,
+    schema: list[dict],
+    column: str,
+    op: str,
+    group_by: str | None = None,
+) -> list[dict]:
+    """Run a simple aggregate (count/sum/avg/min/max) in Postgres, optionally grouped."""
+    op = op.lower()
+    if op not in AGGREGATES:
+        raise ValueError(f"op must be one of: {', '.join(AGGREGATES)}")
+    by_name = {c["name"]: c for c in schema}
+    for name in (column, group_by):
+        if name is not None and name not in by_name:
+            raise KeyError(f"Column not found: {name}")
+
+    value = sql.SQL("{}({})").format(sql.SQL(AGGREGATES[op]), sql.Identifier(by_name[column]["column"]))
+    if group_by is None:
+        cur.execute(sql.SQL("SELECT {} FROM {}").format(value, sql.Identifier(table_name)))
+        return [{op: cur.fetchone()[0]}]
+
+    key = sql.Identifier(by_name[group_by]["column"])
+    cur.execute(
+        sql.SQL("SELECT {key}, {value} FROM {table} GROUP BY {key} ORDER BY {key}").format(
+            key=key, value=value, table=sql.Identifier(table_name)
+        )
+    )
+    return [{group_by: k, op: v} for k, v in cur.fetchall()]
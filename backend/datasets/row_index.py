@@ -0,0 +1,98 @@
+import io
+import pandas as pd
+import pyarrow.parquet as pq
+from pandas import DataFrame
+from openpyxl import load_workbook
+
+from backend.datasets.columnar import decode_text
+
+
+# A byte offset is stored for every ROW_INDEX_STRIDE-th data row of a CSV upload
+ROW_INDEX_STRIDE = 1000
+
+
+def build_row_index(raw: bytes, stride: int = ROW_INDEX_STRIDE) -> list[int]:
+    """
+    Byte offsets of data rows 0, stride, 2*stride, ... of a CSV.
+    offsets[0] is therefore also the length of the header line.
+    Quoted fields spanning several lines are tracked by quote parity, and blank
+    lines are skipped the same way read_csv skips them.
+    """
+    offsets = []
+    pos = 0
+    record_start = 0
+    in_quotes = False
+    row = -1  # header is row -1
+    for line in io.BytesIO(raw):
+        if not in_quotes:
+            record_start = pos
+        if line.count(b'"') % 2:
+            in_quotes = not in_quotes
+        pos += len(line)
+        if in_quotes:
+            continue
+        if not line.strip():
+            continue
+        if row >= 0 and row % stride == 0:
+            offsets.append(record_start)
+        row += 1
+    if row >= 0 and row % stride == 0:
+        # End marker, so the last block's byte range is bounded too
+        offsets.append(pos)
+    return offsets
+
+
+def window_blocks(offset: int, limit: int, stride: int = ROW_INDEX_STRIDE) -> tuple[int, int, int]:
+    """
+    Index blocks covering rows [offset, offset + limit).
+    Returns (first_block, rows_to_skip_in_first_block, end_block).
+    """
+    first = offset // stride
+    end = (offset + limit + stride - 1) // stride
+    return first, offset - first * stride, end
+
+
+def read_csv_window(header: bytes, body: bytes, skip: int, limit: int) -> DataFrame:
+    """Parse a window of rows cut out of a CSV, using its header bytes for column names."""
+    text = decode_text(header + body)
+    # Windows span at most ~2 index blocks, so parsing it all and slicing is cheap
+    # and stays correct for quoted multi-line fields
+    df = pd.read_csv(io.StringIO(text))
+    return df.iloc[skip: skip + limit]
+
+
+def read_xlsx_window(raw: bytes, offset: int, limit: int) -> DataFrame:
+    """
+    Stream only the requested rows of the first sheet with openpyxl's read-only mode.
+    Only the window is kept, but the sheet XML of every earlier row is still parsed,
+    so this is O(offset); prefer read_parquet_window when the Parquet copy exists.
+    """
+    wb = load_workbook(io.BytesIO(raw), read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        header = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        columns = [str(h) if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)]
+        rows = ws.iter_rows(min_row=offset + 2, max_row=offset + 1 + limit, values_only=True)
+        return DataFrame([list(r)[:len(columns)] for r in rows], columns=columns)
+    finally:
+        wb.close()
+
+
+def read_parquet_window(data: bytes, offset: int, limit: int) -> tuple[DataFrame, int]:
+    """
+    Rows [offset, offset + limit) of the stored Parquet copy and its total row count.
+    Only the row groups overlapping the window are decoded.
+    """
+    pf = pq.ParquetFile(io.BytesIO(data))
+    groups, start, skip = [], 0, 0
+    for i in range(pf.metadata.num_row_groups):
+        rows = pf.metadata.row_group(i).num_rows
+        if start + rows > offset and start < offset + limit:
+            if not groups:
+                skip = offset - start
+            groups.append(i)
+        start += rows
+    if not groups:
+        return pf.schema_arrow.empty_table().to_pandas(), pf.metadata.num_rows
+    df = pf.read_row_groups(groups).to_pandas()
+    return df.iloc[skip: skip + limit].reset_index(drop=True), pf.metadata.num_rows
@@ -0,0 +1,38 @@
+LISA_FIELDS = ("local_I", "p_value", "cluster_label")
+LAYER_FIELDS = ("value", *LISA_FIELDS, "value_lower", "value_upper")
+
+
+def pack_layers(boundaries: list[tuple], attributes: list[tuple]) -> dict:
+    """
+    Pack many dashboard layers into one payload:
+      - "geometry": a FeatureCollection with each region's polygon sent once
+      - "codes": region codes, the order every attribute array follows
+      - "layers": {variable: {year: {value, local_I, p_value, cluster_label, value_lower, value_upper}}}
+    `boundaries` are (code, name, geometry) rows and `attributes` are
+    (variable, year, code, value, local_I, p_value, cluster_label, value_lower, value_upper) rows.
+    Regions missing from a layer get nulls in its arrays.
+    """
+    codes = [code for code, _, _ in boundaries]
+    position = {code: i for i, code in enumerate(codes)}
+
+    layers = {}
+    for variable, year, code, *fields in attributes:
+        layer = layers.setdefault(variable, {}).get(year)
+        if layer is None:
+            layer = {k: [None] * len(codes) for k in LAYER_FIELDS}
+            layers[variable][year] = layer
+        i = position[code]
+        for key, field in zip(LAYER_FIELDS, fields):
+            layer[key][i] = field
+
+    return {
+        "geometry": {
+            "type": "FeatureCollection",
+            "features": [
+                {"type": "Feature", "properties": {"code": code, "name": name}, "geometry": geometry}
+                for code, name, geometry in boundaries
+            ],
+        },
+        "codes": codes,
+        "layers": layers,
+    }
@@ -0,0 +1,97 @@
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable
+import pandas as pd
+from pandas import DataFrame
+from geopandas import GeoDataFrame
+
+from backend.geodata.lisa import load_boundaries, lisa_layer
+
+
+@dataclass
+class FillTask:
+    year: int
+    variable: str
+    df: DataFrame
+    gas: bool = False
+    source_hash: str | None = None
+
+
+def source_hash(df: DataFrame) -> str:
+    """Content hash of a task's source rows (order-sensitive)."""
+    digest = hashlib.sha256(",".join(map(str, df.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def compute_task(task: FillTask, gpkg_path: str, level: str, perm: int) -> tuple[GeoDataFrame | None, str | None]:
+    """Run one (year, variable) LISA layer in a worker. Returns (layer, error)."""
+    try:
+        layer = lisa_layer(
+            task.df, load_boundaries(gpkg_path, level), level, task.variable,
+            perm=perm, gas=task.gas,
+        )
+        return layer, None
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e)
+        return None, f"{type(e).__name__}: {detail}"
+
+
+def run_fill(
+    tasks: list[FillTask],
+    gpkg_path: str,
+    level: str,
+    write_batch: Callable[[list[tuple[FillTask, GeoDataFrame | None]]], list[bool]],
+    *,
+    workers: int | None = None,
+    batch_size: int = 8,
+    perm: int = 999,
+) -> list[dict]:
+    """
+    Compute fill tasks across a process pool of at most `workers` processes and
+    hand finished (task, layer) pairs to `write_batch` in groups of `batch_size`, in
+    completion order. Skipped tasks are passed with a None layer so their source can
+    be recorded. `write_batch` returns, per pair, whether a layer was newly stored.
+
+    Returns one status per task: written | exists | skipped (too few values) | failed.
+    Workers are spawned rather than forked so they don't inherit the API's DB
+    connections or threads; each loads the boundary file once.
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(tasks) or 1))
+    statuses = {}
+    pending = []
+
+    def flush():
+        try:
+            written = write_batch(pending)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            for task, _ in pending:
+                statuses[(task.year, task.variable)] = {"status": "failed", "error": error}
+        else:
+            for (task, layer), inserted in zip(pending, written):
+                status = "skipped" if layer is None else "written" if inserted else "exists"
+                statuses[(task.year, task.variable)] = {"status": status}
+        pending.clear()
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(compute_task, task, gpkg_path, level, perm): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                layer, error = future.result()
+            except Exception as e:  # worker died
+                layer, error = None, f"{type(e).__name__}: {e}"
+            if error is not None:
+                statuses[(task.year, task.variable)] = {"status": "failed", "error": error}
+            else:
+                pending.append((task, layer))
+                if len(pending) >= batch_size:
+                    flush()
+        if pending:
+            flush()
+
+    return [{"year": task.year, "variable": task.variable, **statuses[(task.year, task.variable)]} for task in tasks]
@@ -0,0 +1,137 @@
+import gzip
+import json
+import select
+import threading
+from collections import OrderedDict
+
+from backend.db import get_db_connection
+from backend.geodata.store import ASTHMA_VARIABLES, LAYER_CHANNEL
+
+
+def layer_key(level: str, year: int, variable: str) -> tuple:
+    """
+    Cache key of one dashboard layer. Both asthma variables map to the same key,
+    since /get_asthma_dashboard serves whichever of them wins for the year.
+    """
+    return level, int(year), "asthma" if variable in ASTHMA_VARIABLES else variable
+
+
+class LayerCache:
+    """
+    In-process LRU cache of serialized dashboard layer responses, kept both as
+    plain and gzip-compressed bytes. An entry must be invalidated whenever its
+    layer is written: a new layer under the same key (observed asthma replacing
+    a forecast) or a layer replaced in place (forecasts, refills, queue tasks).
+
+    Each key has a generation that invalidate() bumps. Readers take it with
+    generation() before querying the database and pass it to put(), which
+    drops bodies read before an invalidation that raced with them. clear()
+    bumps every generation at once by advancing an epoch added to all of them.
+    """
+
+    def __init__(self, max_bytes: int, compress_level: int = 6):
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self._entries: OrderedDict[tuple, tuple[bytes, bytes]] = OrderedDict()
+        self._generations: dict[tuple, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> tuple[bytes, bytes] | None:
+        """(plain, gzipped) bytes of a cached layer."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def generation(self, key: tuple) -> int:
+        with self._lock:
+            return self._epoch + self._generations.get(key, 0)
+
+    def put(self, key: tuple, body: bytes, generation: int | None = None) -> tuple[bytes, bytes]:
+        """
+        Cache body under key and return the (plain, gzipped) entry. With the
+        generation taken before body was read, nothing is cached when the key
+        was invalidated in between.
+        """
+        entry = (body, gzip.compress(body, compresslevel=self.compress_level))
+        nbytes = len(entry[0]) + len(entry[1])
+        if nbytes > self.max_bytes:
+            return entry
+        with self._lock:
+            if generation is not None and generation != self._epoch + self._generations.get(key, 0):
+                return entry
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old[0]) + len(old[1])
+            self._entries[key] = entry
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted[0]) + len(evicted[1])
+        return entry
+
+    def invalidate(self, key: tuple):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= len(entry[0]) + len(entry[1])
+
+    def clear(self):
+        """Invalidate every key, e.g. when announcements may have been missed."""
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def listen_for_invalidations(cache: LayerCache, stop: threading.Event, reconnect_seconds: float = 5):
+    """
+    Invalidate cache entries of layers announced on LAYER_CHANNEL, including
+    those written by other processes such as geodata queue workers. Runs until
+    stop is set, reconnecting after connection errors. The whole cache is
+    cleared after every (re)LISTEN, since layers written while no listener was
+    connected were announced to nobody.
+    """
+    while not stop.is_set():
+        try:
+            conn = get_db_connection()
+        except Exception as e:
+            print(f"Dashboard cache listener could not connect: {e}")
+            stop.wait(reconnect_seconds)
+            continue
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {LAYER_CHANNEL}")
+            cache.clear()
+            while not stop.is_set():
+                if not select.select([conn], [], [], 1.0)[0]:
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    level, year, variable = json.loads(conn.notifies.pop(0).payload)
+                    cache.invalidate(layer_key(level, year, variable))
+        except Exception as e:
+            print(f"Dashboard cache listener reconnecting: {e}")
+            stop.wait(reconnect_seconds)
+        finally:
+            conn.close()
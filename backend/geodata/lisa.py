@@ -0,0 +1,307 @@
+import copy
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+import geopandas as gpd
+from geopandas import GeoDataFrame
+from libpysal.weights import Queen, Rook, KNN
+from esda.moran import Moran_Local
+from fastapi import HTTPException
+
+
+COLUMN_MAPPINGS = {
+    "adm0": {"code": "shapeGroup", "name": "shapeName", "alias": "country"},
+    "adm1": {"code": "shapeID", "name": "shapeName", "alias": "state"},
+    "adm2": {"code": "shapeID", "name": "shapeName", "alias": "county"}
+}
+
+
+def assign_weights(gdf: GeoDataFrame, wtype: str, k: int | None):
+    wtype = wtype.lower()
+    if wtype == "queen":
+        w = Queen.from_dataframe(gdf)
+        
+    elif wtype == "rook":
+        w = Rook.from_dataframe(gdf)
+        
+    elif wtype == "knn":
+        if k is None:
+            raise ValueError("k can't be None for weight type knn")
+        cent = gdf.geometry.representative_point()
+        w = KNN.from_dataframe(gdf.set_geometry(cent), k=k, use_index=True)
+        
+    else:
+        raise HTTPException(status_code=400, detail=f"Unsupported weight type: {wtype}")
+    w.transform = "R" # pyright: ignore[reportAttributeAccessIssue]
+    
+    if getattr(w, 'islands', None):
+        pass
+    return w
+
+_weights: OrderedDict = OrderedDict()
+_weights_lock = threading.Lock()
+WEIGHTS_CACHE_SIZE = 16
+
+
+def cached_weights(gdf: GeoDataFrame, wtype: str, k: int | None):
+    """
+    assign_weights, reused across calls on the same regions (e.g. every year of a
+    forecast). Keyed by the regions' codes, extent and the weight options; each
+    caller gets a shallow copy so concurrent Moran_Local runs don't share
+    transform state.
+    """
+    key = (wtype.lower(), k, tuple(gdf["code"]), tuple(np.round(gdf.total_bounds, 9)))
+    with _weights_lock:
+        w = _weights.get(key)
+        if w is not None:
+            _weights.move_to_end(key)
+    if w is None:
+        w = assign_weights(gdf, wtype, k)
+        with _weights_lock:
+            _weights[key] = w
+            while len(_weights) > WEIGHTS_CACHE_SIZE:
+                _weights.popitem(last=False)
+    return copy.copy(w)
+
+def normalize(s: pd.Series):
+    # ascii-fold
+    def fold(x):
+        if pd.isna(x):
+            x = ""
+        else:
+            x = str(x)
+        x = unicodedata.normalize("NFKD", x)
+        chars =[]
+        for char in x:
+            if not unicodedata.combining(char):
+                chars.append(char)
+        x = "".join(chars)
+        return x.lower()
+    output = s.map(fold).str.replace(r"[^a-z0-9]+",  " ", regex=True).str.strip()
+    return output
+
+
+def join_layers(
+    df: DataFrame,
+    gdf: GeoDataFrame,
+    level: str,
+    variable: str,
+    *,
+    join_by: str = "code",
+    join_key: str | None = None,
+    country_iso3: str | None = None,
+    country_col: str | None = "country",
+    state_col: str | None = "state",
+    county_col: str | None = "county",
+    lon_col: str | None = "lon",
+    lat_col: str | None = "lat",
+    carry: tuple[str, ...] = (),
+    ):
+    # extra columns (e.g. interval bounds) joined alongside the variable when present
+    values = [variable, *(c for c in carry if c in df.columns and c != variable)]
+    
+    if country_iso3:
+        if "iso_a3" in gdf.columns:
+            gdf = gdf[gdf["iso_a3"].astype(str).str.upper() == country_iso3.upper()].copy()
+        elif "shapeGroup" in gdf.columns:
+            gdf = gdf[gdf["shapeGroup"].astype(str).str.upper() == country_iso3.upper()].copy()
+    
+    
+    if join_by == "code":
+        if not join_key or join_key not in df.columns:
+            raise HTTPException(400, detail=f"join_by code required join_key to be in the uploaded file")
+        temp = df.copy()
+        temp["code"] = temp[join_key].astype(str).str.strip()
+        merged = gdf.merge(temp[["code", *values]], on="code", how="inner")
+        return merged
+    
+    elif join_by == "name":
+        if level == "adm0":
+            if country_col in df.columns:
+                left = gdf.copy()
+                right = df.copy()
+                left["name_norm"] = normalize(left["name"])
+                right["name_norm"] = normalize(right[country_col])
+                merged = left.merge(right[[country_col, "name_norm", *values]], on="name_norm", how="inner")
+                return merged
+            else:
+                raise HTTPException(400, detail="for join_by=adm0, country name column must be provided")
+        
+        elif level == "adm1":
+            for column in (country_col, state_col):
+                if column not in df.columns:
+                    raise HTTPException(400, detail=f"missing '{column}' for adm1 name join.")
+            left = gdf.copy()
+            right = df.copy()
+            left["state_norm"] = normalize(left["name"])
+            right["state_norm"] = normalize(right[state_col])
+            merged = left.merge(right[[country_col, state_col, "state_norm", *values]], on="state_norm", how="inner")
+            return merged
+        
+        elif level == "adm2":
+            # Require county name; recommend country_iso3 to pre-filter base
+            if county_col not in df.columns:
+                raise HTTPException(400, detail=f"missing '{county_col}' for adm2 name join")
+            left = gdf.copy()
+            right = df.copy()
+            left["county_norm"] = normalize(left["name"])
+            right["county_norm"] = normalize(right[county_col])
+            merged = left.merge(right[[county_col, "county_norm", *values]],
+                                on="county_norm", how="inner")
+            return merged
+        
+        else:
+            raise HTTPException(400, detail="Invalid Level")
+    
+    elif join_by == "point":
+        if lon_col not in df.columns or lat_col not in df.columns:
+            raise HTTPException(400, detail=f"join_by=point required '{lon_col}'")
+        
+        if gdf.crs is None or gdf.crs.to_epsg() != 4326:
+            gdf = gdf.to_crs(epsg=4326)
+        
+        points = gpd.GeoDataFrame(df[[lon_col, lat_col, *values]].copy(), geometry=gpd.points_from_xy(df[lon_col], df[lat_col], crs="EPSG:4326"))
+        spatial_join = gpd.sjoin(points, gdf[["code", "name", "geometry"]], predicate="within", how="inner")
+        agg = spatial_join.groupby("code", as_index=False)[values].mean()
+        merged = gdf.merge(agg, on="code", how="inner")
+        return merged
+    
+    else:
+        raise HTTPException(400, detail="join_by must be one of: code, name or point")
+        
+def local_moran(
+    gdf: GeoDataFrame,
+    variable: str,
+    *,
+    wtype: str = "queen",
+    k: int | None = None,
+    perm: int = 999,
+    alpha: float = 0.05,
+    gas: bool = False
+):
+    if gdf.crs is None:
+        gdf = gdf.set_crs(4326)
+    else:
+        gdf = gdf.to_crs(4326)   
+    
+    gdf = gdf.copy()
+    gdf["geometry"] = gdf.geometry.buffer(0)
+    y = pd.to_numeric(gdf[variable], errors="coerce")
+    mask = y.notna()
+    if mask.sum() < 5:
+        if not gas:
+            raise ValueError("Not enough valid numeric values (>=5 required)")
+        else:
+            print("Not enough valid numeric values (>=5 required), SKIPPING")
+            return False
+    sub = gdf.loc[mask].copy()
+    y_sub = y.loc[mask].to_numpy()
+    
+    try:
+        # weights & LISA
+        w = cached_weights(sub, wtype, k) if "code" in sub.columns else assign_weights(sub, wtype, k)
+        lisa = Moran_Local(y_sub, w, permutations=perm)
+        
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+
+    # attach results back
+    out = gdf.copy()
+    out["local_I"] = np.nan
+    out["p_value"] = np.nan
+    out.loc[mask, "local_I"] = lisa.Is
+    out.loc[mask, "p_value"] = lisa.p_sim
+
+    # cluster labels (1=HH, 2=LH, 3=LL, 4=HL), only when significant
+    q_series = pd.Series(lisa.q, index=sub.index)
+    label_map = {1: "HH", 2: "LH", 3: "LL", 4: "HL"}
+    labels = np.full(len(out), "Not Significant", dtype=object)
+    sig_idx = out.index[(out["p_value"] < alpha) & mask]
+    if len(sig_idx):
+        mapped = q_series.reindex(sig_idx).map(label_map).fillna("Not Significant")
+        pos = out.index.get_indexer(sig_idx)
+        labels[pos] = mapped
+    out["cluster_label"] = labels
+
+    return out
+
+
+@lru_cache(maxsize=8)
+def _read_boundaries(path: str, level: str, mtime: float) -> GeoDataFrame:
+    gdf = gpd.read_file(path)
+    mapping = COLUMN_MAPPINGS[level]
+    gdf = gdf.rename(columns={mapping["code"]: "code", mapping["name"]: "name"})
+    if gdf.crs is None:
+        gdf.set_crs(4326, inplace=True)
+    else:
+        gdf = gdf.to_crs(4326)
+    gdf["geometry"] = gdf.geometry.buffer(0)
+    return gdf
+
+
+def load_boundaries(path: str, level: str) -> GeoDataFrame:
+    """
+    Polygons of a geopackage with code/name columns, in EPSG:4326 and repaired.
+    Read once per process and file version; callers get their own copy.
+    """
+    return _read_boundaries(path, level, os.path.getmtime(path)).copy()
+
+
+def lisa_layer(
+    df: DataFrame,
+    boundaries: GeoDataFrame,
+    level: str,
+    variable: str,
+    *,
+    join_by: str = "name",
+    join_key: str | None = None,
+    country_col: str = "Country",
+    state_col: str = "State",
+    county_col: str | None = None,
+    wtype: str = "queen",
+    k: int | None = None,
+    perm: int = 999,
+    alpha: float = 0.05,
+    simplify_tol: float | None = 0.01,
+    gas: bool = False,
+    carry: tuple[str, ...] = (),
+) -> GeoDataFrame | None:
+    """
+    Join a dataset onto boundaries and run Local Moran's I for one variable.
+    Returns the layer with name renamed to the level's alias, or None when
+    a gas variable has too few values to analyse. `carry` columns of df are
+    kept on the layer as they are.
+    """
+    # join user data onto polygons
+    try:
+        merged = join_layers(
+            gdf=boundaries, df=df, level=level, variable=variable,
+            join_by=join_by, join_key=join_key, country_iso3=None,
+            country_col=country_col, state_col=state_col, county_col=county_col,
+            lon_col=None, lat_col=None, carry=carry
+        )
+    except ValueError as ve:
+        raise HTTPException(400, detail=str(ve))
+
+    try:
+        result = local_moran(
+            merged, variable,
+            wtype=wtype, k=k, perm=perm, alpha=alpha,
+            gas=gas
+        )
+    except ValueError as ve:
+        raise HTTPException(400, detail=str(ve))
+
+    if result is False:
+        return None
+    # optional simplify for web payload
+    if simplify_tol:
+        result["geometry"] = result.geometry.simplify(simplify_tol, preserve_topology=True)
+
+    # rename name -> alias (country/state/county) for output
+    return result.rename(columns={"name": COLUMN_MAPPINGS[level]["alias"]})
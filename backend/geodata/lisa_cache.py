@@ -0,0 +1,50 @@
+import hashlib
+import json
+
+
+def lisa_cache_key(content_hash: str, params: dict) -> str:
+    """Key for one /lisa run: the dataset's content hash plus every analysis/join option."""
+    payload = json.dumps({"content_hash": content_hash, **params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_cached(cur, cache_key: str, ttl_seconds: int) -> str | None:
+    """Stored GeoJSON text for a key if it hasn't expired; marks the entry as recently used."""
+    cur.execute(
+        """
+        UPDATE lisa_cache SET accessed_time = now()
+        WHERE cache_key = %s AND created_time > now() - %s * interval '1 second'
+        RETURNING result
+        """,
+        (cache_key, ttl_seconds))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def store_cached(
+    cur,
+    cache_key: str,
+    content_hash: str,
+    params: dict,
+    result: str,
+    ttl_seconds: int,
+    max_entries: int,
+):
+    """Upsert a result, then drop expired entries and the least recently used beyond max_entries."""
+    cur.execute(
+        """
+        INSERT INTO lisa_cache (cache_key, content_hash, params, result)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (cache_key) DO UPDATE
+          SET result = EXCLUDED.result,
+              created_time = now(),
+              accessed_time = now()
+        """,
+        (cache_key, content_hash, json.dumps(params, default=str), result))
+    cur.execute(
+        """
+        DELETE FROM lisa_cache
+        WHERE created_time <= now() - %s * interval '1 second'
+           OR cache_key IN (SELECT cache_key FROM lisa_cache ORDER BY accessed_time DESC OFFSET %s)
+        """,
+        (ttl_seconds, max_entries))
@@ -0,0 +1,103 @@
+import json
+
+
+def enqueue_tasks(cur, tasks: list[tuple[str, int, str, dict]], max_attempts: int = 3) -> int:
+    """
+    Queue (level, year, variable, params) layer tasks. A task already queued for
+    the same layer is reset to pending with the new params unless a worker is
+    running it. Returns how many tasks were (re)queued.
+    """
+    if not tasks:
+        return 0
+    cur.execute("""
+        INSERT INTO geo_tasks (level, year, variable, params, max_attempts)
+        SELECT * FROM unnest(%s::varchar[], %s::int[], %s::varchar[], %s::jsonb[], %s::int[])
+        ON CONFLICT (level, variable, year) DO UPDATE
+          SET params = EXCLUDED.params, max_attempts = EXCLUDED.max_attempts,
+              status = 'pending', attempts = 0, worker = NULL, heartbeat_time = NULL,
+              last_error = NULL, updated_time = now()
+          WHERE geo_tasks.status <> 'running'
+        RETURNING task_id
+    """, (
+        [level for level, _, _, _ in tasks],
+        [int(year) for _, year, _, _ in tasks],
+        [variable for _, _, variable, _ in tasks],
+        [json.dumps(params) for _, _, _, params in tasks],
+        [max_attempts] * len(tasks),
+    ))
+    return len(cur.fetchall())
+
+
+def claim_task(cur, worker: str, stale_seconds: int) -> dict | None:
+    """
+    Claim the oldest pending task, or a running one whose worker stopped
+    heartbeating for stale_seconds. Concurrent claimers skip each other's rows.
+    Stale tasks that are out of attempts are marked failed instead.
+    """
+    cur.execute("""
+        UPDATE geo_tasks SET status = 'failed', worker = NULL, last_error = 'worker stopped heartbeating',
+               updated_time = now()
+        WHERE status = 'running' AND attempts >= max_attempts
+          AND heartbeat_time < now() - %s * interval '1 second'
+    """, (stale_seconds,))
+    cur.execute("""
+        WITH next AS (
+            SELECT task_id FROM geo_tasks
+            WHERE attempts < max_attempts
+              AND (status = 'pending'
+                   OR (status = 'running' AND heartbeat_time < now() - %s * interval '1 second'))
+            ORDER BY task_id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        UPDATE geo_tasks t
+        SET status = 'running', worker = %s, attempts = t.attempts + 1,
+            heartbeat_time = now(), updated_time = now()
+        FROM next WHERE t.task_id = next.task_id
+        RETURNING t.task_id, t.level, t.year, t.variable, t.params, t.attempts
+    """, (stale_seconds, worker))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    task_id, level, year, variable, params, attempts = row
+    return {"task_id": task_id, "level": level, "year": year, "variable": variable,
+            "params": params, "attempts": attempts}
+
+
+def heartbeat(cur, task_id: int, worker: str) -> bool:
+    """Extend a claim; False when the task was taken over by another worker."""
+    cur.execute("""
+        UPDATE geo_tasks SET heartbeat_time = now()
+        WHERE task_id = %s AND worker = %s AND status = 'running'
+        RETURNING task_id
+    """, (task_id, worker))
+    return cur.fetchone() is not None
+
+
+def finish_task(cur, task_id: int, worker: str, status: str) -> bool:
+    """
+    Mark a claimed task done/skipped, locking its row. Call first in the
+    transaction that stores the result: False means the claim was lost and the
+    transaction should be rolled back.
+    """
+    cur.execute("""
+        UPDATE geo_tasks SET status = %s, heartbeat_time = NULL, last_error = NULL, updated_time = now()
+        WHERE task_id = %s AND worker = %s AND status = 'running'
+        RETURNING task_id
+    """, (status, task_id, worker))
+    return cur.fetchone() is not None
+
+
+def fail_task(cur, task_id: int, worker: str, error: str):
+    """Release a claimed task after an error: back to pending while attempts remain."""
+    cur.execute("""
+        UPDATE geo_tasks
+        SET status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END,
+            worker = NULL, heartbeat_time = NULL, last_error = %s, updated_time = now()
+        WHERE task_id = %s AND worker = %s AND status = 'running'
+    """, (error, task_id, worker))
+
+
+def task_counts(cur) -> dict:
+    cur.execute("SELECT status, count(*) FROM geo_tasks GROUP BY status")
+    return dict(cur.fetchall())
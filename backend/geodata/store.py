@@ -0,0 +1,199 @@
+import json
+import math
+from geopandas import GeoDataFrame
+from psycopg2.extras import Json, execute_values
+from shapely.geometry import mapping
+
+
+# Historical layers are written as "Asthma Prevalence%", forecasts as "Predicted Asthma Prevalence %".
+# Observed data wins when a year has both.
+ASTHMA_VARIABLES = ("Asthma Prevalence%", "Predicted Asthma Prevalence %")
+GAS_VARIABLES = ("Avg CO2", "Avg NO2", "Avg Ozone", "Avg PM10", "Avg PM2.5", "Avg SO2")
+
+# NOTIFY channel announcing stored layers as [level, year, variable] payloads, so
+# processes caching layers (the API) hear about writes made by other processes
+LAYER_CHANNEL = "geo_layers"
+
+
+def _number(value):
+    if value is None:
+        return None
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def with_geometry(result: GeoDataFrame) -> GeoDataFrame:
+    """
+    Rows of a LISA result that have a non-empty geometry. Both row builders use
+    it, so no attribute row references a boundary that was never written.
+    """
+    keep = ~(result.geometry.is_empty | result.geometry.isna())
+    return result if keep.all() else result[keep]
+
+
+def boundary_rows(result: GeoDataFrame, level: str, alias: str) -> list[tuple]:
+    """(level, code, name, geometry, bbox) rows for geo_boundaries from a LISA result."""
+    result = with_geometry(result)
+    return [
+        (level, str(code), name, Json(mapping(geom)), "({2},{3}),({0},{1})".format(*geom.bounds))
+        for code, name, geom in zip(result["code"], result[alias], result.geometry)
+    ]
+
+
+def attribute_rows(result: GeoDataFrame, level: str, year: int, variable: str) -> list[tuple]:
+    """
+    (level, code, year, variable, value, local_I, p_value, cluster_label, value_lower, value_upper)
+    rows for geo_attributes; the interval bounds are NULL unless the layer carries them.
+    Rows without geometry are left out, as in boundary_rows.
+    """
+    result = with_geometry(result)
+    missing = [None] * len(result)
+    lower = result["value_lower"] if "value_lower" in result.columns else missing
+    upper = result["value_upper"] if "value_upper" in result.columns else missing
+    return [
+        (level, str(code), int(year), variable, _number(value), _number(local_i), _number(p_value), label,
+         _number(low), _number(high))
+        for code, value, local_i, p_value, label, low, high in zip(
+            result["code"], result[variable], result["local_I"], result["p_value"], result["cluster_label"],
+            lower, upper
+        )
+    ]
+
+
+class GeodataWriter:
+    """
+    Buffers LISA layers and stores them in one round trip per table: a single
+    execute_values INSERT for all boundaries and one for all attribute rows,
+    keyed on geo_attributes' natural key (level, variable, year, code).
+
+    Layers added with replace=True supersede whatever is stored for their
+    (level, variable, year); the others are only written when not stored yet.
+    Flush inside the caller's transaction; every changed layer is announced on
+    LAYER_CHANNEL when it commits.
+    """
+
+    def __init__(self, level: str, alias: str):
+        self.level = level
+        self.alias = alias
+        self._layers: dict[tuple[str, int], tuple[GeoDataFrame, bool]] = {}
+
+    def __len__(self):
+        return len(self._layers)
+
+    def add(self, result: GeoDataFrame, year: int, variable: str, replace: bool = False):
+        self._layers[(variable, int(year))] = (result, replace)
+
+    def flush(self, cur) -> list[tuple[int, str]]:
+        """Write the buffered layers; returns the (year, variable) keys that were stored."""
+        if not self._layers:
+            return []
+        boundaries, attributes, replaced = {}, [], []
+        for (variable, year), (result, replace) in self._layers.items():
+            for row in boundary_rows(result, self.level, self.alias):
+                boundaries.setdefault(row[1], row)
+            attributes.extend(attribute_rows(result, self.level, year, variable))
+            if replace:
+                replaced.append((variable, year))
+        self._layers.clear()
+
+        execute_values(cur, """
+            INSERT INTO geo_boundaries (level, code, name, geometry, bbox) VALUES %s
+            ON CONFLICT (level, code) DO NOTHING
+        """, list(boundaries.values()), page_size=max(len(boundaries), 1))
+        if replaced:
+            cur.execute("""
+                DELETE FROM geo_attributes a
+                USING unnest(%s::text[], %s::int[]) AS k(variable, year)
+                WHERE a.level = %s AND a.variable = k.variable AND a.year = k.year
+            """, ([v for v, _ in replaced], [y for _, y in replaced], self.level))
+        stored = execute_values(cur, """
+            INSERT INTO geo_attributes
+              (level, code, year, variable, value, local_I, p_value, cluster_label, value_lower, value_upper) VALUES %s
+            ON CONFLICT (level, variable, year, code) DO NOTHING
+            RETURNING year, variable
+        """, attributes, page_size=max(len(attributes), 1), fetch=True)
+        stored = sorted(set(stored))
+        notify_layers(cur, self.level, sorted(set(stored) | {(year, variable) for variable, year in replaced}))
+        return stored
+
+
+def notify_layers(cur, level: str, keys: list[tuple[int, str]]):
+    """NOTIFY LAYER_CHANNEL of changed (year, variable) layers; delivered when the transaction commits."""
+    if keys:
+        cur.execute("SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+                    (LAYER_CHANNEL, [json.dumps([level, int(year), variable]) for year, variable in keys]))
+
+
+def record_sources(cur, level: str, sources: list[tuple[int, str, str]]):
+    """Remember which source data layers were computed from: (year, variable, source_hash) rows."""
+    execute_values(cur, """
+        INSERT INTO geo_sources (level, year, variable, source_hash) VALUES %s
+        ON CONFLICT (level, variable, year) DO UPDATE
+          SET source_hash = EXCLUDED.source_hash, updated_time = now()
+    """, [(level, int(year), variable, source_hash) for year, variable, source_hash in sources],
+        page_size=max(len(sources), 1))
+
+
+def assemble_collection(rows: list[tuple], alias: str, variable: str) -> dict:
+    """
+    Rebuild the GeoJSON FeatureCollection the dashboard expects from
+    (code, name, geometry, value, local_I, p_value, cluster_label, value_lower, value_upper)
+    rows. Interval bounds are only included for layers that have them.
+    """
+    features = []
+    for i, (code, name, geometry, value, local_i, p_value, label, lower, upper) in enumerate(rows):
+        properties = {
+            "code": code,
+            alias: name,
+            variable: value,
+            "local_I": local_i,
+            "p_value": p_value,
+            "cluster_label": label,
+        }
+        if lower is not None or upper is not None:
+            properties["value_lower"], properties["value_upper"] = lower, upper
+        features.append({
+            "id": str(i),
+            "type": "Feature",
+            "properties": properties,
+            "geometry": geometry,
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def layer_filters(
+    cluster_labels: list[str] | None = None,
+    p_max: float | None = None,
+    codes: list[str] | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+) -> tuple[str, dict]:
+    """
+    Extra WHERE clauses (over geo_attributes a JOIN geo_boundaries b) for the dashboard
+    filters, plus their named parameters. bbox is (minx, miny, maxx, maxy) in EPSG:4326.
+    """
+    clauses, params = [], {}
+    if cluster_labels:
+        clauses.append("a.cluster_label = ANY(%(cluster_labels)s)")
+        params["cluster_labels"] = list(cluster_labels)
+    if p_max is not None:
+        clauses.append("a.p_value <= %(p_max)s")
+        params["p_max"] = p_max
+    if codes:
+        clauses.append("a.code = ANY(%(codes)s)")
+        params["codes"] = list(codes)
+    if bbox is not None:
+        clauses.append("b.bbox && box(point(%(minx)s, %(miny)s), point(%(maxx)s, %(maxy)s))")
+        params.update(zip(("minx", "miny", "maxx", "maxy"), bbox))
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+def layer_query(filters: str = "") -> str:
+    """One layer's rows for assemble_collection; takes level/year/variable named params."""
+    return """
+        SELECT a.code, b.name, b.geometry, a.value, a.local_I, a.p_value, a.cluster_label,
+               a.value_lower, a.value_upper
+        FROM geo_attributes a
+        JOIN geo_boundaries b ON b.level = a.level AND b.code = a.code
+        WHERE a.level = %(level)s AND a.year = %(year)s AND a.variable = %(variable)s""" + filters + """
+        ORDER BY a.code
+    """
@@ -0,0 +1,186 @@
+"""
+Geodata backfill worker: claims layer tasks from the geo_tasks queue and stores
+their LISA results. Run any number of these, on any host that shares the
+database and the repo's data files:
+
+    python -m backend.geodata.worker --processes 4
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from functools import lru_cache
+import pandas as pd
+import psycopg2
+from pandas import DataFrame
+
+from backend.db import get_db_connection
+from backend.geodata.fill import source_hash
+from backend.geodata.lisa import COLUMN_MAPPINGS, load_boundaries, lisa_layer
+from backend.geodata.queue import claim_task, heartbeat, finish_task, fail_task
+from backend.geodata.store import GeodataWriter, record_sources
+
+
+@lru_cache(maxsize=4)
+def _read_csv(path: str, mtime: float) -> DataFrame:
+    return pd.read_csv(path)
+
+
+def read_task_source(params: dict, year: int, variable: str) -> DataFrame:
+    """
+    A task's input rows: params["source"] CSV, narrowed to `year` when
+    params["year_column"] is set, with a constant params["country"] column
+    when the file has none.
+    """
+    df = _read_csv(params["source"], os.path.getmtime(params["source"]))
+    if params.get("year_column"):
+        df = df[pd.to_numeric(df[params["year_column"]], errors="coerce") == int(year)]
+    country_col, state_col = params.get("country_col", "Country"), params.get("state_col", "State")
+    df = df.copy()
+    if params.get("country"):
+        df[country_col] = params["country"]
+    return df[[country_col, state_col, variable]]
+
+
+class _Heartbeat(threading.Thread):
+    """Keeps a claim alive on its own connection while the task computes."""
+
+    def __init__(self, task_id: int, worker: str, interval: float):
+        super().__init__(daemon=True)
+        self.task_id, self.worker, self.interval = task_id, worker, interval
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        conn = get_db_connection()
+        try:
+            while not self.stopped.wait(self.interval):
+                with conn, conn.cursor() as cur:
+                    if not heartbeat(cur, self.task_id, self.worker):
+                        self.lost = True
+                        return
+        finally:
+            conn.close()
+
+
+def _error_text(e: Exception) -> str:
+    return f"{type(e).__name__}: {getattr(e, 'detail', None) or e}"
+
+
+def run_task(conn, task: dict, worker: str, heartbeat_seconds: float) -> str:
+    """
+    Compute and store one claimed task. Returns its final status. Errors while
+    computing or storing release the task through fail_task (retried while
+    attempts remain) instead of escaping.
+    """
+    beat = _Heartbeat(task["task_id"], worker, heartbeat_seconds)
+    beat.start()
+    try:
+        params, level = task["params"], task["level"]
+        df = read_task_source(params, task["year"], task["variable"])
+        layer = lisa_layer(
+            df, load_boundaries(params["boundaries"], level), level, task["variable"],
+            country_col=params.get("country_col", "Country"), state_col=params.get("state_col", "State"),
+            perm=params.get("perm", 999), gas=params.get("gas", False),
+        )
+    except Exception as e:
+        beat.stopped.set()
+        with conn, conn.cursor() as cur:
+            fail_task(cur, task["task_id"], worker, _error_text(e))
+        return "failed"
+    finally:
+        beat.stopped.set()
+        beat.join()
+
+    status = "skipped" if layer is None else "done"
+    try:
+        with conn, conn.cursor() as cur:
+            if beat.lost or not finish_task(cur, task["task_id"], worker, status):
+                conn.rollback()
+                return "lost"
+            writer = GeodataWriter(level, COLUMN_MAPPINGS[level]["alias"])
+            if layer is not None:
+                writer.add(layer, task["year"], task["variable"], replace=True)
+            writer.flush(cur)
+            record_sources(cur, level, [(task["year"], task["variable"], source_hash(df))])
+    except Exception as e:
+        # `with conn` rolled the write (and finish_task) back; the claim is still ours
+        with conn, conn.cursor() as cur:
+            fail_task(cur, task["task_id"], worker, _error_text(e))
+        return "failed"
+    return status
+
+
+def work(
+    stale_seconds: int = 300,
+    heartbeat_seconds: float = 30,
+    poll_seconds: float = 0,
+    max_tasks: int | None = None,
+) -> dict:
+    """
+    Claim and run tasks until the queue is empty (or keep polling every
+    poll_seconds when > 0). Returns a count per final status.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    counts = {}
+    done = 0
+    conn = get_db_connection()
+    try:
+        while max_tasks is None or done < max_tasks:
+            with conn, conn.cursor() as cur:
+                task = claim_task(cur, worker, stale_seconds)
+            if task is None:
+                if poll_seconds > 0:
+                    time.sleep(poll_seconds)
+                    continue
+                break
+            try:
+                status = run_task(conn, task, worker, heartbeat_seconds)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                # connection lost mid-task: the claim goes stale and is retried elsewhere
+                print(f"[{worker}] lost database connection: {e}")
+                conn.close()
+                conn = get_db_connection()
+                status = "lost"
+            counts[status] = counts.get(status, 0) + 1
+            done += 1
+            print(f"[{worker}] {task['level']} {task['year']} {task['variable']}: {status}")
+    finally:
+        conn.close()
+    return counts
+
+
+def _work(kwargs: dict) -> dict:
+    return work(**kwargs)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Run geo_tasks backfill workers")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes on this host")
+    parser.add_argument("--stale-after", type=int, default=300,
+                        help="seconds without a heartbeat before a claim may be taken over")
+    parser.add_argument("--heartbeat", type=float, default=30, help="seconds between heartbeats")
+    parser.add_argument("--poll", type=float, default=0,
+                        help="keep polling an empty queue every N seconds (0 = exit when empty)")
+    parser.add_argument("--max-tasks", type=int, default=None, help="stop each process after N tasks")
+    args = parser.parse_args(argv)
+
+    kwargs = {"stale_seconds": args.stale_after, "heartbeat_seconds": args.heartbeat,
+              "poll_seconds": args.poll, "max_tasks": args.max_tasks}
+    if args.processes <= 1:
+        results = [work(**kwargs)]
+    else:
+        with multiprocessing.get_context("spawn").Pool(args.processes) as pool:
+            results = pool.map(_work, [kwargs] * args.processes)
+    totals = {}
+    for counts in results:
+        for status, n in counts.items():
+            totals[status] = totals.get(status, 0) + n
+    print(f"Finished: {totals}")
+
+
+if __name__ == "__main__":
+    main()
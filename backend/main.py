@@ -1,4 +1,4 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Path, Form, Response
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Path, Form, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
 import fiona
 import psycopg2
@@ -7,14 +7,13 @@ from fastapi.responses import JSONResponse
 import pandas as pd
 from pandas import DataFrame
 import geopandas as gpd
-from libpysal.weights import Queen, Rook, KNN
-from esda.moran import Moran, Moran_Local
 from geopandas import GeoDataFrame
 import numpy as np
 from numpy.typing import NDArray
-import io, json, os, unicodedata
+import io, json, os, hashlib, threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path as pt
-from dotenv import load_dotenv
 
 
 # Import Machine Learning functions
@@ -29,9 +28,35 @@ from backend.machine_learning.extra_trees import run_extra_trees_regressor
 from backend.machine_learning.elastic_net import run_elastic_net_regression
 
 # Import forecasting functions
-from backend.training.forecasting import run_forecast
-
-app = FastAPI()
+from backend.training.forecasting import iter_forecast, forecast_source_hash, INTERVAL_COLUMNS, FORECAST_LEVELS
+from backend.training.scenarios import parse_scenarios, run_scenarios
+
+# Import database and dataset storage helpers
+from backend.db import get_db_connection
+from backend.datasets.columnar import parse_upload, to_parquet_bytes, read_columnar, select_columns, PARQUET_ERRORS
+from backend.datasets.relational import table_name_for, infer_schema, ingest_table, drop_table, read_table, aggregate_table
+from backend.datasets.profile import build_profile
+from backend.datasets.cache import DatasetCache
+from backend.geodata.bulk import pack_layers
+from backend.geodata.lisa_cache import lisa_cache_key, get_cached, store_cached
+from backend.geodata.layer_cache import LayerCache, layer_key, listen_for_invalidations
+from backend.geodata.fill import FillTask, source_hash, run_fill
+from backend.geodata.queue import enqueue_tasks, task_counts
+from backend.geodata.lisa import COLUMN_MAPPINGS, join_layers, local_moran, load_boundaries, lisa_layer, normalize
+from backend.geodata.store import ASTHMA_VARIABLES, GAS_VARIABLES, GeodataWriter, record_sources, assemble_collection, layer_filters, layer_query
+from backend.datasets.row_index import build_row_index, window_blocks, read_csv_window, read_xlsx_window, read_parquet_window
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_dashboard_cache()
+    # drop cached dashboard layers as soon as any process (e.g. a geodata worker) rewrites them
+    stop = threading.Event()
+    threading.Thread(target=listen_for_invalidations, args=(DASHBOARD_CACHE, stop), daemon=True).start()
+    yield
+    stop.set()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],  # frontend URL
@@ -48,387 +73,175 @@ GPKG_PATHS = {
     "adm2": "backend/geopackages/adm2.gpkg"  # County level
 }
 
-COLUMN_MAPPINGS = {
-    "adm0": {"code": "shapeGroup", "name": "shapeName", "alias": "country"},
-    "adm1": {"code": "shapeID", "name": "shapeName", "alias": "state"},
-    "adm2": {"code": "shapeID", "name": "shapeName", "alias": "county"}
-}
-
-
-def assign_weights(gdf: GeoDataFrame, wtype: str, k: int | None):
-    wtype = wtype.lower()
-    if wtype == "queen":
-        w = Queen.from_dataframe(gdf)
-        
-    elif wtype == "rook":
-        w = Rook.from_dataframe(gdf)
-        
-    elif wtype == "knn":
-        if k is None:
-            raise ValueError("k can't be None for weight type knn")
-        cent = gdf.geometry.representative_point()
-        w = KNN.from_dataframe(gdf.set_geometry(cent), k=k, use_index=True)
-        
-    else:
-        raise HTTPException(status_code=400, detail=f"Unsupported weight type: {wtype}")
-    w.transform = "R" # pyright: ignore[reportAttributeAccessIssue]
-    
-    if getattr(w, 'islands', None):
-        pass
-    return w
-
-def normalize(s: pd.Series):
-    # ascii-fold
-    def fold(x):
-        if pd.isna(x):
-            x = ""
-        else:
-            x = str(x)
-        x = unicodedata.normalize("NFKD", x)
-        chars =[]
-        for char in x:
-            if not unicodedata.combining(char):
-                chars.append(char)
-        x = "".join(chars)
-        return x.lower()
-    output = s.map(fold).str.replace(r"[^a-z0-9]+",  " ", regex=True).str.strip()
-    return output
-
-
-def join_layers(
-    df: DataFrame,
-    gdf: GeoDataFrame,
-    level: str,
-    variable: str,
-    *,
-    join_by: str = "code",
-    join_key: str | None = None,
-    country_iso3: str | None = None,
-    country_col: str | None = "country",
-    state_col: str | None = "state",
-    county_col: str | None = "county",
-    lon_col: str | None = "lon",
-    lat_col: str | None = "lat",
-    ):
-    
-    if country_iso3:
-        if "iso_a3" in gdf.columns:
-            gdf = gdf[gdf["iso_a3"].astype(str).str.upper() == country_iso3.upper()].copy()
-        elif "shapeGroup" in gdf.columns:
-            gdf = gdf[gdf["shapeGroup"].astype(str).str.upper() == country_iso3.upper()].copy()
-    
-    
-    if join_by == "code":
-        if not join_key or join_key not in df.columns:
-            raise HTTPException(400, detail=f"join_by code required join_key to be in the uploaded file")
-        temp = df.copy()
-        temp["code"] = temp[join_key].astype(str).str.strip()
-        merged = gdf.merge(temp[["code", variable]], on="code", how="inner")
-        return merged
-    
-    elif join_by == "name":
-        if level == "adm0":
-            if country_col in df.columns:
-                left = gdf.copy()
-                right = df.copy()
-                left["name_norm"] = normalize(left["name"])
-                right["name_norm"] = normalize(right[country_col])
-                merged = left.merge(right[[country_col, "name_norm", variable]], on="name_norm", how="inner")
-                return merged
-            else:
-                raise HTTPException(400, detail="for join_by=adm0, country name column must be provided")
-        
-        elif level == "adm1":
-            for column in (country_col, state_col):
-                if column not in df.columns:
-                    raise HTTPException(400, detail=f"missing '{column}' for adm1 name join.")
-            left = gdf.copy()
-            right = df.copy()
-            left["state_norm"] = normalize(left["name"])
-            right["state_norm"] = normalize(right[state_col])
-            merged = left.merge(right[[country_col, state_col, "state_norm", variable]], on="state_norm", how="inner")
-            return merged
-        
-        elif level == "adm2":
-            # Require county name; recommend country_iso3 to pre-filter base
-            if county_col not in df.columns:
-                raise HTTPException(400, detail=f"missing '{county_col}' for adm2 name join")
-            left = gdf.copy()
-            right = df.copy()
-            left["county_norm"] = normalize(left["name"])
-            right["county_norm"] = normalize(right[county_col])
-            merged = left.merge(right[[county_col, "county_norm", variable]],
-                                on="county_norm", how="inner")
-            return merged
-        
-        else:
-            raise HTTPException(400, detail="Invalid Level")
-    
-    elif join_by == "point":
-        if lon_col not in df.columns or lat_col not in df.columns:
-            raise HTTPException(400, detail=f"join_by=point required '{lon_col}'")
-        
-        if gdf.crs is None or gdf.crs.to_epsg() != 4326:
-            gdf = gdf.to_crs(epsg=4326)
-        
-        points = gpd.GeoDataFrame(df[[lon_col, lat_col, variable]].copy(), geometry=gpd.points_from_xy(df[lon_col], df[lat_col], crs="EPSG:4326"))
-        spatial_join = gpd.sjoin(points, gdf[["code", "name", "geometry"]], predicate="within", how="inner")
-        agg = spatial_join.groupby("code", as_index=False)[variable].mean()
-        merged = gdf.merge(agg, on="code", how="inner")
-        return merged
-    
-    else:
-        raise HTTPException(400, detail="join_by must be one of: code, name or point")
-        
-def local_moran(
-    gdf: GeoDataFrame,
-    variable: str,
-    *,
-    wtype: str = "queen",
-    k: int | None = None,
-    perm: int = 999,
-    alpha: float = 0.05,
-    gas: bool = False
-):
-    if gdf.crs is None:
-        gdf = gdf.set_crs(4326)
-    else:
-        gdf = gdf.to_crs(4326)   
-    
-    gdf = gdf.copy()
-    gdf["geometry"] = gdf.geometry.buffer(0)
-    y = pd.to_numeric(gdf[variable], errors="coerce")
-    mask = y.notna()
-    if mask.sum() < 5:
-        if not gas:
-            raise ValueError("Not enough valid numeric values (>=5 required)")
-        else:
-            print("Not enough valid numeric values (>=5 required), SKIPPING")
-            return False
-    sub = gdf.loc[mask].copy()
-    y_sub = y.loc[mask].to_numpy()
-    
-    try:
-        # weights & LISA
-        w = assign_weights(sub, wtype, k)
-        lisa = Moran_Local(y_sub, w, permutations=perm)
-        
-    except ValueError as e:
-        raise HTTPException(400, detail=str(e))
-
-    # attach results back
-    out = gdf.copy()
-    out["local_I"] = np.nan
-    out["p_value"] = np.nan
-    out.loc[mask, "local_I"] = lisa.Is
-    out.loc[mask, "p_value"] = lisa.p_sim
-
-    # cluster labels (1=HH, 2=LH, 3=LL, 4=HL), only when significant
-    q_series = pd.Series(lisa.q, index=sub.index)
-    label_map = {1: "HH", 2: "LH", 3: "LL", 4: "HL"}
-    labels = np.full(len(out), "Not Significant", dtype=object)
-    sig_idx = out.index[(out["p_value"] < alpha) & mask]
-    if len(sig_idx):
-        mapped = q_series.reindex(sig_idx).map(label_map).fillna("Not Significant")
-        pos = out.index.get_indexer(sig_idx)
-        labels[pos] = mapped
-    out["cluster_label"] = labels
-
-    return out
-
-def upsert_cache(cache_id: int, cache_name: str, geojson_obj: dict):
-    conn = get_db_connection()
-    try:
-        with conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO cache (cache_id, cache_name, cache_data)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (cache_id) DO UPDATE
-                  SET cache_name = EXCLUDED.cache_name,
-                      cache_data = EXCLUDED.cache_data,
-                      updated_time = now();
-                """,
-                (cache_id, cache_name, Json(geojson_obj))
-            )
-    finally:
-        conn.close()
-
-def upload_asthmageo_data(year: int, geojson_obj: dict):
-    conn = get_db_connection()
-    try:
-        with conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO asthma_geodata (asthmageo_id, asthmageo_name, asthmageo_data)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (asthmageo_id) DO NOTHING
-                RETURNING asthmageo_id;
-                """,
-                (year, f"asthma_forecast_{year}", Json(geojson_obj)),
-            )
-            inserted = cur.fetchone()  # None if DO NOTHING triggered
-            print(f"Saved: {year}")
-            return bool(inserted)  # True = saved, False = already existed
-    finally:
-        conn.close()
-        
-def upload_gasgeo_data(year: int, var: str, geojson_obj: dict):
+def flush_geo_layers(writer: GeodataWriter, sources: list[tuple[int, str, str]] | None = None) -> list[tuple[int, str]]:
+    """Flush buffered layers (and their source hashes) in one transaction; returns the stored keys."""
     conn = get_db_connection()
     try:
         with conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO gas_geodata (gasgeo_year, gasgeo_name, gasgeo_data)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (gasgeo_id) DO NOTHING
-                RETURNING gasgeo_id;
-                """,
-                (year, var, Json(geojson_obj)),
-            )
-            inserted = cur.fetchone()  # None if DO NOTHING triggered
-            print(f"Saved: {var}-{year}")
-            return bool(inserted)  # True = saved, False = already existed
+            stored = writer.flush(cur)
+            if sources:
+                record_sources(cur, writer.level, sources)
     finally:
         conn.close()
-        
-def run_lisa_forecast(
-    df: DataFrame,
-    year: int,
-    level: str= "adm1",
-    variable: str ="Predicted Asthma Prevalence %",
-    # join options
-    join_by: str = "name",
-    country_col: str = "Country",
-    state_col: str = "State",
-    # analysis options
-    wtype: str = "queen",
-    k: int | None = None,
-    perm: int = 999,
-    alpha: float =0.05,
-    simplify_tol: float | None = 0.01,
-    asthma: bool = True,
-    gas: bool = False
-):
-    
-
-    gdf = gpd.read_file(GPKG_PATHS[level])
-    mapping = COLUMN_MAPPINGS[level]
-    bcode, bname, alias = mapping["code"], mapping["name"], mapping["alias"]
-    gdf = gdf.rename(columns={bcode: "code", bname: "name"})
-
-    if gdf.crs is None:
-        gdf.set_crs(4326, inplace=True)
-    else:
-        gdf = gdf.to_crs(4326)
-    gdf["geometry"] = gdf.geometry.buffer(0)
+    for year, variable in stored:
+        DASHBOARD_CACHE.invalidate(layer_key(writer.level, year, variable))
+    return stored
 
-    # join user data onto polygons
-    try:
-        merged = join_layers(
-            gdf=gdf, df=df, level=level, variable=variable,
-            join_by=join_by, join_key=None, country_iso3=None,
-            country_col=country_col, state_col=state_col, county_col=None,
-            lon_col=None, lat_col=None
-        )
-    except ValueError as ve:
-        raise HTTPException(400, detail=str(ve))
 
-    # run Local Moran in an independent function
-    try:
-        result = local_moran(
-            merged, variable,
-            wtype=wtype, k=k, perm=perm, alpha=alpha,
-            gas=gas
-        )
-    except ValueError as ve:
-        raise HTTPException(400, detail=str(ve))
+def store_fill_results(results: list[tuple[FillTask, GeoDataFrame | None]], level: str = "adm1") -> list[bool]:
+    """
+    Store /fill_database layers in one transaction, replacing any older version,
+    and record the source hash each was computed from (also for skipped layers).
+    """
+    writer = GeodataWriter(level, COLUMN_MAPPINGS[level]["alias"])
+    for task, result in results:
+        if result is not None:
+            writer.add(result, task.year, task.variable, replace=True)
+    stored = set(flush_geo_layers(writer, [(task.year, task.variable, task.source_hash) for task, _ in results]))
+    return [(task.year, task.variable) in stored for task, _ in results]
 
-    if result is False:
-        return 0
-    # optional simplify for web payload
-    if simplify_tol:
-        result["geometry"] = result.geometry.simplify(simplify_tol, preserve_topology=True)
+# Source data behind the /fill_database layers
+FILL_YEARS = range(2011, 2022)
+ASTHMA_SOURCE = "data/out_years/ml_dataset_smoking_Year-{year}.csv"
+GAS_SOURCE = "backend/training/ml_dataset_smoking.csv"
 
-    # rename name -> alias (country/state/county) for output
-    result = result.rename(columns={"name": alias})
 
-    cols = ["code", alias, variable, "local_I", "p_value", "cluster_label", "geometry"]
-    geojson = result[cols].to_json()
-    geojson_obj = json.loads(geojson)
-    
-    if asthma:
-        upload_asthmageo_data(year=year, geojson_obj=geojson_obj)
-    elif gas:
-        upload_gasgeo_data(year=year, var=variable, geojson_obj=geojson_obj)
-    
-    return 1
+def read_fill_sources(years) -> dict[int, tuple[DataFrame, DataFrame]]:
+    """
+    {year: (asthma_df, gas_df)} for /fill_database, reading every file once.
+    The gas dataset covers all years and is split by its Year column.
+    """
+    gas = pd.read_csv(GAS_SOURCE)
+    gas["Country"] = "United States of America"
+    gas_years = pd.to_numeric(gas["Year"], errors="coerce").astype("Int64")
+    gas_by_year = {int(y): g for y, g in gas.groupby(gas_years)}
+    return {
+        year: (pd.read_csv(ASTHMA_SOURCE.format(year=year)), gas_by_year.get(year, gas.iloc[0:0]))
+        for year in years
+    }
 
-def get_gas_df(year: int):
-    df = pd.read_csv("backend/training/ml_dataset_smoking.csv")
 
-    years = pd.to_numeric(df["Year"], errors="coerce").astype("Int64")
-    mask = years == int(year)
-    out = df.loc[mask].copy()
+# Parsed uploads shared by the ML/LISA endpoints, bounded by DATASET_CACHE_MAX_MB
+DATASET_CACHE = DatasetCache(max_bytes=int(os.environ.get("DATASET_CACHE_MAX_MB", "512")) * 1024 * 1024)
 
-    out["Country"] = "United States of America"
-    return out
+# /lisa results kept in lisa_cache
+LISA_CACHE_TTL_SECONDS = int(os.environ.get("LISA_CACHE_TTL_HOURS", "168")) * 3600
+LISA_CACHE_MAX_ENTRIES = int(os.environ.get("LISA_CACHE_MAX_ENTRIES", "200"))
 
-load_dotenv()
+# Serialized unfiltered dashboard layers, bounded by DASHBOARD_CACHE_MAX_MB;
+# DASHBOARD_CACHE_WARM=1 fills it for every stored adm1 layer at startup
+DASHBOARD_CACHE = LayerCache(max_bytes=int(os.environ.get("DASHBOARD_CACHE_MAX_MB", "256")) * 1024 * 1024)
 
-DB_NAME = os.environ["DB_NAME"]
-DB_USER = os.environ["DB_USER"]
-DB_PASS = os.environ["DB_PASS"]
-DB_HOST = os.environ["DB_HOST"]
-DB_PORT = int(os.environ["DB_PORT"])
+# /fill_database worker processes (0 = CPU count) and layers stored per transaction
+FILL_WORKERS = int(os.environ.get("FILL_WORKERS", "0")) or None
+FILL_BATCH_SIZE = int(os.environ.get("FILL_BATCH_SIZE", "8"))
 
-def get_db_connection():
-    return psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS,
-        host=DB_HOST,
-        port=DB_PORT
-    )
+# /forecast LISA threads fed year by year from the forecast stage
+FORECAST_LISA_WORKERS = int(os.environ.get("FORECAST_LISA_WORKERS", "4"))
 
 
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
+def plan_fill_tasks() -> list[FillTask]:
+    """
+    Every adm1 dashboard layer (asthma + gas vars, 2011-2021) that is missing or
+    whose source rows changed since it was stored.
+    """
+    try:
+        sources = read_fill_sources(FILL_YEARS)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    conn = get_db_connection()
+    try:
+        with conn, conn.cursor() as cur:
+            # layers already stored, with the source hash they were computed from (NULL if unknown)
+            cur.execute("""
+                SELECT year, variable, source_hash FROM geo_sources WHERE level='adm1'
+                UNION ALL
+                SELECT DISTINCT a.year, a.variable, NULL FROM geo_attributes a
+                WHERE a.level='adm1' AND NOT EXISTS (
+                    SELECT 1 FROM geo_sources s WHERE s.level=a.level AND s.variable=a.variable AND s.year=a.year
+                )
+            """)
+            materialized = {(year, variable): stored for year, variable, stored in cur.fetchall()}
+    finally:
+        conn.close()
+
+    tasks = []
+    for year, (asthma_df, gas_df) in sources.items():
+        candidates = [FillTask(year, "Asthma Prevalence%", asthma_df[["Country", "State", "Asthma Prevalence%"]])]
+        candidates += [FillTask(year, var, gas_df[["Country", "State", var]], gas=True) for var in GAS_VARIABLES]
+        for task in candidates:
+            task.source_hash = source_hash(task.df)
+            key = (task.year, task.variable)
+            if key in materialized and materialized[key] in (None, task.source_hash):
+                continue
+            tasks.append(task)
+    return tasks
+
+
 @app.post("/fill_database")
-async def fill_database():
+def fill_database(workers: int | None = Query(None, description="LISA worker processes (default: FILL_WORKERS or CPU count)")):
+    """
+    Compute every adm1 dashboard layer that is missing or out of date in parallel
+    and store them in batches. Returns a status per (year, variable) it had to compute.
+    """
+    tasks = plan_fill_tasks()
+    if not tasks:
+        return {"status": "success", "tasks": []}
+    statuses = run_fill(
+        tasks, GPKG_PATHS["adm1"], "adm1", store_fill_results,
+        workers=workers or FILL_WORKERS, batch_size=FILL_BATCH_SIZE,
+    )
+    failed = sum(1 for s in statuses if s["status"] == "failed")
+    return {"status": "success" if not failed else "partial", "tasks": statuses}
+
+
+@app.post("/geo_tasks/fill")
+def enqueue_fill(max_attempts: int = Query(3, ge=1, description="Attempts per task before it is marked failed")):
+    """
+    Queue the layers /fill_database would compute as geo_tasks rows instead of
+    running them here; `python -m backend.geodata.worker` processes on any host
+    pick them up.
+    """
+    tasks = [
+        ("adm1", task.year, task.variable, {
+            "source": GAS_SOURCE if task.gas else ASTHMA_SOURCE.format(year=task.year),
+            "year_column": "Year" if task.gas else None,
+            "country": "United States of America" if task.gas else None,
+            "boundaries": GPKG_PATHS["adm1"],
+            "gas": task.gas,
+            "perm": 999,
+        })
+        for task in plan_fill_tasks()
+    ]
     conn = get_db_connection()
     try:
-        file_path = "ml_dataset_smoking_Year-"
-        for year in range(2011, 2022):
-            df = pd.read_csv(f"data/out_years/{file_path}{year}.csv")
-            with conn, conn.cursor() as cur:
-                cur.execute("""
-                            SELECT asthmageo_id FROM asthma_geodata WHERE asthmageo_id=%s
-                            """, (year,))
-                row = cur.fetchone()
-                if not row:
-                    run_lisa_forecast(df=df, year=year, variable="Asthma Prevalence%", asthma=True)
-                
-            with conn, conn.cursor() as cur:
-                gas_vars = ["Avg CO2", "Avg NO2", "Avg Ozone", "Avg PM10", "Avg PM2.5", "Avg SO2"]
-                for var in gas_vars:
-                    print(f"ATTEMPTING {year} - {var}")
-                    cur.execute("""
-                                SELECT gasgeo_year, gasgeo_name FROM gas_geodata WHERE gasgeo_year=%s AND gasgeo_name = %s
-                                """, (year, var))
-                    row = cur.fetchone()
-                    if not row:
-                        run_lisa_forecast(df=get_gas_df(year), year=year, variable=var, asthma=False, gas=True)
-                else:
-                    continue
-        
-    except Exception as e:
-        return HTTPException(status_code=500, detail=str(e))
+        with conn, conn.cursor() as cur:
+            queued = enqueue_tasks(cur, tasks, max_attempts=max_attempts)
+            return {"status": "success", "queued": queued, "tasks": task_counts(cur)}
+    finally:
+        conn.close()
+
+
+@app.get("/geo_tasks")
+def list_geo_tasks(status: str | None = Query(None, description="pending | running | done | skipped | failed")):
+    conn = get_db_connection()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT task_id, level, year, variable, status, attempts, worker, heartbeat_time, last_error
+                FROM geo_tasks WHERE %(status)s::text IS NULL OR status = %(status)s
+                ORDER BY task_id
+            """, {"status": status})
+            columns = [d[0] for d in cur.description]
+            tasks = [dict(zip(columns, row)) for row in cur.fetchall()]
+            return {"counts": task_counts(cur), "tasks": tasks}
     finally:
         conn.close()
-        
 
     
 @app.post("/lisa/{file_id}")
@@ -497,11 +310,35 @@ async def run_lisa(
 
     """
     
-    df = retrieve_csv_table(file_id)
     level = level.lower()
     if level not in GPKG_PATHS:
         raise HTTPException(400, detail="Invalid level, use adm0, adm1 or adm2")
 
+    # identical inputs on identical content return the stored result
+    content_hash = get_content_hash(file_id)
+    cache_params = {
+        "level": level, "variable": variable, "join_by": join_by, "join_key": join_key,
+        "country_iso3": country_iso3, "country_col": country_col, "state_col": state_col,
+        "county_col": county_col, "lon_col": lon_col, "lat_col": lat_col,
+        "wtype": wtype, "k": k, "perm": perm, "alpha": alpha, "simplify_tol": simplify_tol,
+    }
+    cache_key = lisa_cache_key(content_hash, cache_params)
+    if cache:
+        conn = get_db_connection()
+        try:
+            with conn, conn.cursor() as cur:
+                cached = get_cached(cur, cache_key, LISA_CACHE_TTL_SECONDS)
+        finally:
+            conn.close()
+        if cached is not None:
+            return Response(content=cached, media_type="application/geo+json")
+
+    df = load_dataset(file_id, columns=lisa_columns(
+        level, variable, join_by=join_by, join_key=join_key,
+        country_col=country_col, state_col=state_col, county_col=county_col,
+        lon_col=lon_col, lat_col=lat_col
+    ))
+
     gdf = gpd.read_file(GPKG_PATHS[level])
     mapping = COLUMN_MAPPINGS[level]
     for req in ("code", "name", "alias"):
@@ -557,48 +394,296 @@ async def run_lisa(
 
     cols = ["code", alias, variable, "local_I", "p_value", "cluster_label", "geometry"]
     geojson = result[cols].to_json()
-    geojson_obj = json.loads(geojson)
     if cache:
-        upsert_cache(1, "lisa-latest.geojson", geojson_obj)
+        conn = get_db_connection()
+        try:
+            with conn, conn.cursor() as cur:
+                store_cached(cur, cache_key, content_hash, cache_params, geojson,
+                             LISA_CACHE_TTL_SECONDS, LISA_CACHE_MAX_ENTRIES)
+        finally:
+            conn.close()
     return Response(content=geojson, media_type="application/geo+json")
     
+def forecast_level(level: str) -> dict:
+    """FORECAST_LEVELS entry of a level with boundaries; 400 for unknown levels, 404 when its inputs are missing."""
+    spec = FORECAST_LEVELS.get(level)
+    if spec is None or level not in GPKG_PATHS:
+        raise HTTPException(400, detail=f"level must be one of: {', '.join(FORECAST_LEVELS)}")
+    for path in (spec["hist_csv"], spec["model_pkl"]):
+        if not os.path.exists(path):
+            raise HTTPException(404, detail=f"No {level} forecast input at {path}")
+    return spec
+
+
+def forecast_join(spec: dict) -> dict:
+    """lisa_layer join options for forecast frames: the region column is the key whichever way the level joins."""
+    region_col = spec["region_col"]
+    return {"join_by": spec["join_by"], "join_key": region_col, "state_col": region_col, "county_col": region_col}
+
+
+def check_forecast_regions(spec: dict, boundaries: GeoDataFrame, level: str):
+    """
+    400 up front when the historical dataset's regions match fewer of the level's
+    boundaries than LISA needs (codes for join_by code, normalized names otherwise),
+    rather than from inside a LISA thread; partial matches are only reported.
+    """
+    region_col = spec["region_col"]
+    try:
+        regions = pd.read_csv(spec["hist_csv"], usecols=[region_col])[region_col]
+    except ValueError:
+        raise HTTPException(400, detail=f"{spec['hist_csv']} has no '{region_col}' column")
+    regions = pd.Series(regions.dropna().astype(str).str.strip().unique())
+    if spec["join_by"] == "code":
+        matched = regions.isin(set(boundaries["code"].astype(str)))
+    else:
+        matched = normalize(regions).isin(set(normalize(boundaries["name"])))
+    unmatched = regions[~matched].tolist()
+    if matched.sum() < 5:
+        raise HTTPException(400, detail=(
+            f"{matched.sum()} of {len(regions)} '{region_col}' values in {spec['hist_csv']} match {level} boundary "
+            f"{'codes' if spec['join_by'] == 'code' else 'names'} (e.g. unmatched: {unmatched[:3]}); see FORECAST_LEVELS"))
+    if unmatched:
+        print(f"[WARN] {len(unmatched)} '{region_col}' values have no {level} boundary: {unmatched[:5]}")
+
+
 @app.post("/forecast")
-async def forecast(start: int = Form(2025, description="Starting year to begin forecasting from"), 
-                    end: int = Form(2027, description="End year to stop forecasting at")):
+def forecast(start: int = Form(2025, description="Starting year to begin forecasting from"), 
+             end: int = Form(2027, description="End year to stop forecasting at"),
+             interval: float | None = Form(None, gt=0, lt=1, description="Also store a prediction interval with this coverage, e.g. 0.9"),
+             level: str = Form("adm1", description="Admin level to forecast and analyse: adm1 (states) or adm2 (counties)")):
+    """
+    Forecast asthma prevalence for start..end and store each year's LISA layer.
+    Years already stored from the current model bundle and historical dataset
+    (and interval setting) are skipped entirely; only the rest are predicted and analysed.
+    With `interval`, features also carry value_lower / value_upper from the spread of the trees.
+    `level` picks the dataset, model and boundaries from FORECAST_LEVELS and GPKG_PATHS.
+    """
+    variable = "Predicted Asthma Prevalence %"
+    spec = forecast_level(level)
+    region_col = spec["region_col"]
     try:
-        result = run_forecast(start_year= start, end_year=end)
-        for i, obj in enumerate(result["per_year_frames"]):
-            run_lisa_forecast(df=obj, year=result["years"][i])
-        
+        source = forecast_source_hash(spec["hist_csv"], spec["model_pkl"])
+        if interval:
+            source = hashlib.sha256(f"{source}:interval={interval}".encode()).hexdigest()
+        conn = get_db_connection()
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute("""
+                    SELECT year FROM geo_sources
+                    WHERE level=%s AND variable=%s AND source_hash=%s AND year = ANY(%s)
+                """, (level, variable, source, list(range(start, end + 1))))
+                stored = {year for (year,) in cur.fetchall()}
+        finally:
+            conn.close()
+        missing = [year for year in range(start, end + 1) if year not in stored]
+        if not missing:
+            return {"status": "success", "computed": [], "cached": sorted(stored)}
+
+        # pipelined: each year's frame goes to a LISA thread as soon as it is scored
+        # (boundaries and weights are shared), and each layer is stored as it finishes,
+        # replacing forecasts from older inputs
+        boundaries = load_boundaries(GPKG_PATHS[level], level)
+        check_forecast_regions(spec, boundaries, level)
+        join = forecast_join(spec)
+        frames = iter_forecast(missing, spec["hist_csv"], spec["model_pkl"], interval=interval, region_col=region_col)
+        pending = {}
+
+        def store_finished(block: bool):
+            done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                year = pending.pop(future)
+                writer = GeodataWriter(level, COLUMN_MAPPINGS[level]["alias"])
+                layer = future.result()
+                if layer is not None:
+                    writer.add(layer, year, variable, replace=True)
+                flush_geo_layers(writer, [(year, variable, source)])
+
+        with ThreadPoolExecutor(max_workers=FORECAST_LISA_WORKERS) as pool:
+            for year, frame in frames:
+                pending[pool.submit(lisa_layer, frame, boundaries, level, variable, carry=INTERVAL_COLUMNS, **join)] = year
+                # store whatever has finished before scoring the next year; wait once every LISA thread is busy
+                store_finished(block=len(pending) >= FORECAST_LISA_WORKERS)
+            while pending:
+                store_finished(block=True)
+        return {"status": "success", "computed": missing, "cached": sorted(stored)}
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
         
 
+@app.post("/scenarios")
+def scenarios(
+    scenarios: str = Form(..., description='JSON list, e.g. [{"name": "pm25-20", "changes": {"Avg PM2.5": -20}, "by_year": 2030}]'),
+    start: int = Form(2025, description="Starting year to begin forecasting from"),
+    end: int = Form(2030, description="End year to stop forecasting at"),
+    lisa: bool = Form(False, description="Also run LISA on every scenario x year"),
+    perm: int = Form(499, description="LISA permutations"),
+    level: str = Form("adm1", description="Admin level to forecast and analyse: adm1 (states) or adm2 (counties)"),
+):
+    """
+    What-if forecasts: every scenario's percent changes to forecast pollutant/extra
+    features are scored together with the baseline in one model call.
+    -> { scenarios: [{name, changes, by_year, rows: [...], lisa?: {year: [{code, state|county, local_I, p_value, cluster_label}]}}] }
+    `level` picks the dataset, model and boundaries as in /forecast. Nothing is stored.
+    """
+    try:
+        specs = parse_scenarios(json.loads(scenarios))
+    except (json.JSONDecodeError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid scenarios: {e}")
+    level_spec = forecast_level(level)
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    if lisa:
+        boundaries = load_boundaries(GPKG_PATHS[level], level)
+        check_forecast_regions(level_spec, boundaries, level)
+    try:
+        frames = run_scenarios(specs, start, end, level_spec["hist_csv"], level_spec["model_pkl"],
+                               region_col=level_spec["region_col"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    by_name = {s["name"]: s for s in specs}
+    alias = COLUMN_MAPPINGS[level]["alias"]
+    layers = {}
+    if lisa:
+        # every scenario x year on the /forecast LISA threads, sharing one boundary layer and its weights
+        join = forecast_join(level_spec)
+        with ThreadPoolExecutor(max_workers=FORECAST_LISA_WORKERS) as pool:
+            futures = {
+                (name, int(year)): pool.submit(lisa_layer, df_y, boundaries, level, "Predicted Asthma Prevalence %",
+                                               perm=perm, **join)
+                for name, frame in frames.items() for year, df_y in frame.groupby("Year")
+            }
+            layers = {key: future.result() for key, future in futures.items()}
+
+    out = []
+    for name, frame in frames.items():
+        spec = by_name.get(name, {"changes": {}, "by_year": None})
+        entry = {"name": name, "changes": spec["changes"], "by_year": spec["by_year"],
+                 "rows": json.loads(frame.to_json(orient="records"))}
+        if lisa:
+            entry["lisa"] = {}
+            for year in sorted(frame["Year"].unique()):
+                layer = layers[(name, int(year))]
+                entry["lisa"][int(year)] = json.loads(
+                    layer[["code", alias, "local_I", "p_value", "cluster_label"]].to_json(orient="records")
+                ) if layer is not None else []
+        out.append(entry)
+    return {"scenarios": out}
+
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(
+    file: UploadFile = File(...),
+    mode: str = Form("blob", description="blob | table: table also COPYs the rows into a typed Postgres table")
+):
     try:
+        mode = mode.lower()
+        if mode not in ("blob", "table"):
+            raise HTTPException(status_code=400, detail="mode must be one of: blob, table")
         # Read the contents of the uploaded file
         contents = await file.read()
+        content_hash = hashlib.sha256(contents).hexdigest()
         # Connect to PostgreSQL
         conn = get_db_connection()
-        cur = conn.cursor()
-
-        # Insert file into database
-        cur.execute("""
-            INSERT INTO files (file_name, file_data)
-            VALUES (%s, %s)
-        """, (file.filename, psycopg2.Binary(contents)))
-        conn.commit()
-        cur.close()
-        conn.close()
+        try:
+            with conn, conn.cursor() as cur:
+                # Serialise concurrent uploads of the same content
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (content_hash,))
+                cur.execute("""
+                    SELECT b.file_parquet IS NOT NULL, b.file_row_index IS NOT NULL,
+                           p.content_hash IS NOT NULL, c.table_name IS NOT NULL
+                    FROM file_blobs b
+                    LEFT JOIN dataset_profiles p ON p.content_hash = b.content_hash
+                    LEFT JOIN dataset_catalog c ON c.content_hash = b.content_hash
+                    WHERE b.content_hash = %s
+                """, (content_hash,))
+                existing = cur.fetchone()
+                deduplicated = existing is not None
+                has_parquet, has_row_index, has_profile, has_table = existing or (False, False, False, False)
+
+                # Derived artifacts missing for this content (a new upload, or an earlier upload under
+                # another name/mode, or one whose parse failed) are built from this upload's name
+                is_csv = bool(file.filename) and file.filename.lower().endswith(".csv")
+                needs_parquet = mode == "blob" and not has_parquet
+                needs_row_index = is_csv and not has_row_index
+                needs_table = mode == "table" and not has_table
+
+                df = None
+                if needs_parquet or needs_row_index or needs_table or not has_profile:
+                    # Parse once into a columnar copy; consumers read this instead of the raw bytes
+                    try:
+                        df = parse_upload(file.filename, contents)
+                    except Exception as e:
+                        if mode == "table":
+                            raise HTTPException(status_code=400, detail=f"Could not parse {file.filename}: {e}")
+                        print(f"Could not parse {file.filename}, storing raw bytes only: {e}")
+
+                parquet = row_index = None
+                if df is not None and needs_parquet:
+                    try:
+                        parquet = to_parquet_bytes(df)
+                    except PARQUET_ERRORS as e:
+                        print(f"Could not convert {file.filename} to Parquet, storing raw bytes only: {e}")
+                if df is not None and needs_row_index:
+                    row_index = build_row_index(contents)
+
+                if not deduplicated:
+                    cur.execute("""
+                        INSERT INTO file_blobs (content_hash, file_data, file_parquet, file_row_index)
+                        VALUES (%s, %s, %s, %s)
+                    """, (content_hash, psycopg2.Binary(contents),
+                          psycopg2.Binary(parquet) if parquet else None, row_index))
+                elif parquet or row_index:
+                    cur.execute("""
+                        UPDATE file_blobs
+                        SET file_parquet = COALESCE(file_parquet, %s), file_row_index = COALESCE(file_row_index, %s)
+                        WHERE content_hash = %s
+                    """, (psycopg2.Binary(parquet) if parquet else None, row_index, content_hash))
+
+                if df is not None and not has_profile:
+                    # Profile once so headers, dtypes and row counts never need a re-parse
+                    profile = build_profile(df)
+                    cur.execute("""
+                        INSERT INTO dataset_profiles (content_hash, row_count, profile_columns)
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (content_hash) DO NOTHING
+                    """, (content_hash, profile["row_count"], Json(profile["columns"])))
+
+                if needs_table:
+                    # Typed table + catalog entry, so previews/projections/aggregates run in SQL
+                    table_name = table_name_for(content_hash)
+                    schema = infer_schema(df)
+                    ingest_table(cur, table_name, df, schema)
+                    cur.execute("""
+                        INSERT INTO dataset_catalog (content_hash, table_name, table_columns, row_count)
+                        VALUES (%s, %s, %s, %s)
+                    """, (content_hash, table_name, Json(schema), len(df)))
 
-        return {"status": "success", "filename": file.filename}
+                # Insert file into database
+                cur.execute("""
+                    INSERT INTO files (file_name, file_hash)
+                    VALUES (%s, %s)
+                    RETURNING file_id
+                """, (file.filename, content_hash))
+                file_id = cur.fetchone()[0]
+        finally:
+            conn.close()
+
+        return {"status": "success", "filename": file.filename, "id": file_id, "mode": mode,
+                "deduplicated": deduplicated}
+    except HTTPException:
+        raise
     except Exception as e:
         print("Error uploading file:", str(e))  # LOG TO TERMINAL
         raise HTTPException(status_code=500, detail=str(e))
     
 
-# cache/1       
+# most recently used LISA result
 
 @app.get("/cache")
 def get_cache():
@@ -607,100 +692,275 @@ def get_cache():
         with conn, conn.cursor() as cur:
             cur.execute(
                 """
-                SELECT cache_name, cache_data FROM cache WHERE cache_id=%s
-                """, 
-                (1,))
+                SELECT result FROM lisa_cache ORDER BY accessed_time DESC LIMIT 1
+                """)
             row = cur.fetchone()
             if not row:
                 raise HTTPException(status_code=404, detail="Cache not found")
-            cache_name, cache_data = row
-            return Response(content=json.dumps(cache_data), media_type="application/geo+json")
+            return Response(content=row[0], media_type="application/geo+json")
     except:
         return Response(content=None)
     finally:
         conn.close()
 
 
+def parse_bbox(bbox: str | None) -> tuple[float, float, float, float] | None:
+    if bbox is None:
+        return None
+    try:
+        minx, miny, maxx, maxy = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be minx,miny,maxx,maxy")
+    return minx, miny, maxx, maxy
+
+
+def asthma_layer_variable(cur, level: str, year: int) -> str | None:
+    # observed layer first, forecast otherwise
+    cur.execute(
+        """
+        SELECT variable FROM geo_attributes
+        WHERE level=%s AND year=%s AND variable = ANY(%s)
+        GROUP BY variable ORDER BY array_position(%s, variable::text) LIMIT 1
+        """,
+        (level, year, list(ASTHMA_VARIABLES), list(ASTHMA_VARIABLES)))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def layer_bytes(cur, level: str, year: int, variable: str, filters: str = "", params: dict | None = None) -> bytes:
+    cur.execute(layer_query(filters), {"level": level, "year": year, "variable": variable, **(params or {})})
+    data = assemble_collection(cur.fetchall(), COLUMN_MAPPINGS[level]["alias"], variable)
+    return json.dumps(data).encode("utf-8")
+
+
+def layer_response(request: Request, entry: tuple[bytes, bytes]) -> Response:
+    """Cached (plain, gzipped) layer as a response, gzipped when the client accepts it."""
+    headers = {"Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=entry[1], media_type="application/geo+json", headers=headers)
+    return Response(content=entry[0], media_type="application/geo+json", headers=headers)
+
+
+def warm_dashboard_cache():
+    if os.environ.get("DASHBOARD_CACHE_WARM") != "1":
+        return
+    try:
+        conn = get_db_connection()
+    except Exception as e:
+        print(f"Dashboard cache warm-up skipped: {e}")
+        return
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT DISTINCT year, variable FROM geo_attributes WHERE level='adm1' AND variable <> ALL(%s)",
+                        (list(ASTHMA_VARIABLES),))
+            layers = cur.fetchall()
+            cur.execute("SELECT DISTINCT year FROM geo_attributes WHERE level='adm1' AND variable = ANY(%s)",
+                        (list(ASTHMA_VARIABLES),))
+            for (year,) in cur.fetchall():
+                layers.append((year, asthma_layer_variable(cur, "adm1", year)))
+            for year, variable in layers:
+                key = layer_key("adm1", year, variable)
+                generation = DASHBOARD_CACHE.generation(key)
+                DASHBOARD_CACHE.put(key, layer_bytes(cur, "adm1", year, variable), generation)
+    finally:
+        conn.close()
+
+
 @app.get("/get_asthma_dashboard/{year}")
-async def get_asthma_dashboard(year: int = Path(..., description="Year of the data")):
+async def get_asthma_dashboard(request: Request,
+                               year: int = Path(..., description="Year of the data"),
+                               level: str = Query("adm1", description="adm0 | adm1 | adm2"),
+                               cluster: list[str] | None = Query(None, description="Only these cluster labels (HH, LH, LL, HL, Not Significant)"),
+                               p_max: float | None = Query(None, description="Only features with p_value <= p_max"),
+                               codes: list[str] | None = Query(None, description="Only these region codes"),
+                               bbox: str | None = Query(None, description="minx,miny,maxx,maxy in EPSG:4326")):
+    filters, params = layer_filters(cluster, p_max, codes, parse_bbox(bbox))
+    key = layer_key(level, year, ASTHMA_VARIABLES[0])
+    if not filters:
+        cached = DASHBOARD_CACHE.get(key)
+        if cached is not None:
+            return layer_response(request, cached)
+    generation = DASHBOARD_CACHE.generation(key)
     conn = get_db_connection()
     try:
         with conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT asthmageo_name, asthmageo_data FROM asthma_geodata WHERE asthmageo_id=%s
-                """, 
-                (year,))
-            row = cur.fetchone()
-            if not row:
+            variable = asthma_layer_variable(cur, level, year)
+            if variable is None:
                 raise HTTPException(status_code=404, detail="Data not found")
-            name, data = row
-            return Response(content=json.dumps(data), media_type="application/geo+json")
+            body = layer_bytes(cur, level, year, variable, filters, params)
     finally:
         conn.close()
+    if not filters:
+        return layer_response(request, DASHBOARD_CACHE.put(key, body, generation))
+    return Response(content=body, media_type="application/geo+json")
         
 @app.get("/list_asthma_dashboard")
 async def list_asthma_geodata():
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("SELECT asthmageo_id, asthmageo_name FROM asthma_geodata")
+        cur.execute("""
+            SELECT DISTINCT year FROM geo_attributes WHERE level='adm1' AND variable = ANY(%s) ORDER BY year
+        """, (list(ASTHMA_VARIABLES),))
         files = cur.fetchall()
         cur.close()
         conn.close()
 
-        return [{"id": f[0], "Geodata Name": f[1]} for f in files]
+        return [{"id": f[0], "Geodata Name": f"asthma_forecast_{f[0]}"} for f in files]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/get_gas_dashboard/{year}/{var}")
-async def get_gas_dashboard(year: int = Path(..., description="Year of the data"), var: str = Path(..., description="Gas var: [Avg CO2, Avg NO2, Avg Ozone, Avg PM10, Avg PM2.5, Avg SO2]")):
+async def get_gas_dashboard(request: Request,
+                            year: int = Path(..., description="Year of the data"), var: str = Path(..., description="Gas var: [Avg CO2, Avg NO2, Avg Ozone, Avg PM10, Avg PM2.5, Avg SO2]"),
+                            level: str = Query("adm1", description="adm0 | adm1 | adm2"),
+                            cluster: list[str] | None = Query(None, description="Only these cluster labels (HH, LH, LL, HL, Not Significant)"),
+                            p_max: float | None = Query(None, description="Only features with p_value <= p_max"),
+                            codes: list[str] | None = Query(None, description="Only these region codes"),
+                            bbox: str | None = Query(None, description="minx,miny,maxx,maxy in EPSG:4326")):
+    filters, params = layer_filters(cluster, p_max, codes, parse_bbox(bbox))
+    key = layer_key(level, year, var)
+    if not filters:
+        cached = DASHBOARD_CACHE.get(key)
+        if cached is not None:
+            return layer_response(request, cached)
+    generation = DASHBOARD_CACHE.generation(key)
     conn = get_db_connection()
     try:
         with conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT gasgeo_data FROM gas_geodata WHERE gasgeo_year=%s AND gasgeo_name=%s
-                """, 
-                (year,var))
-            row = cur.fetchone()
-            if not row:
+            cur.execute("SELECT 1 FROM geo_attributes WHERE level=%s AND year=%s AND variable=%s LIMIT 1",
+                        (level, year, var))
+            if not cur.fetchone():
                 raise HTTPException(status_code=404, detail="Data not found")
-            data = row
-            return Response(content=json.dumps(data), media_type="application/geo+json")
+            body = layer_bytes(cur, level, year, var, filters, params)
     finally:
         conn.close()
+    if not filters:
+        return layer_response(request, DASHBOARD_CACHE.put(key, body, generation))
+    return Response(content=body, media_type="application/geo+json")
         
 @app.get("/list_gas_dashboard")
 async def list_gas_geodata():
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("SELECT gasgeo_id, gasgeo_year, gasgeo_name FROM gas_geodata")
+        cur.execute("""
+            SELECT DISTINCT year, variable FROM geo_attributes
+            WHERE level='adm1' AND variable <> ALL(%s) ORDER BY year, variable
+        """, (list(ASTHMA_VARIABLES),))
         files = cur.fetchall()
         cur.close()
         conn.close()
 
-        return [{"id": f[0], "Year": f[1], "Var": f[2]} for f in files]
+        return [{"id": i, "Year": f[0], "Var": f[1]} for i, f in enumerate(files, start=1)]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 
+@app.get("/dashboard/bulk")
+async def get_dashboard_bulk(
+    years: list[int] | None = Query(None, description="Years to include (default: all stored years)"),
+    variables: list[str] | None = Query(None, description="asthma and/or gas vars, e.g. Avg NO2 (default: all)"),
+    level: str = Query("adm1", description="adm0 | adm1 | adm2"),
+    cluster: list[str] | None = Query(None, description="Only these cluster labels (HH, LH, LL, HL, Not Significant)"),
+    p_max: float | None = Query(None, description="Only features with p_value <= p_max"),
+    codes: list[str] | None = Query(None, description="Only these region codes"),
+    bbox: str | None = Query(None, description="minx,miny,maxx,maxy in EPSG:4326")
+):
+    """
+    Every requested (year, variable) dashboard layer in one response
+    -> { geometry: FeatureCollection (each region once), codes: [...],
+         layers: {var: {year: {value, local_I, p_value, cluster_label, value_lower, value_upper}}} }
+    Attribute arrays follow the order of `codes`.
+    """
+    filters, params = layer_filters(cluster, p_max, codes, parse_bbox(bbox))
+    params.update({"level": level, "vars": variables, "years": years, "asthma": list(ASTHMA_VARIABLES)})
+    # one asthma variable per year (observed first, forecast otherwise), as asthma_layer_variable
+    # picks it, chosen before any row filter so a layer never mixes observed and forecast values
+    asthma_choice = """
+        WITH asthma AS (
+            SELECT DISTINCT ON (year) year, variable
+            FROM (SELECT DISTINCT year, variable FROM geo_attributes
+                  WHERE level = %(level)s AND variable = ANY(%(asthma)s)
+                    AND (%(years)s::int[] IS NULL OR year = ANY(%(years)s::int[]))) v
+            ORDER BY year, array_position(%(asthma)s, variable::text)
+        )
+    """
+    layer_filter = """
+        FROM geo_attributes a
+        JOIN geo_boundaries b ON b.level = a.level AND b.code = a.code
+        LEFT JOIN asthma s ON s.year = a.year
+        WHERE a.level = %(level)s
+          AND (%(years)s::int[] IS NULL OR a.year = ANY(%(years)s::int[]))
+          AND (NOT a.variable = ANY(%(asthma)s) OR a.variable = s.variable)
+          AND (%(vars)s::text[] IS NULL OR
+               (CASE WHEN a.variable = ANY(%(asthma)s) THEN 'asthma' ELSE a.variable END) = ANY(%(vars)s::text[]))
+    """ + filters
+    conn = get_db_connection()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(
+                f"""
+                {asthma_choice}
+                SELECT CASE WHEN a.variable = ANY(%(asthma)s) THEN 'asthma' ELSE a.variable END,
+                       a.year, a.code, a.value, a.local_I, a.p_value, a.cluster_label,
+                       a.value_lower, a.value_upper
+                {layer_filter}
+                ORDER BY 1, a.year, a.code
+                """,
+                params)
+            attributes = cur.fetchall()
+            if not attributes:
+                raise HTTPException(status_code=404, detail="Data not found")
+            cur.execute(
+                f"""
+                {asthma_choice}
+                SELECT code, name, geometry FROM geo_boundaries
+                WHERE level = %(level)s AND code IN (SELECT a.code {layer_filter})
+                ORDER BY code
+                """,
+                params)
+            boundaries = cur.fetchall()
+            return Response(content=json.dumps(pack_layers(boundaries, attributes)), media_type="application/json")
+    finally:
+        conn.close()
+
+
+
 @app.delete("/delete/{file_id}")
 async def delete_file(file_id: int = Path(..., description="ID of the file to delete")):
     try:
         conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM files WHERE file_id = %s", (file_id,))
-        conn.commit()
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute("DELETE FROM files WHERE file_id = %s RETURNING file_hash", (file_id,))
+                deleted = cur.fetchone()
 
-        if cur.rowcount == 0:
-            raise HTTPException(status_code=404, detail="File not found")
+                if deleted is None:
+                    raise HTTPException(status_code=404, detail="File not found")
 
-        cur.close()
-        conn.close()
+                # Drop the content (and its profile/table) once no other upload references it
+                content_hash = deleted[0]
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (content_hash,))
+                cur.execute("SELECT table_name FROM dataset_catalog WHERE content_hash = %s", (content_hash,))
+                ingested = cur.fetchone()
+                cur.execute("""
+                    DELETE FROM file_blobs b WHERE b.content_hash = %s
+                    AND NOT EXISTS (SELECT 1 FROM files f WHERE f.file_hash = b.content_hash)
+                """, (content_hash,))
+                orphaned = cur.rowcount > 0
+                if orphaned and ingested:
+                    drop_table(cur, ingested[0])
+        finally:
+            conn.close()
+            DATASET_CACHE.forget_file(file_id)
+        if orphaned:
+            DATASET_CACHE.invalidate(content_hash)
         return {"status": "success", "message": f"File with ID {file_id} deleted"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -721,28 +981,125 @@ async def list_files():
 
 
 
-@app.get("/files/{file_id}")
-def retrieve_csv_table(file_id: int):
+def load_dataset(file_id: int, columns: list[str] | None = None) -> DataFrame:
+    """
+    Load an uploaded dataset from its stored Parquet copy (or its ingested table),
+    reading only `columns` when given.
+    Parsed frames are kept in DATASET_CACHE by content hash, so repeat analyses (and
+    re-uploads of the same bytes) skip the download and parse.
+    Content that couldn't be stored as Parquet at upload is parsed here and backfilled.
+    A hit for a file_id whose hash is already known doesn't touch the database.
+    """
+    known_hash = DATASET_CACHE.file_hash(file_id)
+    if known_hash is not None:
+        cached = DATASET_CACHE.get(known_hash, columns)
+        if cached is not None:
+            return cached
+
     conn = get_db_connection()
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT file_data FROM files WHERE file_id = %s", (file_id,))
-        result = cur.fetchone()
-
-        if result is None:
-            raise HTTPException(status_code=404, detail="File not found")
-
-        file_data = result[0]
-        csv_content = file_data.tobytes().decode("utf-8")
-        reader = pd.read_csv(io.StringIO(csv_content), encoding='latin1')
-        
-        return reader
+        with conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT f.file_name, f.file_hash, b.file_parquet IS NOT NULL, c.table_name, c.table_columns
+                FROM files f
+                JOIN file_blobs b ON b.content_hash = f.file_hash
+                LEFT JOIN dataset_catalog c ON c.content_hash = f.file_hash
+                WHERE f.file_id = %s
+            """, (file_id,))
+            result = cur.fetchone()
+            if result is None:
+                raise HTTPException(status_code=404, detail="File not found")
+
+            file_name, content_hash, has_parquet, table_name, table_columns = result
+            DATASET_CACHE.remember_file(file_id, content_hash)
+            if content_hash != known_hash:
+                cached = DATASET_CACHE.get(content_hash, columns)
+                if cached is not None:
+                    return cached
+            wanted = DATASET_CACHE.columns_to_load(content_hash, columns)
+
+            if has_parquet:
+                cur.execute("SELECT file_parquet FROM file_blobs WHERE content_hash = %s", (content_hash,))
+                df = read_columnar(cur.fetchone()[0].tobytes(), wanted)
+            elif table_name is not None:
+                df = read_table(cur, table_name, table_columns, wanted)
+            else:
+                cur.execute("SELECT file_data FROM file_blobs WHERE content_hash = %s", (content_hash,))
+                df = parse_upload(file_name, cur.fetchone()[0].tobytes())
+                try:
+                    cur.execute("UPDATE file_blobs SET file_parquet = %s WHERE content_hash = %s",
+                                (psycopg2.Binary(to_parquet_bytes(df)), content_hash))
+                except PARQUET_ERRORS:
+                    pass  # not representable as Parquet: keep parsing the raw bytes
+                df = select_columns(df, wanted)
+
+            DATASET_CACHE.put(content_hash, df, wanted)
+            return select_columns(df, columns).copy()
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        if 'cur' in locals(): cur.close()
-        if 'conn' in locals(): conn.close()
+        conn.close()
+
+
+def get_content_hash(file_id: int) -> str:
+    content_hash = DATASET_CACHE.file_hash(file_id)
+    if content_hash is not None:
+        return content_hash
+    conn = get_db_connection()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT file_hash FROM files WHERE file_id = %s", (file_id,))
+            row = cur.fetchone()
+            if row is None:
+                raise HTTPException(status_code=404, detail="File not found")
+            DATASET_CACHE.remember_file(file_id, row[0])
+            return row[0]
+    finally:
+        conn.close()
+
+
+@app.get("/dashboard/cache/stats")
+def dashboard_cache_stats():
+    return DASHBOARD_CACHE.stats()
+
+
+@app.get("/datasets/cache/stats")
+def dataset_cache_stats():
+    return DATASET_CACHE.stats()
+
+
+def lisa_columns(
+    level: str,
+    variable: str,
+    *,
+    join_by: str,
+    join_key: str | None,
+    country_col: str | None,
+    state_col: str | None,
+    county_col: str | None,
+    lon_col: str | None,
+    lat_col: str | None,
+) -> list[str] | None:
+    """Columns join_layers needs for a given join; None loads the whole file."""
+    if join_by == "code":
+        keys = [join_key]
+    elif join_by == "name":
+        keys = {"adm0": [country_col], "adm1": [country_col, state_col], "adm2": [county_col]}.get(level)
+        if keys is None:
+            return None
+    elif join_by == "point":
+        keys = [lon_col, lat_col]
+    else:
+        return None
+    return [c for c in keys if c] + [variable]
+
+
+@app.get("/files/{file_id}")
+def retrieve_csv_table(file_id: int):
+    return load_dataset(file_id)
 
 
 @app.get("/files/{file_id}/headers")
@@ -751,7 +1108,18 @@ def get_csv_headers(file_id: int):
     cur = conn.cursor()
     try:
 
-        cur.execute("SELECT file_data FROM files WHERE file_id = %s", (file_id,))
+        cur.execute("""
+            SELECT p.profile_columns FROM files f JOIN dataset_profiles p ON p.content_hash = f.file_hash
+            WHERE f.file_id = %s
+        """, (file_id,))
+        profiled = cur.fetchone()
+        if profiled:
+            return {"columns": [c["name"] for c in profiled[0]]}
+
+        cur.execute("""
+            SELECT b.file_data FROM files f JOIN file_blobs b ON b.content_hash = f.file_hash
+            WHERE f.file_id = %s
+        """, (file_id,))
         result = cur.fetchone()
 
         if result is None:
@@ -764,12 +1132,35 @@ def get_csv_headers(file_id: int):
 
         return {"columns": headers}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         if 'cur' in locals(): cur.close()
         if 'conn' in locals(): conn.close()
         
+
+@app.get("/files/{file_id}/profile")
+def get_file_profile(file_id: int = Path(..., description="ID of the uploaded file")):
+    """
+    Upload-time dataset profile
+    -> { row_count, columns: [{ name, dtype, null_count, min, max, histogram }] }
+    """
+    conn = get_db_connection()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT p.row_count, p.profile_columns FROM files f JOIN dataset_profiles p ON p.content_hash = f.file_hash
+                WHERE f.file_id = %s
+            """, (file_id,))
+            row = cur.fetchone()
+            if not row:
+                raise HTTPException(status_code=404, detail="Profile not found")
+            row_count, columns = row
+            return {"row_count": int(row_count), "columns": columns}
+    finally:
+        conn.close()
         
 
 @app.get("/preview/{file_id}")
@@ -787,32 +1178,86 @@ def preview_file(
     cur = conn.cursor()
     try:
 
-        cur.execute("SELECT file_name, file_data FROM files WHERE file_id = %s", (file_id,))
+        # Ingested uploads page straight out of their typed table
+        cur.execute("""
+            SELECT c.table_name, c.table_columns, c.row_count FROM files f JOIN dataset_catalog c ON c.content_hash = f.file_hash
+            WHERE f.file_id = %s
+        """, (file_id,))
+        ingested = cur.fetchone()
+        if ingested:
+            table_name, table_columns, total = ingested
+            slice_df = read_table(cur, table_name, table_columns, offset=offset, limit=limit)
+            return JSONResponse(content={
+                "columns": [c["name"] for c in table_columns],
+                "rows": json.loads(slice_df.to_json(orient="records", date_format="iso")),
+                "total": int(total)
+            })
+
+        first_block, skip, end_block = window_blocks(offset, limit)
+        # Only the index entries bounding this window are read (arrays are 1-based)
+        cur.execute("""
+            SELECT f.file_name, f.file_hash, p.row_count, b.file_parquet IS NOT NULL,
+                   b.file_row_index[1], b.file_row_index[%s], b.file_row_index[%s]
+            FROM files f
+            JOIN file_blobs b ON b.content_hash = f.file_hash
+            LEFT JOIN dataset_profiles p ON p.content_hash = f.file_hash
+            WHERE f.file_id = %s
+        """, (first_block + 1, end_block + 1, file_id))
         result = cur.fetchone()
         if result is None:
             raise HTTPException(status_code=404, detail="File not found")
 
         import os, io, pandas as pd
-        file_name, file_data = result
-        raw = file_data.tobytes()
+        file_name, content_hash, row_count, has_parquet, header_end, start, stop = result
         ext = os.path.splitext(file_name or "")[1].lower()
 
-        if ext == ".csv":
-            df = pd.read_csv(io.StringIO(raw.decode("latin1")))
-        elif ext in (".xlsx", ".xls"):
-            df = pd.read_excel(io.BytesIO(raw), engine=None)
+        if ext == ".csv" and header_end is not None and row_count is not None:
+            # Indexed CSV: substring() only detoasts the chunks covering the window
+            if start is None:
+                window = "''::bytea"  # offset is past the last row
+            elif stop is None:
+                window = f"substring(file_data FROM {int(start) + 1})"
+            else:
+                window = f"substring(file_data FROM {int(start) + 1} FOR {int(stop) - int(start)})"
+            cur.execute(f"SELECT substring(file_data FROM 1 FOR %s), {window} FROM file_blobs WHERE content_hash = %s",
+                        (header_end, content_hash))
+            header, body = cur.fetchone()
+            slice_df = read_csv_window(header.tobytes(), body.tobytes(), skip, limit)
+            total = row_count
+            columns = list(slice_df.columns)
+        elif ext in (".xlsx", ".xls") and has_parquet:
+            # Workbooks page out of their Parquet copy instead of re-parsing the sheet up to offset
+            cur.execute("SELECT file_parquet FROM file_blobs WHERE content_hash = %s", (content_hash,))
+            slice_df, total = read_parquet_window(cur.fetchone()[0].tobytes(), offset, limit)
+            columns = list(slice_df.columns)
         else:
-            raise HTTPException(status_code=400, detail=f"Unsupported file type: {ext or 'unknown'}")
+            cur.execute("SELECT file_data FROM file_blobs WHERE content_hash = %s", (content_hash,))
+            raw = cur.fetchone()[0].tobytes()
+
+            if ext == ".csv":
+                df = pd.read_csv(io.StringIO(raw.decode("latin1")))
+            elif ext == ".xlsx" and row_count is not None:
+                df = read_xlsx_window(raw, offset, limit)
+            elif ext in (".xlsx", ".xls"):
+                df = pd.read_excel(io.BytesIO(raw), engine=None)
+            else:
+                raise HTTPException(status_code=400, detail=f"Unsupported file type: {ext or 'unknown'}")
 
-        total = len(df)
-        if offset >= total:
-            slice_df = df.iloc[0:0]  # empty
-        else:
-            slice_df = df.iloc[offset: offset + limit]
+            if ext == ".xlsx" and row_count is not None:
+                # already just the requested rows
+                total = row_count
+                slice_df = df
+            else:
+                total = row_count if row_count is not None else len(df)
+                if offset >= total:
+                    slice_df = df.iloc[0:0]  # empty
+                else:
+                    slice_df = df.iloc[offset: offset + limit]
+            columns = list(df.columns)
 
         return JSONResponse(content={
-            "columns": list(df.columns),
-            "rows": slice_df.to_dict(orient="records"),
+            "columns": columns,
+            "rows": json.loads(slice_df.to_json(orient="records", date_format="iso")),
             "total": int(total)
         })
 
@@ -825,13 +1270,44 @@ def preview_file(
         if 'conn' in locals(): conn.close()
         
 
+@app.get("/files/{file_id}/aggregate")
+def aggregate_file(
+    file_id: int = Path(..., description="ID of a file uploaded with mode=table"),
+    column: str = Query(..., description="Column to aggregate"),
+    op: str = Query("avg", description="count | sum | avg | min | max"),
+    group_by: str | None = Query(None, description="Optional column to group by")
+):
+    """
+    Simple aggregate computed in Postgres over an ingested upload
+    -> { column, op, group_by, rows: [...] }
+    """
+    conn = get_db_connection()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT c.table_name, c.table_columns FROM files f JOIN dataset_catalog c ON c.content_hash = f.file_hash
+                WHERE f.file_id = %s
+            """, (file_id,))
+            ingested = cur.fetchone()
+            if ingested is None:
+                raise HTTPException(status_code=404, detail="File not found or not ingested as a table")
+            table_name, table_columns = ingested
+            try:
+                rows = aggregate_table(cur, table_name, table_columns, column, op, group_by)
+            except (KeyError, ValueError) as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return {"column": column, "op": op.lower(), "group_by": group_by, "rows": rows}
+    finally:
+        conn.close()
+
+
 @app.get("/machine-learning/linear-regression")
 def run_linear_regressions(target_variable: str = Query(..., description="Target variable for regression"),
     feature_variables: list = Query(..., description="List of feature variables"),
     file_id: int = Query(..., description="ID of the uploaded CSV file")):
     try:
         print(f"Running linear regression with target: {target_variable}, features: {feature_variables}, file_id: {file_id}")
-        data = retrieve_csv_table(file_id)
+        data = load_dataset(file_id, columns=[target_variable, *feature_variables])
         res = run_linear_regression(
             data=data,
             feature_cols=feature_variables,
@@ -849,7 +1325,7 @@ def run_random_forest(target_variable: str = Query(..., description="Target vari
     file_id: int = Query(..., description="ID of the uploaded CSV file")):
     try:
         print(f"Running random forest with target: {target_variable}, features: {feature_variables}, file_id: {file_id}")
-        data = retrieve_csv_table(file_id)
+        data = load_dataset(file_id, columns=[target_variable, *feature_variables])
         res = run_rf_model(
             data=data,
             feature_cols=feature_variables,
@@ -867,7 +1343,7 @@ def run_logistic_regressions(target_variable: str = Query(..., description="Targ
     file_id: int = Query(..., description="ID of the uploaded CSV file")):
     try:
         print(f"Running logistic regression with target: {target_variable}, features: {feature_variables}, file_id: {file_id}")
-        data = retrieve_csv_table(file_id)
+        data = load_dataset(file_id, columns=[target_variable, *feature_variables])
         res = run_logistic_regression(
             data=data,
             feature_cols=feature_variables,
@@ -885,7 +1361,7 @@ def run_naive_bayes_models(target_variable: str = Query(..., description="Target
     file_id: int = Query(..., description="ID of the uploaded CSV file")):
     try:
         print(f"Running naive bayes with target: {target_variable}, features: {feature_variables}, file_id: {file_id}")
-        data = retrieve_csv_table(file_id)
+        data = load_dataset(file_id, columns=[target_variable, *feature_variables])
         res = run_naive_bayes(
             data=data,
             feature_cols=feature_variables,
@@ -902,7 +1378,7 @@ def run_gradient_boosting_endpoint(target_variable: str = Query(..., description
     file_id: int = Query(..., description="ID of the uploaded CSV file")):
     try:
         print(f"Running naive bayes with target: {target_variable}, features: {feature_variables}, file_id: {file_id}")
-        data = retrieve_csv_table(file_id)
+        data = load_dataset(file_id, columns=[target_variable, *feature_variables])
         res = run_gradient_boosting(
             data=data,
             feature_cols=feature_variables,
@@ -920,7 +1396,7 @@ def run_svr_endpoint(target_variable: str = Query(..., description="Target varia
     file_id: int = Query(..., description="ID of the uploaded CSV file")):
     try:
         print(f"Running naive bayes with target: {target_variable}, features: {feature_variables}, file_id: {file_id}")
-        data = retrieve_csv_table(file_id)
+        data = load_dataset(file_id, columns=[target_variable, *feature_variables])
         res = run_svr_model(
             data=data,
             feature_cols=feature_variables,
@@ -939,7 +1415,7 @@ def run_extra_trees_regressor_endpoint(target_variable: str = Query(..., descrip
 ):
     try:
         print(f"Running Extra Trees Regressor with target: {target_variable}, features: {feature_variables}, file_id: {file_id}")
-        data = retrieve_csv_table(file_id)
+        data = load_dataset(file_id, columns=[target_variable, *feature_variables])
         res = run_extra_trees_regressor(
             data=data,
             feature_cols=feature_variables,
@@ -961,7 +1437,7 @@ def run_elastic_net_endpoint(
 ):
     try:
         print(f"Running Elastic Net with target: {target_variable}, features: {feature_variables}, file_id: {file_id}")
-        data = retrieve_csv_table(file_id)
+        data = load_dataset(file_id, columns=[target_variable, *feature_variables])
         res = run_elastic_net_regression(
             data=data,
             feature_cols=feature_variables,
@@ -983,7 +1459,7 @@ def run_elastic_net_endpoint(
 # ):
 #     try:
 #         print(f"Running KNN with target: {target_variable}, features: {feature_variables}, file_id: {file_id}, k={n_neighbors}")
-#         data = retrieve_csv_table(file_id)
+#         data = load_dataset(file_id, columns=[target_variable, *feature_variables])
 #         res = run_knn_classifier(
 #             data=data,
 #             feature_cols=feature_variables,
@@ -0,0 +1,121 @@
+"""
+Upgrade a database created from an older setup.sql to the current schema:
+
+    python -m backend.migrate
+
+Runs setup.sql (which only creates what is missing), then moves legacy data
+into the current tables. Every step checks for the legacy layout first and runs
+in one transaction, so the script is safe to re-run and a failed run changes nothing.
+
+- files.file_data: uploads are copied into file_blobs keyed by their sha256,
+  files.file_hash is backfilled and only then is file_data dropped. Parquet
+  copies and row indexes, profiles and the like are rebuilt lazily on first use.
+- asthma_geodata / gas_geodata: every stored FeatureCollection is split into
+  geo_boundaries and geo_attributes rows (as adm1 layers, the only level they
+  held) and the old tables are dropped. They get no geo_sources row:
+  /fill_database keeps layers of unknown source as they are, while /forecast
+  recomputes and replaces forecast years the next time they are requested.
+"""
+from pathlib import Path
+
+from geopandas import GeoDataFrame
+
+from backend.db import get_db_connection
+from backend.geodata.lisa import COLUMN_MAPPINGS
+from backend.geodata.store import ASTHMA_VARIABLES, GeodataWriter
+
+SETUP_SQL = Path(__file__).with_name("setup.sql")
+
+
+def table_columns(cur, table: str) -> set[str]:
+    """Column names of table in the current schema; empty when it does not exist."""
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+    """, (table,))
+    return {name for (name,) in cur.fetchall()}
+
+
+def migrate_files(cur) -> int:
+    """
+    Move legacy files.file_data (plus the file_parquet / file_row_index columns
+    some versions added) into file_blobs. Returns the number of files rows moved.
+    """
+    columns = table_columns(cur, "files")
+    if "file_data" not in columns:
+        return 0
+    carried = [c for c in ("file_parquet", "file_row_index") if c in columns]
+    # uploads saved without bytes become empty content rather than losing their row
+    content = "COALESCE(file_data, ''::bytea)"
+    cur.execute(f"""
+        INSERT INTO file_blobs (content_hash, file_data{''.join(f', {c}' for c in carried)})
+        SELECT DISTINCT ON (1) encode(sha256({content}), 'hex'), {content}{''.join(f', {c}' for c in carried)}
+        FROM files ORDER BY 1, file_id
+        ON CONFLICT (content_hash) DO NOTHING
+    """)
+    cur.execute(f"UPDATE files SET file_hash = encode(sha256({content}), 'hex')")
+    moved = cur.rowcount
+    cur.execute(f"""
+        ALTER TABLE files
+            {''.join(f'DROP COLUMN {c}, ' for c in carried)}DROP COLUMN file_data,
+            ALTER COLUMN file_hash SET NOT NULL,
+            ADD FOREIGN KEY (file_hash) REFERENCES file_blobs(content_hash)
+    """)
+    return moved
+
+
+def legacy_layers(cur) -> list[tuple[int, str, dict]]:
+    """(year, variable, FeatureCollection) of every layer in asthma_geodata and gas_geodata."""
+    layers = []
+    if table_columns(cur, "asthma_geodata"):
+        # one layer per year, observed or forecast; the variable is whichever property it carries
+        cur.execute("SELECT asthmageo_id, asthmageo_data FROM asthma_geodata ORDER BY asthmageo_id")
+        for year, collection in cur.fetchall():
+            properties = collection["features"][0]["properties"] if collection.get("features") else {}
+            variable = next((v for v in ASTHMA_VARIABLES if v in properties), None)
+            if variable is None:
+                print(f"asthma_geodata {year}: no asthma variable, skipped")
+                continue
+            layers.append((year, variable, collection))
+    if table_columns(cur, "gas_geodata"):
+        cur.execute("SELECT gasgeo_year, gasgeo_name, gasgeo_data FROM gas_geodata ORDER BY gasgeo_year, gasgeo_name")
+        layers.extend(cur.fetchall())
+    return layers
+
+
+def migrate_geodata(cur) -> int:
+    """
+    Copy asthma_geodata / gas_geodata layers into geo_boundaries and geo_attributes,
+    keeping layers already stored there, then drop the old tables. Returns the
+    number of layers written.
+    """
+    level = "adm1"
+    writer = GeodataWriter(level, COLUMN_MAPPINGS[level]["alias"])
+    for year, variable, collection in legacy_layers(cur):
+        if collection.get("features"):
+            writer.add(GeoDataFrame.from_features(collection["features"], crs=4326), year, variable)
+    stored = writer.flush(cur)
+    cur.execute("DROP TABLE IF EXISTS asthma_geodata, gas_geodata")
+    return len(stored)
+
+
+def migrate(conn):
+    with conn, conn.cursor() as cur:
+        if table_columns(cur, "files"):
+            # setup.sql indexes files.file_hash, which legacy files tables lack
+            cur.execute("ALTER TABLE files ADD COLUMN IF NOT EXISTS file_hash CHAR(64)")
+        cur.execute(SETUP_SQL.read_text())
+        print(f"files: moved {migrate_files(cur)} uploads into file_blobs")
+        print(f"geodata: moved {migrate_geodata(cur)} layers into geo_attributes")
+
+
+def main():
+    conn = get_db_connection()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
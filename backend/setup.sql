@@ -1,39 +1,118 @@
-CREATE TABLE files (
+-- Safe to re-run. Databases created from an older version of this file are upgraded
+-- with `python -m backend.migrate`, which also runs it.
+
+-- Uploaded bytes and everything derived from them, stored once per distinct content
+CREATE TABLE IF NOT EXISTS file_blobs (
+    content_hash CHAR(64) PRIMARY KEY, -- sha256 of file_data
+    file_data BYTEA NOT NULL,
+    file_parquet BYTEA, -- typed columnar copy, parsed once at upload
+    file_row_index bigint[], -- CSV byte offset of every 1000th data row, for windowed previews
+    created_time timestamptz NOT NULL DEFAULT now()
+);
+
+-- Keep uploads uncompressed in TOAST so substring() only reads the chunks it needs
+ALTER TABLE file_blobs ALTER COLUMN file_data SET STORAGE EXTERNAL;
+
+CREATE TABLE IF NOT EXISTS files (
     file_id SERIAL PRIMARY KEY,
     file_name VARCHAR(255),
-    file_data BYTEA
+    file_hash CHAR(64) NOT NULL REFERENCES file_blobs(content_hash)
 );
+CREATE INDEX IF NOT EXISTS files_file_hash_idx ON files (file_hash);
 
-CREATE TABLE cache (
-    cache_id int,
-    cache_name VARCHAR(255),
-    cache_data JSONB,
-    updated_time timestamptz NOT NULL DEFAULT now(),
-    PRIMARY KEY (cache_id)
+-- Uploads ingested with mode=table: one typed table per content (dataset_<hash prefix>)
+CREATE TABLE IF NOT EXISTS dataset_catalog (
+    content_hash CHAR(64) PRIMARY KEY REFERENCES file_blobs(content_hash) ON DELETE CASCADE,
+    table_name VARCHAR(63) NOT NULL UNIQUE,
+    table_columns JSONB NOT NULL, -- [{name, column, type}] in file order
+    row_count bigint NOT NULL,
+    created_time timestamptz NOT NULL DEFAULT now()
 );
 
-CREATE TABLE asthma_geodata(
-    asthmageo_id int,
-    asthmageo_name VARCHAR(255),
-    asthmageo_data JSONB,
-    PRIMARY KEY(asthmageo_id),
-    CONSTRAINT unique_asthmageo_name UNIQUE (asthmageo_name);
+-- Filled at upload time so headers, dtypes and row counts don't require a re-parse
+CREATE TABLE IF NOT EXISTS dataset_profiles (
+    content_hash CHAR(64) PRIMARY KEY REFERENCES file_blobs(content_hash) ON DELETE CASCADE,
+    row_count bigint NOT NULL,
+    profile_columns JSONB NOT NULL, -- [{name, dtype, null_count, min, max, histogram}] in file order
+    created_time timestamptz NOT NULL DEFAULT now()
 );
 
-CREATE TABLE user_geodata(
-    usergeo_id int,
-    usergeo_name VARCHAR(255),
-    usergeo_data JSONB,
-    PRIMARY KEY(usergeo_id)
+-- /lisa results keyed by dataset content hash + analysis options; TTL/LRU pruned by the API
+CREATE TABLE IF NOT EXISTS lisa_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    content_hash CHAR(64) NOT NULL,
+    params JSONB NOT NULL,
+    result TEXT NOT NULL, -- GeoJSON as returned by /lisa
+    created_time timestamptz NOT NULL DEFAULT now(),
+    accessed_time timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS lisa_cache_accessed_idx ON lisa_cache (accessed_time);
+
+-- Dashboard layers: simplified polygons stored once per admin level ...
+CREATE TABLE IF NOT EXISTS geo_boundaries(
+    level VARCHAR(8) NOT NULL,
+    code VARCHAR(64) NOT NULL,
+    name VARCHAR(255),
+    geometry JSONB NOT NULL, -- GeoJSON geometry, simplified for the web
+    bbox box, -- geometry bounds, for bbox filtering
+    PRIMARY KEY(level, code)
 );
+CREATE INDEX IF NOT EXISTS geo_boundaries_bbox_idx ON geo_boundaries USING gist (bbox);
 
+-- ... and one narrow row per region, year and variable (asthma or gas)
+CREATE TABLE IF NOT EXISTS geo_attributes(
+    level VARCHAR(8) NOT NULL,
+    code VARCHAR(64) NOT NULL,
+    year int NOT NULL,
+    variable VARCHAR(255) NOT NULL,
+    value DOUBLE PRECISION,
+    local_I DOUBLE PRECISION,
+    p_value DOUBLE PRECISION,
+    cluster_label VARCHAR(16),
+    value_lower DOUBLE PRECISION, -- prediction interval of forecast values, NULL otherwise
+    value_upper DOUBLE PRECISION,
+    PRIMARY KEY(level, variable, year, code),
+    FOREIGN KEY(level, code) REFERENCES geo_boundaries(level, code)
+);
+CREATE INDEX IF NOT EXISTS geo_attributes_level_year_idx ON geo_attributes (level, year);
+-- Server-side dashboard filters (cluster label, p-value threshold)
+CREATE INDEX IF NOT EXISTS geo_attributes_cluster_idx ON geo_attributes (level, variable, year, cluster_label);
+CREATE INDEX IF NOT EXISTS geo_attributes_p_value_idx ON geo_attributes (level, variable, year, p_value);
 
-CREATE TABLE gas_geodata(
-    gasgeo_id SERIAL PRIMARY KEY,
-    gasgeo_year int,
-    gasgeo_name VARCHAR(255),
-    gasgeo_data JSONB,
-    CONSTRAINT UNIQUE_YEAR_NAME UNIQUE (gasgeo_year, gasgeo_name)
+-- Hash of the source rows each /fill_database layer was computed from; a layer is
+-- recomputed when its source changes. Layers skipped for too few values are recorded too.
+CREATE TABLE IF NOT EXISTS geo_sources(
+    level VARCHAR(8) NOT NULL,
+    year int NOT NULL,
+    variable VARCHAR(255) NOT NULL,
+    source_hash CHAR(64) NOT NULL,
+    updated_time timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY(level, variable, year)
 );
 
+-- Backfill work queue: one row per layer, claimed by `python -m backend.geodata.worker`
+-- processes on any host with SELECT ... FOR UPDATE SKIP LOCKED
+CREATE TABLE IF NOT EXISTS geo_tasks(
+    task_id BIGSERIAL PRIMARY KEY,
+    level VARCHAR(8) NOT NULL,
+    year int NOT NULL,
+    variable VARCHAR(255) NOT NULL,
+    params JSONB NOT NULL, -- source file, boundaries and analysis options
+    status VARCHAR(16) NOT NULL DEFAULT 'pending', -- pending | running | done | skipped | failed
+    attempts int NOT NULL DEFAULT 0,
+    max_attempts int NOT NULL DEFAULT 3,
+    worker VARCHAR(255),
+    heartbeat_time timestamptz,
+    last_error TEXT,
+    created_time timestamptz NOT NULL DEFAULT now(),
+    updated_time timestamptz NOT NULL DEFAULT now(),
+    UNIQUE(level, variable, year)
+);
+CREATE INDEX IF NOT EXISTS geo_tasks_claim_idx ON geo_tasks (status, task_id);
 
+CREATE TABLE IF NOT EXISTS user_geodata(
+    usergeo_id int,
+    usergeo_name VARCHAR(255),
+    usergeo_data JSONB,
+    PRIMARY KEY(usergeo_id)
+);
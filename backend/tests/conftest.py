@@ -0,0 +1,58 @@
+"""
+Tests run from the repo root (python -m pytest backend/tests). Database tests use
+the Postgres configured by the DB_* variables (see README), inside a throwaway
+schema created from setup.sql, and are skipped when no database is reachable.
+"""
+import os
+import uuid
+from pathlib import Path
+import pytest
+
+SETUP_SQL = Path(__file__).resolve().parents[1] / "setup.sql"
+
+
+@pytest.fixture(scope="session")
+def db_schema():
+    """Name of a fresh schema holding setup.sql's tables; every connection opened meanwhile uses it."""
+    try:
+        from backend.db import get_db_connection
+        get_db_connection().close()
+    except Exception as e:
+        pytest.skip(f"no test database: {e}")
+
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    previous = os.environ.get("PGOPTIONS")
+    # libpq reads PGOPTIONS on connect, so the app's own connections (and worker
+    # processes, which inherit the environment) land in the test schema too
+    os.environ["PGOPTIONS"] = f"-c search_path={schema}"
+    conn = get_db_connection()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"CREATE SCHEMA {schema}")
+            cur.execute(f"SET search_path = {schema}")
+            cur.execute(SETUP_SQL.read_text())
+        yield schema
+    finally:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.close()
+        if previous is None:
+            os.environ.pop("PGOPTIONS", None)
+        else:
+            os.environ["PGOPTIONS"] = previous
+
+
+@pytest.fixture
+def db(db_schema):
+    """A connection to the test schema, with every table emptied first."""
+    from backend.db import get_db_connection
+    conn = get_db_connection()
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT tablename FROM pg_tables WHERE schemaname = %s", (db_schema,))
+        tables = [name for (name,) in cur.fetchall()]
+        if tables:
+            cur.execute(f"TRUNCATE {', '.join(tables)} RESTART IDENTITY CASCADE")
+    try:
+        yield conn
+    finally:
+        conn.close()
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+
+from backend.training import compiled
+from backend.training.compiled import compiled_model, compiled_path, export_ensemble, load_compiled
+from backend.training.forecasting import load_model
+from backend.training.intervals import prediction_interval
+from backend.training.registry import load_bundle, save_bundle
+
+FEATURES = ["Avg NO2", "Avg PM2.5"]
+
+
+def frame(n, seed):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"Avg NO2": rng.normal(10, 2, n), "Avg PM2.5": rng.normal(8, 1, n),
+                       "State": rng.choice(["A", "B", "C"], n)})
+    df.loc[df.sample(frac=0.1, random_state=seed).index, "Avg PM2.5"] = np.nan
+    return df
+
+
+@pytest.fixture(params=[ExtraTreesRegressor, RandomForestRegressor])
+def bundle_path(request, tmp_path):
+    """A fitted preprocessing + forest pipeline saved as a bundle, with its compiled ensemble next to it."""
+    train = frame(300, 0)
+    prep = ColumnTransformer([("num", SimpleImputer(strategy="median"), FEATURES),
+                              ("cat", OneHotEncoder(handle_unknown="ignore"), ["State"])])
+    model = Pipeline([("prep", prep), ("model", request.param(n_estimators=25, random_state=0))])
+    model.fit(train, train["Avg NO2"] * 0.3 + train["State"].eq("A") + np.random.default_rng(1).normal(0, 0.2, 300))
+    path = tmp_path / "model.pkl"
+    save_bundle({"model": model, "features": FEATURES, "cat_cols": ["State"]}, path)
+    export_ensemble(model, compiled_path(path))
+    return path
+
+
+def test_compiled_ensemble_matches_the_pipeline(bundle_path):
+    pipeline = load_bundle(bundle_path)["model"]
+    ensemble = compiled_model(bundle_path)
+    assert ensemble is not None and load_model(bundle_path) is ensemble
+    X = frame(500, 2)
+
+    # same trees summed in the same order as the forest's sequential predict
+    assert np.array_equal(ensemble.predict(X, n_jobs=1), pipeline.predict(X))
+    np.testing.assert_allclose(ensemble.predict(X), pipeline.predict(X), rtol=1e-12)
+    for got, expected in zip(prediction_interval(ensemble, X, coverage=0.8), prediction_interval(pipeline, X, coverage=0.8)):
+        np.testing.assert_allclose(got, expected, rtol=1e-12)
+
+
+def test_ensembles_from_another_sklearn_fall_back_to_the_bundle(bundle_path):
+    path = compiled_path(bundle_path)
+    with np.load(path) as arrays:
+        stored = dict(arrays)
+    assert str(stored["sklearn_version"]) == compiled.sklearn.__version__
+
+    for key, value in (("sklearn_version", "0.0.1"), ("node_layout", "[]")):
+        with open(path, "wb") as f:
+            np.savez(f, **{**stored, key: np.array(value)})
+        with pytest.raises(compiled.IncompatibleEnsemble):
+            load_compiled(path)
+        assert compiled_model(bundle_path) is None
+        assert isinstance(load_model(bundle_path), Pipeline)
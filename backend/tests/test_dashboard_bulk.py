@@ -0,0 +1,46 @@
+import json
+from fastapi.testclient import TestClient
+
+
+SQUARE = {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+
+
+def insert_rows(conn, rows):
+    """rows: (code, year, variable, value, cluster_label)"""
+    with conn, conn.cursor() as cur:
+        for code in sorted({code for code, *_ in rows}):
+            cur.execute(
+                "INSERT INTO geo_boundaries (level, code, name, geometry, bbox) VALUES ('adm1', %s, %s, %s, '(1,1),(0,0)')",
+                (code, f"State {code}", json.dumps(SQUARE)))
+        for code, year, variable, value, label in rows:
+            cur.execute("""
+                INSERT INTO geo_attributes (level, code, year, variable, value, local_I, p_value, cluster_label)
+                VALUES ('adm1', %s, %s, %s, %s, 0.5, 0.01, %s)
+            """, (code, year, variable, value, label))
+
+
+def test_bulk_picks_one_asthma_variable_per_year_before_filtering(db):
+    # imported once the db fixture has skipped or connected: backend.db needs the DB_* variables
+    import backend.main as app_module
+    observed, forecast = "Asthma Prevalence%", "Predicted Asthma Prevalence %"
+    insert_rows(db, [
+        # 2020 has both: observed wins for every region, whatever the filters drop
+        ("A", 2020, observed, 10.0, "HH"),
+        ("B", 2020, observed, 11.0, "LL"),
+        ("A", 2020, forecast, 20.0, "HH"),
+        ("B", 2020, forecast, 21.0, "HH"),
+        # 2021 only has a forecast
+        ("A", 2021, forecast, 30.0, "HH"),
+        ("B", 2021, forecast, 31.0, "HH"),
+    ])
+    client = TestClient(app_module.app)
+
+    body = client.get("/dashboard/bulk", params={"variables": "asthma"}).json()
+    assert body["codes"] == ["A", "B"]
+    assert body["layers"]["asthma"]["2020"]["value"] == [10.0, 11.0]
+    assert body["layers"]["asthma"]["2021"]["value"] == [30.0, 31.0]
+
+    # B's observed row is filtered out; its forecast row must not take its place
+    body = client.get("/dashboard/bulk", params={"variables": "asthma", "years": 2020, "cluster": "HH"}).json()
+    assert body["codes"] == ["A"]
+    assert body["layers"]["asthma"]["2020"]["value"] == [10.0]
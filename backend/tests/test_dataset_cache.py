@@ -0,0 +1,29 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from backend.datasets.cache import DatasetCache
+
+
+def test_cache_hits_skip_the_database_until_the_file_is_deleted(db, monkeypatch):
+    # imported once the db fixture has skipped or connected: backend.db needs the DB_* variables
+    import backend.main as app_module
+    monkeypatch.setattr(app_module, "DATASET_CACHE", DatasetCache(max_bytes=1 << 20))
+    client = TestClient(app_module.app)
+    file_id = client.post("/upload", files={"file": ("a.csv", b"x,y\n1,2\n3,4\n")}).json()["id"]
+
+    assert app_module.load_dataset(file_id)["y"].tolist() == [2, 4]
+
+    connect = app_module.get_db_connection
+    def offline():
+        raise AssertionError("cache hit went to the database")
+    monkeypatch.setattr(app_module, "get_db_connection", offline)
+    assert app_module.load_dataset(file_id, columns=["x"])["x"].tolist() == [1, 3]
+    assert app_module.get_content_hash(file_id) == app_module.DATASET_CACHE.file_hash(file_id)
+
+    monkeypatch.setattr(app_module, "get_db_connection", connect)
+    assert client.delete(f"/delete/{file_id}").status_code == 200
+    assert app_module.DATASET_CACHE.file_hash(file_id) is None
+    with pytest.raises(HTTPException) as e:
+        app_module.load_dataset(file_id)
+    assert e.value.status_code == 404
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import ExtraTreesRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+
+from backend.training import forecasting
+from backend.training.forecasting import forecast_linear, forecast_panel, iter_forecast, run_forecast
+from backend.training.registry import save_bundle
+
+FUTURE = [2025, 2026, 2030]
+
+
+@pytest.fixture
+def history():
+    """A small panel covering each fallback: several years, one point, only NaNs, unsorted rows."""
+    rng = np.random.default_rng(0)
+    rows = [{"Year": year, "State": state, "Avg NO2": rng.normal(10, 2), "Avg PM2.5": rng.normal(8, 1)}
+            for state in ("A", "B") for year in range(2011, 2022)]
+    rows += [
+        {"Year": 2015, "State": "C", "Avg NO2": 4.0, "Avg PM2.5": np.nan},  # one point each side
+        {"Year": 2016, "State": "C", "Avg NO2": np.nan, "Avg PM2.5": 3.0},
+        {"Year": 2012, "State": "D", "Avg NO2": np.nan, "Avg PM2.5": np.nan},  # nothing to fit
+    ]
+    hist = pd.DataFrame(rows).sample(frac=1, random_state=0)
+    hist.loc[hist.sample(5, random_state=1).index, "Avg NO2"] = np.nan  # gaps inside the long series
+    return hist
+
+
+def per_region(hist, regions, features):
+    """The per-region forecast_linear loop forecast_panel replaced, in the same row order."""
+    out = {f: [] for f in features}
+    for region in regions:
+        rows = hist[hist["State"] == region]
+        for f in features:
+            values = rows[f] if f in rows.columns else pd.Series(np.nan, index=rows.index)
+            out[f].extend(forecast_linear(rows["Year"], values, FUTURE))
+    return pd.DataFrame(out)
+
+
+def test_forecast_panel_matches_per_region_linear_fits(history):
+    regions = ["A", "B", "C", "D", "E"]  # E has no history at all
+    features = ["Avg NO2", "Avg PM2.5", "Avg SO2"]  # Avg SO2 is not in the history
+    panel = forecast_panel(history, regions, FUTURE, features)
+    expected = per_region(history, regions, features)
+    assert panel.shape == (len(regions) * len(FUTURE), len(features))
+    pd.testing.assert_frame_equal(panel, expected, rtol=1e-9, atol=1e-9)
+
+
+def test_forecast_panel_is_constant_when_every_point_shares_one_year():
+    # polyfit has no unique line here (and warns); the panel documents a flat forecast at the mean
+    hist = pd.DataFrame({"Year": [2020, 2020, 2020], "State": ["A"] * 3, "Avg NO2": [1.0, 2.0, 6.0]})
+    panel = forecast_panel(hist, ["A"], FUTURE, ["Avg NO2"])
+    np.testing.assert_allclose(panel["Avg NO2"], [3.0] * len(FUTURE))
+
+
+@pytest.fixture
+def forecast_inputs(tmp_path, history):
+    """(hist_csv, model_pkl): the history above and a small bundle trained on it."""
+    train = history.dropna()
+    prep = ColumnTransformer([("num", SimpleImputer(strategy="median"), ["Avg NO2", "Avg PM2.5"]),
+                              ("cat", OneHotEncoder(handle_unknown="ignore"), ["State"])])
+    model = Pipeline([("prep", prep), ("model", ExtraTreesRegressor(n_estimators=5, random_state=0))])
+    model.fit(train[["Avg NO2", "Avg PM2.5", "State"]], train["Avg NO2"] / 2)
+    history.to_csv(tmp_path / "hist.csv", index=False)
+    save_bundle({"model": model, "features": ["Avg NO2", "Avg PM2.5"], "cat_cols": ["State"]}, tmp_path / "model.pkl")
+    return str(tmp_path / "hist.csv"), str(tmp_path / "model.pkl")
+
+
+def test_iter_forecast_scores_each_year_once_per_inputs(forecast_inputs, monkeypatch):
+    scored = []
+    predict_frame = forecasting._predict_frame
+
+    def counting(model, future, *args, **kwargs):
+        scored.extend(sorted(set(future["Year"])))
+        return predict_frame(model, future, *args, **kwargs)
+
+    monkeypatch.setattr(forecasting, "_predict_frame", counting)
+    first = dict(iter_forecast([2025, 2026], *forecast_inputs))
+    assert scored == [2025, 2026]
+
+    # only the year not seen yet is scored; the others come from the memo, run_forecast included
+    again = dict(iter_forecast([2027, 2026, 2025], *forecast_inputs))
+    assert scored == [2025, 2026, 2027]
+    assert list(again) == [2025, 2026, 2027]
+    for year in first:
+        assert again[year] is first[year]
+    result = run_forecast(2025, 2027, *forecast_inputs)
+    assert scored == [2025, 2026, 2027]
+    assert result.years == [2025, 2026, 2027]
+
+    # another interval setting is another forecast
+    dict(iter_forecast([2025], *forecast_inputs, interval=0.8))
+    assert scored == [2025, 2026, 2027, 2025]
+
+
+def test_run_forecast_wraps_the_iter_forecast_frames(forecast_inputs):
+    frames = dict(iter_forecast([2025, 2026], *forecast_inputs))
+    result = run_forecast(2025, 2026, *forecast_inputs)
+    assert result.years == [2025, 2026]
+    assert all(result["per_year_dict"][year] is frame for year, frame in frames.items())
+    pd.testing.assert_frame_equal(result.combined_df, pd.concat(frames.values(), ignore_index=True))
+    assert result.per_year_csvs[2026] == frames[2026].to_csv(index=False)
@@ -0,0 +1,81 @@
+import multiprocessing
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import psycopg2
+import pytest
+from shapely.geometry import box
+
+from backend.geodata.queue import enqueue_tasks, task_counts
+
+GRID = 6
+YEARS = range(2011, 2019)
+VARIABLE = "Avg NO2"
+
+
+@pytest.fixture
+def task_inputs(tmp_path):
+    """A GRID x GRID state geopackage and a source CSV with VARIABLE for every state and year."""
+    n = GRID * GRID
+    gpd.GeoDataFrame(
+        {"shapeID": [f"S{i:02d}" for i in range(n)], "shapeName": [f"State {i:02d}" for i in range(n)]},
+        geometry=[box(i % GRID, i // GRID, i % GRID + 1, i // GRID + 1) for i in range(n)], crs=4326,
+    ).to_file(tmp_path / "adm1.gpkg", driver="GPKG")
+    rng = np.random.default_rng(0)
+    pd.DataFrame([
+        {"Year": year, "State": f"State {i:02d}", VARIABLE: i % GRID + rng.normal(0, 0.5)}
+        for year in YEARS for i in range(n)
+    ]).to_csv(tmp_path / "source.csv", index=False)
+    return {"source": str(tmp_path / "source.csv"), "year_column": "Year", "country": "United States of America",
+            "boundaries": str(tmp_path / "adm1.gpkg"), "gas": False, "perm": 99}
+
+
+def enqueue(conn, params, max_attempts=3):
+    with conn, conn.cursor() as cur:
+        enqueue_tasks(cur, [("adm1", year, VARIABLE, params) for year in YEARS], max_attempts=max_attempts)
+
+
+def _work(kwargs):
+    from backend.geodata import worker
+    return worker.work(**kwargs)
+
+
+def test_concurrent_workers_finish_each_task_once(db, task_inputs):
+    enqueue(db, task_inputs)
+    processes = 3
+    with multiprocessing.get_context("spawn").Pool(processes) as pool:
+        results = pool.map(_work, [{"heartbeat_seconds": 1}] * processes)
+
+    assert sum(counts.get("done", 0) for counts in results) == len(YEARS)
+    assert all(set(counts) <= {"done"} for counts in results)
+    with db, db.cursor() as cur:
+        assert task_counts(cur) == {"done": len(YEARS)}
+        cur.execute("SELECT attempts, count(*) FROM geo_tasks GROUP BY attempts")
+        assert cur.fetchall() == [(1, len(YEARS))]
+        cur.execute("SELECT year, count(*) FROM geo_attributes GROUP BY year ORDER BY year")
+        assert cur.fetchall() == [(year, GRID * GRID) for year in YEARS]
+        cur.execute("SELECT count(*) FROM geo_sources")
+        assert cur.fetchone()[0] == len(YEARS)
+
+
+def test_write_errors_release_the_task(db, task_inputs, monkeypatch):
+    # imported once the db fixture has skipped or connected: backend.db needs the DB_* variables
+    from backend.geodata import worker
+    enqueue(db, task_inputs, max_attempts=2)
+
+    def broken_record_sources(cur, level, sources):
+        raise psycopg2.DataError("boom")
+
+    monkeypatch.setattr(worker, "record_sources", broken_record_sources)
+    counts = worker.work(heartbeat_seconds=1)
+
+    # every task is tried max_attempts times, in the same process, then given up on
+    assert counts == {"failed": 2 * len(YEARS)}
+    with db, db.cursor() as cur:
+        assert task_counts(cur) == {"failed": len(YEARS)}
+        cur.execute("SELECT DISTINCT last_error FROM geo_tasks")
+        assert cur.fetchall() == [("DataError: boom",)]
+        # the failed writes were rolled back
+        cur.execute("SELECT count(*) FROM geo_attributes")
+        assert cur.fetchone()[0] == 0
@@ -0,0 +1,42 @@
+import threading
+import time
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_clear_drops_entries_and_bodies_read_before_it(db_schema):
+    # imported once db_schema has skipped or connected: backend.db needs the DB_* variables
+    from backend.geodata.layer_cache import LayerCache
+    cache = LayerCache(max_bytes=1 << 20)
+    cache.put(("adm1", 2020, "asthma"), b"cached")
+    stale = cache.generation(("adm1", 2021, "asthma"))
+    cache.clear()
+    assert cache.get(("adm1", 2020, "asthma")) is None and cache.stats()["bytes"] == 0
+    cache.put(("adm1", 2021, "asthma"), b"read before clear", generation=stale)
+    assert cache.get(("adm1", 2021, "asthma")) is None
+
+
+def test_listener_clears_the_cache_on_every_reconnect(db, monkeypatch):
+    from backend.geodata import layer_cache
+    key = ("adm1", 2020, "asthma")
+    cache = layer_cache.LayerCache(max_bytes=1 << 20)
+    connections, connect = [], layer_cache.get_db_connection
+    monkeypatch.setattr(layer_cache, "get_db_connection", lambda: connections.append(connect()) or connections[-1])
+    cache.put(key, b"cached before the listener started")
+    stop = threading.Event()
+    listener = threading.Thread(target=layer_cache.listen_for_invalidations, args=(cache, stop, 0.1), daemon=True)
+    listener.start()
+    try:
+        wait_for(lambda: cache.get(key) is None)
+        # layers written while the listener is down are never announced to it
+        cache.put(key, b"written during the outage")
+        connections[0].close()
+        wait_for(lambda: len(connections) > 1 and cache.get(key) is None)
+    finally:
+        stop.set()
+        listener.join(5)
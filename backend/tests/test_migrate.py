@@ -0,0 +1,118 @@
+import hashlib
+import uuid
+
+import pytest
+
+LEGACY_FILES = """
+CREATE TABLE files (
+    file_id SERIAL PRIMARY KEY,
+    file_name VARCHAR(255),
+    file_data BYTEA
+);
+"""
+
+
+@pytest.fixture
+def legacy(db_schema):
+    """A connection to an empty schema of its own, for building an old-layout database in."""
+    from backend.db import get_db_connection
+    schema = f"legacy_{uuid.uuid4().hex[:12]}"
+    conn = get_db_connection()
+    with conn, conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}")
+        cur.execute(f"SET search_path = {schema}")
+    try:
+        yield conn
+    finally:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.close()
+
+
+def test_legacy_uploads_move_into_file_blobs(legacy):
+    from backend.migrate import migrate
+    uploads = [("a.csv", b"x,y\n1,2\n"), ("copy of a.csv", b"x,y\n1,2\n"), ("b.csv", b"z\n3\n")]
+    with legacy, legacy.cursor() as cur:
+        cur.execute(LEGACY_FILES)
+        for name, data in uploads:
+            cur.execute("INSERT INTO files (file_name, file_data) VALUES (%s, %s)", (name, data))
+
+    migrate(legacy)
+    migrate(legacy)  # re-running is a no-op
+
+    with legacy, legacy.cursor() as cur:
+        cur.execute("""
+            SELECT f.file_id, f.file_name, f.file_hash, b.file_data
+            FROM files f JOIN file_blobs b ON b.content_hash = f.file_hash ORDER BY f.file_id
+        """)
+        rows = [(file_id, name, file_hash, bytes(data)) for file_id, name, file_hash, data in cur.fetchall()]
+        assert rows == [(i + 1, name, hashlib.sha256(data).hexdigest(), data) for i, (name, data) in enumerate(uploads)]
+        cur.execute("SELECT count(*) FROM file_blobs")
+        assert cur.fetchone()[0] == 2
+        cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'files' ORDER BY ordinal_position
+        """)
+        assert [name for (name,) in cur.fetchall()] == ["file_id", "file_name", "file_hash"]
+        # new uploads keep numbering after the migrated ones
+        cur.execute("INSERT INTO files (file_name, file_hash) VALUES ('c.csv', %s) RETURNING file_id", (rows[0][2],))
+        assert cur.fetchone()[0] == len(uploads) + 1
+
+
+LEGACY_GEODATA = """
+CREATE TABLE asthma_geodata(
+    asthmageo_id int PRIMARY KEY,
+    asthmageo_name VARCHAR(255),
+    asthmageo_data JSONB
+);
+CREATE TABLE gas_geodata(
+    gasgeo_id SERIAL PRIMARY KEY,
+    gasgeo_year int,
+    gasgeo_name VARCHAR(255),
+    gasgeo_data JSONB
+);
+"""
+
+
+def collection(variable, values):
+    """A layer as the old run_lisa_forecast stored it: one unit square per state, side by side."""
+    return {"type": "FeatureCollection", "features": [
+        {"id": str(i), "type": "Feature",
+         "properties": {"code": f"S{i}", "state": f"State {i}", variable: value,
+                        "local_I": 0.5, "p_value": 0.01, "cluster_label": "HH"},
+         "geometry": {"type": "Polygon", "coordinates": [[[i, 0], [i + 1, 0], [i + 1, 1], [i, 1], [i, 0]]]}}
+        for i, value in enumerate(values)
+    ]}
+
+
+def test_legacy_layers_move_into_geo_tables(legacy):
+    from psycopg2.extras import Json
+    from backend.migrate import migrate
+    with legacy, legacy.cursor() as cur:
+        cur.execute(LEGACY_FILES + LEGACY_GEODATA)
+        cur.execute("INSERT INTO asthma_geodata VALUES (2015, 'asthma_forecast_2015', %s), (2030, 'asthma_forecast_2030', %s)",
+                    (Json(collection("Asthma Prevalence%", [9.0, 10.0])),
+                     Json(collection("Predicted Asthma Prevalence %", [11.0, 12.0]))))
+        cur.execute("INSERT INTO gas_geodata (gasgeo_year, gasgeo_name, gasgeo_data) VALUES (2015, 'Avg NO2', %s)",
+                    (Json(collection("Avg NO2", [20.0, None])),))
+
+    migrate(legacy)
+    migrate(legacy)
+
+    with legacy, legacy.cursor() as cur:
+        cur.execute("SELECT code, name, bbox::text FROM geo_boundaries WHERE level = 'adm1' ORDER BY code")
+        assert cur.fetchall() == [("S0", "State 0", "(1,1),(0,0)"), ("S1", "State 1", "(2,1),(1,0)")]
+        cur.execute("""
+            SELECT year, variable, code, value, local_I, p_value, cluster_label FROM geo_attributes
+            WHERE level = 'adm1' ORDER BY year, variable, code
+        """)
+        assert cur.fetchall() == [
+            (2015, "Asthma Prevalence%", "S0", 9.0, 0.5, 0.01, "HH"),
+            (2015, "Asthma Prevalence%", "S1", 10.0, 0.5, 0.01, "HH"),
+            (2015, "Avg NO2", "S0", 20.0, 0.5, 0.01, "HH"),
+            (2015, "Avg NO2", "S1", None, 0.5, 0.01, "HH"),
+            (2030, "Predicted Asthma Prevalence %", "S0", 11.0, 0.5, 0.01, "HH"),
+            (2030, "Predicted Asthma Prevalence %", "S1", 12.0, 0.5, 0.01, "HH"),
+        ]
+        cur.execute("SELECT count(*) FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE '%geodata'")
+        assert cur.fetchone()[0] == 1  # only user_geodata is left
@@ -0,0 +1,90 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import ExtraTreesRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+
+# prediction.py imports its siblings directly, as when run from backend/training
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "training"))
+import prediction  # noqa: E402
+from registry import save_bundle  # noqa: E402
+
+FEATURES = ["Avg NO2", "Avg PM2.5"]
+CAT_COLS = ["State", "Year"]
+CHUNK = 50
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    rng = np.random.default_rng(0)
+    train = pd.DataFrame({
+        "State": rng.choice(["A", "B", "C"], 200), "Year": rng.integers(2015, 2025, 200),
+        "Avg NO2": rng.normal(10, 2, 200), "Avg PM2.5": rng.normal(8, 1, 200),
+    })
+    prep = ColumnTransformer([("num", SimpleImputer(strategy="median"), FEATURES),
+                              ("cat", OneHotEncoder(handle_unknown="ignore"), CAT_COLS)])
+    model = Pipeline([("prep", prep), ("model", ExtraTreesRegressor(n_estimators=10, random_state=0))])
+    model.fit(train[FEATURES + CAT_COLS], train["Avg NO2"] * 0.5 + rng.normal(0, 0.1, 200))
+    path = tmp_path / "model.pkl"
+    save_bundle({"model": model, "features": FEATURES, "cat_cols": CAT_COLS, "with_fixed_effects": True}, path)
+    return str(path)
+
+
+def test_parquet_output_keeps_one_schema_across_chunks(tmp_path, model_path):
+    """
+    The first chunk has integer features and extra columns and an all-empty Note
+    column; later chunks bring decimals, NaNs and text into the same columns.
+    """
+    n = 4 * CHUNK
+    first = np.arange(n) < CHUNK
+    source = pd.DataFrame({
+        "Year": 2025 + np.arange(n) % 3, "State": np.array(["A", "B", "C", "D"])[np.arange(n) % 4],
+        "Avg NO2": np.where(first, np.arange(n) % 7 + 8, np.arange(n) % 7 + 8.25),
+        "Avg PM2.5": np.where(first, 8, np.where(np.arange(n) % 5 == 0, np.nan, 7.5)),
+        "Population": np.where(first, 1000, np.where(np.arange(n) % 2 == 0, np.nan, 1000.5)),
+        "Note": np.where(first, None, "revised"),
+    })
+    source.to_csv(tmp_path / "future.csv", index=False)
+    output = tmp_path / "predictions.parquet"
+
+    rows = prediction.score_files([str(tmp_path / "future.csv")], str(output), model_path=model_path,
+                                  chunk_size=CHUNK, workers=2)
+
+    assert rows == n
+    assert pq.ParquetFile(output).metadata.num_row_groups == 4
+    schema = pq.read_schema(output)
+    assert [(f.name, str(f.type)) for f in schema] == [
+        ("Year", "int64"), ("State", "string"), (prediction.TARGET, "double"), ("Avg NO2", "double"),
+        ("Avg PM2.5", "double"), ("Population", "double"), ("Note", "string"),
+    ]
+    got = pd.read_parquet(output)
+    expected = prediction.load_bundle(model_path)["model"].predict(pd.read_csv(tmp_path / "future.csv")[FEATURES + CAT_COLS])
+    np.testing.assert_allclose(got[prediction.TARGET], expected)
+    assert got["Population"].isna().sum() == 3 * CHUNK // 2
+    assert got["Note"].isna().sum() == CHUNK and (got["Note"][CHUNK:] == "revised").all()
+
+
+def test_scores_with_the_compiled_ensemble_when_there_is_one(tmp_path, model_path):
+    from compiled import CompiledEnsemble, compiled_path, export_ensemble
+    pipeline = prediction.load_bundle(model_path)["model"]
+    assert prediction.load_model(model_path) is pipeline
+    export_ensemble(pipeline, compiled_path(model_path))
+    assert isinstance(prediction.load_model(model_path), CompiledEnsemble)
+
+    rng = np.random.default_rng(1)
+    source = pd.DataFrame({"Year": rng.integers(2025, 2028, 3 * CHUNK), "State": rng.choice(["A", "B"], 3 * CHUNK),
+                           "Avg NO2": rng.normal(10, 2, 3 * CHUNK)})  # Avg PM2.5 is missing: NaN, imputed
+    source.to_csv(tmp_path / "future.csv", index=False)
+    for workers in (1, 2):
+        output = tmp_path / f"predictions_{workers}.csv"
+        prediction.score_files([str(tmp_path / "future.csv")], str(output), model_path=model_path,
+                               chunk_size=CHUNK, workers=workers)
+        expected = pipeline.predict(source.assign(**{"Avg PM2.5": np.nan})[FEATURES + CAT_COLS])
+        np.testing.assert_allclose(pd.read_csv(output)[prediction.TARGET], expected, rtol=1e-12)
@@ -0,0 +1,60 @@
+import io
+
+import pandas as pd
+import pytest
+
+from backend.datasets.row_index import build_row_index, read_csv_window, read_parquet_window, window_blocks
+
+STRIDE = 3
+
+
+def csv_bytes(newline: str, trailing_newline: bool) -> bytes:
+    rows = ["id,name,value"]
+    for i in range(17):
+        name = f'"multi\nline {i}"' if i % 4 == 1 else f'"quoted, ""{i}"""' if i % 5 == 2 else f"row {i}"
+        rows.append(f"{i},{name},{i * 1.5}")
+        if i == 8:
+            rows.append("")  # blank lines are skipped like read_csv skips them
+    text = newline.join(rows) + (newline if trailing_newline else "")
+    return text.encode()
+
+
+def preview(raw: bytes, offset: int, limit: int) -> pd.DataFrame:
+    """What /preview reads for an indexed CSV: the header bytes plus the byte range of the covering blocks."""
+    offsets = build_row_index(raw, stride=STRIDE)
+    first, skip, end = window_blocks(offset, limit, stride=STRIDE)
+    # Postgres arrays are NULL past their end, as the endpoint's file_row_index[n] lookups are
+    start = offsets[first] if first < len(offsets) else None
+    stop = offsets[end] if end < len(offsets) else None
+    body = b"" if start is None else raw[start:stop]
+    return read_csv_window(raw[:offsets[0]], body, skip, limit)
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+@pytest.mark.parametrize("trailing_newline", [True, False])
+def test_windows_match_read_csv(newline, trailing_newline):
+    raw = csv_bytes(newline, trailing_newline)
+    full = pd.read_csv(io.BytesIO(raw))
+    assert len(full) == 17
+    for offset in range(0, 20):
+        for limit in (1, 2, 3, 4, 7, 50):
+            got = preview(raw, offset, limit).reset_index(drop=True)
+            expected = full.iloc[offset: offset + limit].reset_index(drop=True)
+            pd.testing.assert_frame_equal(got, expected, check_dtype=False, obj=f"rows {offset}+{limit}")
+
+
+def test_index_ends_with_the_file_length_when_the_last_block_is_full():
+    raw = b"a\n1\n2\n3\n"
+    assert build_row_index(raw, stride=STRIDE) == [2, 8]
+    assert build_row_index(raw + b"4\n", stride=STRIDE) == [2, 8]
+
+
+def test_parquet_windows_read_only_the_overlapping_row_groups():
+    df = pd.DataFrame({"id": range(23), "name": [f"row {i}" for i in range(23)]})
+    buf = io.BytesIO()
+    df.to_parquet(buf, index=False, row_group_size=5)
+    for offset in range(0, 26):
+        for limit in (1, 4, 5, 11, 50):
+            got, total = read_parquet_window(buf.getvalue(), offset, limit)
+            assert total == 23
+            pd.testing.assert_frame_equal(got, df.iloc[offset: offset + limit].reset_index(drop=True))
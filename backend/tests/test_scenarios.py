@@ -0,0 +1,37 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.training.scenarios import parse_scenarios
+
+
+def test_parse_scenarios_accepts_numbers_and_whole_years():
+    assert parse_scenarios([{"name": "a", "changes": {"Avg PM2.5": -20, "Avg NO2": 5.5}, "by_year": 2030.0}]) == [
+        {"name": "a", "changes": {"Avg PM2.5": -20.0, "Avg NO2": 5.5}, "by_year": 2030}
+    ]
+
+
+@pytest.mark.parametrize("spec", [
+    {"changes": {"Avg PM2.5": True}},
+    {"changes": {"Avg PM2.5": float("nan")}},
+    {"changes": {"Avg PM2.5": "-20"}},
+    {"changes": {}, "by_year": True},
+    {"changes": {}, "by_year": {"2030": 1}},
+    {"changes": {}, "by_year": "2030"},
+    {"changes": {}, "by_year": 2030.5},
+    {"changes": {}, "by_year": float("inf")},
+])
+def test_parse_scenarios_rejects_non_numbers(spec):
+    with pytest.raises(ValueError):
+        parse_scenarios([spec])
+
+
+def test_invalid_scenarios_are_422(db_schema):
+    # imported once db_schema has skipped or connected: backend.db needs the DB_* variables
+    import backend.main as app_module
+    client = TestClient(app_module.app)
+    for spec in ({"changes": {}, "by_year": {"2030": 1}}, {"changes": {"Avg PM2.5": False}}):
+        response = client.post("/scenarios", data={"scenarios": json.dumps([spec])})
+        assert response.status_code == 422
+        assert response.json()["detail"].startswith("Invalid scenarios: ")
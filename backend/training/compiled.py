@@ -0,0 +1,199 @@
+"""
+Compact export of the tuned tree-ensemble bundles.
+
+A fitted RandomForest/ExtraTrees pipeline is flattened into one .npz of
+concatenated node arrays (child indices, split feature, threshold, leaf value)
+next to the bundle, plus the pickled preprocessing steps. Loading rebuilds the
+Cython trees straight from those arrays, without unpickling the forest, and
+prediction calls every tree directly instead of going through the forest's
+per-tree joblib dispatch. Results equal the original model's predict.
+
+The trees are rebuilt through sklearn's private Tree state, so each file records
+the sklearn version and node layout that wrote it and is refused (callers fall
+back to the pickled bundle) when either differs from the running sklearn.
+
+Self-contained (numpy/sklearn only) so it imports both as a sibling module from
+backend/training scripts and as backend.training.compiled.
+"""
+import os
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import scipy.sparse as sp
+import sklearn
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.tree._tree import NODE_DTYPE, Tree
+
+
+FORMAT_VERSION = 2
+
+_loaded: dict[str, tuple[tuple, "CompiledEnsemble | IncompatibleEnsemble"]] = {}
+_lock = threading.Lock()
+
+
+def compiled_path(model_path) -> Path:
+    """Compiled ensemble written next to a bundle: best_ensemble.pkl -> best_ensemble.trees.npz"""
+    p = Path(model_path)
+    return p.with_name(f"{p.stem}.trees.npz")
+
+
+class IncompatibleEnsemble(ValueError):
+    """A compiled ensemble written by another format version, sklearn version or tree node layout."""
+
+
+def _node_layout() -> str:
+    return str(NODE_DTYPE.descr)
+
+
+def _split(model):
+    if isinstance(model, Pipeline):
+        return (model[:-1] if len(model.steps) > 1 else None), model[-1]
+    return None, model
+
+
+def export_ensemble(model, path) -> Path:
+    """
+    Write a fitted single-output RandomForest/ExtraTrees regressor (optionally the
+    last step of a Pipeline) to path as uncompressed node arrays. Raises
+    ValueError for any other model.
+    """
+    prep, ensemble = _split(model)
+    if not isinstance(ensemble, (RandomForestRegressor, ExtraTreesRegressor)) or ensemble.n_outputs_ != 1:
+        raise ValueError(f"{type(ensemble).__name__} cannot be compiled; expected a single-output forest regressor")
+    trees = [est.tree_ for est in ensemble.estimators_]
+    states = [t.__getstate__() for t in trees]
+    nodes = np.concatenate([s["nodes"] for s in states])
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        np.savez(
+            f,
+            format_version=np.int32(FORMAT_VERSION),
+            sklearn_version=np.array(sklearn.__version__),
+            node_layout=np.array(_node_layout()),
+            n_features=np.int64(ensemble.n_features_in_),
+            offsets=np.concatenate([[0], np.cumsum([t.node_count for t in trees])]).astype(np.int64),
+            max_depth=np.array([t.max_depth for t in trees], dtype=np.int32),
+            left=nodes["left_child"].astype(np.int32),
+            right=nodes["right_child"].astype(np.int32),
+            feature=nodes["feature"].astype(np.int32),
+            threshold=nodes["threshold"],
+            missing_left=nodes["missing_go_to_left"],
+            value=np.concatenate([s["values"][:, 0, 0] for s in states]),
+            prep=np.frombuffer(pickle.dumps(prep), dtype=np.uint8),
+        )
+    return path
+
+
+class CompiledEnsemble:
+    """Preprocessing plus flat trees; predict() averages the trees like the forest does."""
+
+    def __init__(self, prep, trees: list, n_features: int):
+        self.prep, self.trees, self.n_features = prep, trees, n_features
+
+    @classmethod
+    def from_arrays(cls, arrays) -> "CompiledEnsemble":
+        if int(arrays["format_version"]) != FORMAT_VERSION:
+            raise IncompatibleEnsemble(f"unsupported compiled ensemble format {int(arrays['format_version'])}")
+        if str(arrays["sklearn_version"]) != sklearn.__version__:
+            raise IncompatibleEnsemble(
+                f"written by scikit-learn {arrays['sklearn_version']}, running {sklearn.__version__}")
+        if str(arrays["node_layout"]) != _node_layout():
+            raise IncompatibleEnsemble("written with a different sklearn tree node layout")
+        n_features = int(arrays["n_features"])
+        offsets, max_depth = arrays["offsets"], arrays["max_depth"]
+        left, right, feature = arrays["left"], arrays["right"], arrays["feature"]
+        threshold, missing_left, value = arrays["threshold"], arrays["missing_left"], arrays["value"]
+        trees = []
+        for i in range(len(max_depth)):
+            lo, hi = offsets[i], offsets[i + 1]
+            nodes = np.zeros(hi - lo, dtype=NODE_DTYPE)
+            nodes["left_child"], nodes["right_child"] = left[lo:hi], right[lo:hi]
+            nodes["feature"], nodes["threshold"] = feature[lo:hi], threshold[lo:hi]
+            nodes["missing_go_to_left"] = missing_left[lo:hi]
+            tree = Tree(n_features, np.ones(1, dtype=np.intp), 1)
+            tree.__setstate__({"max_depth": int(max_depth[i]), "node_count": int(hi - lo), "nodes": nodes,
+                               "values": np.ascontiguousarray(value[lo:hi]).reshape(-1, 1, 1)})
+            trees.append(tree)
+        return cls(pickle.loads(arrays["prep"].tobytes()), trees, n_features)
+
+    def _transform(self, X):
+        Xt = self.prep.transform(X) if self.prep is not None else X
+        # what DecisionTreeRegressor.predict converts to before walking the tree
+        return sp.csr_matrix(Xt, dtype=np.float32) if sp.issparse(Xt) else np.ascontiguousarray(Xt, dtype=np.float32)
+
+    def _map_trees(self, fn, n_jobs):
+        """fn(start, stop) over contiguous tree ranges, on threads (tree traversal releases the GIL)."""
+        n_jobs = max(1, min(n_jobs or os.cpu_count() or 1, len(self.trees)))
+        bounds = np.linspace(0, len(self.trees), n_jobs + 1).astype(int)
+        if n_jobs == 1:
+            return [fn(0, len(self.trees))]
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            return list(pool.map(fn, bounds[:-1], bounds[1:]))
+
+    def tree_predictions(self, X, n_jobs: int | None = None) -> np.ndarray:
+        """Per-tree predictions as an (n_trees, n_rows) array."""
+        Xt = self._transform(X)
+        out = np.empty((len(self.trees), Xt.shape[0]))
+
+        def run(start, stop):
+            for i in range(start, stop):
+                out[i] = self.trees[i].predict(Xt)[:, 0]
+
+        self._map_trees(run, n_jobs)
+        return out
+
+    def predict(self, X, n_jobs: int | None = None) -> np.ndarray:
+        Xt = self._transform(X)
+
+        def run(start, stop):
+            total = np.zeros(Xt.shape[0])
+            for i in range(start, stop):
+                total += self.trees[i].predict(Xt)[:, 0]
+            return total
+
+        return np.sum(self._map_trees(run, n_jobs), axis=0) / len(self.trees)
+
+
+def load_compiled(path) -> CompiledEnsemble:
+    """
+    The compiled ensemble at path, loaded once per process and reloaded when the
+    file changes. Raises IncompatibleEnsemble (also remembered per file version)
+    when this sklearn cannot rebuild its trees.
+    """
+    key = os.path.abspath(path)
+    st = os.stat(key)
+    version = (st.st_mtime_ns, st.st_size)
+    with _lock:
+        cached = _loaded.get(key)
+        if cached is not None and cached[0] == version:
+            if isinstance(cached[1], IncompatibleEnsemble):
+                raise cached[1]
+            return cached[1]
+        try:
+            with np.load(key) as arrays:
+                compiled = CompiledEnsemble.from_arrays(arrays)
+        except IncompatibleEnsemble as e:
+            print(f"[WARN] Not using {key}: {e}")
+            _loaded[key] = (version, e)
+            raise
+        _loaded[key] = (version, compiled)
+        return compiled
+
+
+def compiled_model(model_path) -> CompiledEnsemble | None:
+    """
+    The ensemble compiled next to the bundle at model_path, when it is at least as
+    new as the bundle and this sklearn can load it; None means score with the bundle.
+    """
+    path = compiled_path(model_path)
+    if not path.exists() or path.stat().st_mtime_ns < Path(model_path).stat().st_mtime_ns:
+        return None
+    try:
+        return load_compiled(path)
+    except IncompatibleEnsemble:
+        return None
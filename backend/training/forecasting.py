@@ -1,11 +1,19 @@
 # forecast_future_years.py
 # Hardcoded, final version (fixed & hardened)
 
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import cached_property
 import numpy as np
 import pandas as pd
-import joblib
 from pathlib import Path
 
+from backend.training.registry import load_bundle, bundle_metadata, file_sha256
+from backend.training.intervals import prediction_interval
+from backend.training.compiled import compiled_model
+
 # =========================
 # CONFIG (edit as needed)
 # =========================
@@ -14,6 +22,26 @@ HIST_CSV   = f"{DIR}ml_dataset_smoking.csv"         # historical dataset (Year,
 MODEL_PKL  = f"{DIR}models/best_ensemble.pkl"       # trained model bundle from tuning
 #START_YEAR = 2025
 #END_YEAR   = 2027
+COUNTRY    = "United States of America"             # Country of forecast rows whose region is below adm0
+FORECAST_MEMO_SIZE = 64  # forecast years (one frame each) kept per process
+INTERVAL_COLUMNS = ("value_lower", "value_upper")   # prediction interval bounds, when requested
+
+# Per admin level: historical dataset, model bundle trained on it, the dataset's region
+# key column, and how forecasts join that level's boundaries for LISA. County names
+# repeat across states, so adm2 regions are boundary codes: the County column of the
+# county dataset must hold the geoBoundaries ADM2 shapeID of each county (the `code`
+# of GPKG_PATHS["adm2"]), not its name. Neither ml_dataset_county.csv nor
+# best_ensemble_county.pkl ships with the repo; build the dataset with those codes
+# and save a bundle trained on it (same keys as tuning.py writes) before forecasting
+# adm2. /forecast and /scenarios refuse with a 400 when the regions do not match.
+FORECAST_LEVELS = {
+    "adm1": {"hist_csv": HIST_CSV, "model_pkl": MODEL_PKL, "region_col": "State", "join_by": "name"},
+    "adm2": {"hist_csv": f"{DIR}ml_dataset_county.csv", "model_pkl": f"{DIR}models/best_ensemble_county.pkl",
+             "region_col": "County", "join_by": "code"},
+}
+
+_memo: OrderedDict = OrderedDict()
+_memo_lock = threading.Lock()
 
 # =========================
 
@@ -39,27 +67,64 @@ def forecast_linear(years, values, future_years):
     else:
         return np.full_like(fy, np.nan, dtype=float)
 
+def forecast_panel(hist_df, regions, years_future, features, region_col="State"):
+    """
+    Linear trend forecasts for every region x feature at once.
+    Per (region, feature) series this is the least-squares line forecast_linear
+    fits, computed in closed form from grouped sums, with the same fallbacks:
+      - >=2 points: linear fit (a constant if they all share one year)
+      - 1 point: carry forward
+      - 0 points / feature missing from hist_df: NaN
+    Returns a DataFrame of the features in build_future_grid row order
+    (regions x years_future).
+    """
+    features = list(features)
+    fy = np.asarray(years_future, dtype=float)
+    out = np.full((len(regions), fy.size, len(features)), np.nan)
+    present = [i for i, f in enumerate(features) if f in hist_df.columns]
+    if present and len(regions) and fy.size:
+        codes = pd.Categorical(hist_df[region_col], categories=regions).codes
+        x = pd.to_numeric(hist_df["Year"], errors="coerce").to_numpy(dtype=float)
+        keep = (codes >= 0) & ~np.isnan(x)
+        codes, x = codes[keep], x[keep]
+        y = hist_df[[features[i] for i in present]].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)[keep]
+
+        # centre years so the sums don't lose precision
+        x0 = x.mean() if x.size else 0.0
+        x = (x - x0)[:, None]
+        m = ~np.isnan(y)
+        yz = np.where(m, y, 0.0)
+        xm = np.where(m, x, 0.0)
+
+        def grouped(a):
+            sums = np.zeros((len(regions), a.shape[1]))
+            np.add.at(sums, codes, a)
+            return sums
+
+        n, sx, sy, sxx, sxy = (grouped(a) for a in (m.astype(float), xm, yz, xm * xm, xm * yz))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            denom = n * sxx - sx * sx
+            fit = (n >= 2) & (denom > 1e-12 * np.maximum(n * sxx, 1.0))
+            slope = np.where(fit, (n * sxy - sx * sy) / np.where(fit, denom, 1.0), 0.0)
+            intercept = np.where(n > 0, (sy - slope * sx) / np.where(n > 0, n, 1.0), np.nan)
+        # (regions, years, features)
+        out[:, :, present] = intercept[:, None, :] + slope[:, None, :] * (fy - x0)[None, :, None]
+    return pd.DataFrame(out.reshape(-1, len(features)), columns=features)
+
 def forecast_feature_per_state(hist_df, states, years_future, feature_name):
     """
-    Forecast a single numeric feature per state across future years using forecast_linear.
+    Forecast a single numeric feature per state across future years (see forecast_panel).
     Returns a Series aligned to (states x years_future) row order.
     """
-    preds_all = []
-    for s in states:
-        sub = hist_df.loc[hist_df["State"] == s, ["Year"]].copy()
-        if feature_name in hist_df.columns:
-            sub[feature_name] = hist_df.loc[hist_df["State"] == s, feature_name].values
-        # arrays
-        yrs  = sub["Year"].to_numpy()
-        vals = sub[feature_name].to_numpy(dtype=float) if feature_name in sub.columns else np.array([])
-        preds = forecast_linear(yrs, vals, np.array(years_future, dtype=float))
-        preds_all.append(preds)
-    return pd.Series(np.vstack(preds_all).ravel()) if preds_all else pd.Series(dtype=float)
-
-def build_future_grid(states, years_future):
-    """Create a DataFrame with all State × Year combinations for target years."""
-    rows = [{"Year": yf, "State": s} for s in states for yf in years_future]
-    return pd.DataFrame(rows)
+    return forecast_panel(hist_df, states, years_future, [feature_name])[feature_name]
+
+def build_future_grid(regions, years_future, region_col="State"):
+    """Create a DataFrame with all region × Year combinations for target years, region-major."""
+    years_future = list(years_future)
+    return pd.DataFrame({
+        "Year": np.tile(np.asarray(years_future), len(regions)),
+        region_col: np.repeat(np.asarray(regions, dtype=object), len(years_future)),
+    })
 
 def main(START_YEAR: int, END_YEAR: int):
     # 1) Load historical data
@@ -79,7 +144,7 @@ def main(START_YEAR: int, END_YEAR: int):
         raise ValueError("No pollutant feature columns found (expected columns starting with 'Avg ').")
 
     # 2) Load trained model bundle and discover exact features used
-    bundle = joblib.load(MODEL_PKL)
+    bundle = load_bundle(MODEL_PKL)  # cached per process, reloaded when the file changes
     model = bundle["model"]
     feat = bundle.get("features", pollutant_cols)  # numeric features the model expects
     cat  = bundle.get("cat_cols", []) or []        # categorical features (e.g., State, Year)
@@ -93,18 +158,14 @@ def main(START_YEAR: int, END_YEAR: int):
     states = sorted(hist["State"].dropna().unique().tolist())
     future = build_future_grid(states, years_future)
 
-    # 4) Forecast every pollutant feature per state
-    for col in pollutant_cols:
-        future[col] = forecast_feature_per_state(hist, states, years_future, col).values
-
-    # 5) Forecast any additional NON-Avg numeric features expected by the model
-    #    (e.g., "Smoking Prevalence %"). If not in history, create as NaN so the model's imputer can handle it.
+    # 4) Forecast every pollutant feature per state, plus any additional NON-Avg numeric
+    #    features expected by the model (e.g., "Smoking Prevalence %").
+    #    If not in history, they come back NaN so the model's imputer can handle it.
     extra_numeric_feats = [c for c in feat if (not c.startswith("Avg ")) and (c not in cat)]
-    for col in extra_numeric_feats:
-        if col in hist.columns:
-            future[col] = forecast_feature_per_state(hist, states, years_future, col).values
-        else:
-            future[col] = np.nan  # numeric missing
+    trend_cols = pollutant_cols + [c for c in extra_numeric_feats if c not in pollutant_cols]
+    trends = forecast_panel(hist, states, years_future, trend_cols)
+    for col in trend_cols:
+        future[col] = trends[col].to_numpy()
 
     # 6) Ensure categorical columns required by the model exist (State/Year usually already present)
     for c in cat:
@@ -153,42 +214,137 @@ def main(START_YEAR: int, END_YEAR: int):
     print(future[ordered].head(10).to_string(index=False))
 
 
+class _PerYearCsvs(Mapping):
+    """year -> CSV text, serialized on first access."""
+
+    def __init__(self, frames: dict):
+        self._frames = frames
+        self._text = {}
+
+    def __getitem__(self, year):
+        if year not in self._text:
+            self._text[year] = self._frames[year].to_csv(index=False)
+        return self._text[year]
+
+    def __iter__(self):
+        return iter(self._frames)
+
+    def __len__(self):
+        return len(self._frames)
+
+
+class ForecastResult:
+    """
+    Output of run_forecast: the per-year frames iter_forecast yields, as they are.
+    The combined frame, CSV text and files on disk are produced when first asked for.
+    Still readable like the old dict: result["per_year_frames"], result["years"], ...
+    """
+
+    def __init__(self, per_year_dict: dict):
+        self.per_year_dict = per_year_dict  # dict[year] -> DataFrame, in year order
+
+    @cached_property
+    def combined_df(self) -> pd.DataFrame:
+        """every year's rows in one frame, in year order"""
+        frames = list(self.per_year_dict.values())
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["Year"])
+
+    @cached_property
+    def per_year_frames(self) -> list:
+        """“array” of DataFrames, in year order"""
+        return list(self.per_year_dict.values())
+
+    @cached_property
+    def years(self) -> list:
+        return list(self.per_year_dict)
+
+    @cached_property
+    def per_year_csvs(self) -> Mapping:
+        """CSV text blobs if you need to upload/send"""
+        return _PerYearCsvs(self.per_year_dict)
+
+    def save_per_year(self, per_year_dir="forecasts_by_year"):
+        pdir = Path(per_year_dir)
+        pdir.mkdir(parents=True, exist_ok=True)
+        for y, df_y in self.per_year_dict.items():
+            df_y.to_csv(pdir / f"asthma_forecast_{y}.csv", index=False)
+
+    def __getitem__(self, key):
+        if key not in ("combined_df", "per_year_frames", "per_year_dict", "per_year_csvs", "years"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+
+def forecast_source_hash(hist_csv=HIST_CSV, model_pkl=MODEL_PKL) -> str:
+    """Identifies the inputs of a forecast: the model bundle and historical dataset contents."""
+    return hashlib.sha256(f"{file_sha256(model_pkl)}:{file_sha256(hist_csv)}".encode()).hexdigest()
+
+
 def run_forecast(
     start_year: int,
     end_year: int,
     hist_csv=HIST_CSV,
     model_pkl=MODEL_PKL,
     save_per_year=False,
-    per_year_dir="forecasts_by_year"
+    per_year_dir="forecasts_by_year",
+    years=None,
+    interval=None,
+    region_col="State",
 ):
-    # ---- (same steps as your finalized script) ----
+    """
+    Forecast start_year..end_year (or just `years` when given) into a
+    ForecastResult over iter_forecast's frames. With `interval` (a coverage such as 0.9) the frames also get
+    INTERVAL_COLUMNS from the spread of the ensemble's trees. region_col names the
+    historical dataset's region key (see FORECAST_LEVELS for other admin levels).
+    Years come from iter_forecast, so they share its per-year memo.
+    """
+    years_future = sorted(int(y) for y in years) if years is not None else list(range(start_year, end_year + 1))
+    result = ForecastResult(dict(iter_forecast(years_future, hist_csv, model_pkl, interval, region_col)))
+
+    # optionally save each year to disk too
+    if save_per_year:
+        result.save_per_year(per_year_dir)
+    return result
+
+
+def load_model(model_pkl):
+    """
+    The model to score with: the compiled ensemble exported next to model_pkl when
+    it is at least as new as the bundle and loadable by this sklearn (see
+    compiled_model), otherwise the bundle's sklearn model.
+    """
+    compiled = compiled_model(model_pkl)
+    return compiled if compiled is not None else load_bundle(model_pkl)["model"]
+
+
+def forecast_design(years_future, hist_csv, bundle, region_col="State"):
+    """
+    Future design matrix: the region x Year grid (regions are the distinct values of
+    region_col, e.g. State or County) with every trend-forecast feature and any
+    other column the model needs. Returns (future, needed, trend_cols).
+    """
     hist = pd.read_csv(hist_csv)
     hist.columns = hist.columns.astype(str).str.strip()
+    if not {"Year", region_col}.issubset(hist.columns):
+        raise ValueError(f"Historical file must contain 'Year' and '{region_col}' columns.")
     hist["Year"] = pd.to_numeric(hist["Year"], errors="coerce").astype("Int64")
-    hist["State"] = hist["State"].astype(str).str.strip()
+    hist[region_col] = hist[region_col].astype(str).str.strip()
 
     pollutant_cols = [c for c in hist.columns if c.startswith("Avg ")]
-    bundle = joblib.load(model_pkl)
-    model = bundle["model"]
     feat = bundle.get("features", pollutant_cols)
     cat  = bundle.get("cat_cols", []) or []
     needed = list(feat) + list(cat)
 
-    years_future = list(range(start_year, end_year + 1))
-    states = sorted(hist["State"].dropna().unique().tolist())
-    future = build_future_grid(states, years_future)
-
-    # forecast pollutants
-    for col in pollutant_cols:
-        future[col] = forecast_feature_per_state(hist, states, years_future, col).values
+    regions = sorted(hist[region_col].dropna().unique().tolist())
+    future = build_future_grid(regions, years_future, region_col)
 
-    # forecast extra numeric features (e.g., Smoking Prevalence %) if model expects them
+    # forecast pollutants and extra numeric features (e.g., Smoking Prevalence %) if model expects them,
+    # all regions x features in one grouped pass
     extra_numeric_feats = [c for c in feat if (not c.startswith("Avg ")) and (c not in cat)]
-    for col in extra_numeric_feats:
-        if col in hist.columns:
-            future[col] = forecast_feature_per_state(hist, states, years_future, col).values
-        else:
-            future[col] = np.nan
+    trend_cols = pollutant_cols + [c for c in extra_numeric_feats if c not in pollutant_cols]
+    trends = forecast_panel(hist, regions, years_future, trend_cols, region_col)
+    for col in trend_cols:
+        future[col] = trends[col].to_numpy()
 
     # ensure categoricals and required columns exist
     for c in cat:
@@ -197,56 +353,68 @@ def run_forecast(
     for c in needed:
         if c not in future.columns:
             future[c] = np.nan if c in feat else pd.NA
+    return future, needed, trend_cols
 
-    # predict
-    X_future = future[needed].copy()
-    preds = model.predict(X_future)
+
+def _predict_frame(model, future, needed, trend_cols, interval=None, region_col="State") -> pd.DataFrame:
+    """Score a slice of the design matrix into forecast output columns."""
+    future = future.copy()
+    X_future = future[needed]
+    if interval:
+        # one pass over every tree gives the point forecast and its bounds
+        preds, lower, upper = prediction_interval(model, X_future, coverage=interval)
+        future[INTERVAL_COLUMNS[0]], future[INTERVAL_COLUMNS[1]] = lower, upper
+    else:
+        preds = model.predict(X_future)
     future["Predicted Asthma Prevalence %"] = preds
     
     # ---- add Country column and order columns ----
-    future["Country"] = "United States of America"
-    key_cols = ["Country", "Year", "State"]  # Country first
+    if "Country" not in future.columns:
+        future["Country"] = COUNTRY
+    key_cols = list(dict.fromkeys(["Country", "Year", region_col]))  # Country first
     # Ensure these keys exist in case of custom cat cols
     key_cols = [c for c in key_cols if c in future.columns]
 
-    ordered = key_cols + ["Predicted Asthma Prevalence %"] + pollutant_cols + [
-        c for c in extra_numeric_feats if c not in pollutant_cols
-    ]
+    bounds = list(INTERVAL_COLUMNS) if interval else []
+    ordered = key_cols + ["Predicted Asthma Prevalence %"] + bounds + trend_cols
+    return future[ordered]
 
-    # # save combined
-    # Path(out_csv).parent.mkdir(parents=True, exist_ok=True)
-    combined_df = future[ordered].copy()
-    # combined_df.to_csv(out_csv, index=False)
 
-    # build "array" of per-year outputs
-    per_year_list = []            # list of DataFrames
-    per_year_dict = {}            # dict[year] -> DataFrame
-    per_year_csvs = {}            # dict[year] -> CSV string (in-memory)
-    years = []
+def _remember(key, frame):
+    with _memo_lock:
+        _memo[key] = frame
+        while len(_memo) > FORECAST_MEMO_SIZE:
+            _memo.popitem(last=False)
 
-    for year, df_y in combined_df.groupby("Year"):
-        df_y = df_y.reset_index(drop=True)
-        per_year_list.append(df_y)
-        per_year_dict[int(year)] = df_y
-        per_year_csvs[int(year)] = df_y.to_csv(index=False)
-        years.append(year)
 
-    # optionally save each year to disk too
-    if save_per_year:
-        pdir = Path(per_year_dir)
-        pdir.mkdir(parents=True, exist_ok=True)
-        for y, df_y in per_year_dict.items():
-            df_y.to_csv(pdir / f"asthma_forecast_{y}.csv", index=False)
-    
+def iter_forecast(years, hist_csv=HIST_CSV, model_pkl=MODEL_PKL, interval=None, region_col="State"):
+    """
+    Yield (year, frame) one year at a time, in year order, so downstream stages
+    (LISA, writes) can start on a year while later ones are still being scored.
+    Frames are memoized per process by (model bundle and historical data hash,
+    region, interval, year): years already forecast from the same inputs are
+    yielded without scoring, so callers must not mutate them.
+    """
+    years_future = sorted(int(y) for y in years)
+    source = forecast_source_hash(hist_csv, model_pkl)
+    keys = {year: (source, region_col, interval, year) for year in years_future}
+    with _memo_lock:
+        cached = {year: _memo[key] for year, key in keys.items() if key in _memo}
+        for year in cached:
+            _memo.move_to_end(keys[year])
+    todo = [year for year in years_future if year not in cached]
+    if todo:
+        model = load_model(model_pkl)
+        # the trend panel is one vectorized pass over the missing years; scoring is per year
+        future, needed, trend_cols = forecast_design(todo, hist_csv, bundle_metadata(model_pkl), region_col)
+    for year in years_future:
+        frame = cached.get(year)
+        if frame is None:
+            block = future[future["Year"] == year]
+            frame = _predict_frame(model, block, needed, trend_cols, interval, region_col).reset_index(drop=True)
+            _remember(keys[year], frame)
+        yield year, frame
 
-    # return whatever you need to use programmatically
-    return {
-        "combined_df": combined_df,
-        "per_year_frames": per_year_list,  # “array” of DataFrames
-        "per_year_dict": per_year_dict,    # easy keyed access by year
-        "per_year_csvs": per_year_csvs,    # CSV text blobs if you need to upload/send
-        "years": years
-    }
 if __name__ == "__main__":
     run_forecast(2025, 2027)
     
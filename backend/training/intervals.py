@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from sklearn.pipeline import Pipeline
+
+
+def _split(model):
+    """(preprocessing or None, tree ensemble) of a bundle model."""
+    if isinstance(model, Pipeline):
+        return (model[:-1] if len(model.steps) > 1 else None), model[-1]
+    return None, model
+
+
+def tree_predictions(model, X, n_jobs: int | None = None):
+    """
+    Per-tree predictions of a fitted tree ensemble (RandomForest/ExtraTrees,
+    optionally the last step of a Pipeline) as an (n_trees, n_rows) array.
+    X is preprocessed once; trees then run on a thread pool (tree prediction
+    releases the GIL). A CompiledEnsemble computes them itself.
+    """
+    if hasattr(model, "tree_predictions"):
+        return model.tree_predictions(X, n_jobs=n_jobs)
+    prep, ensemble = _split(model)
+    estimators = getattr(ensemble, "estimators_", None)
+    if not estimators:
+        raise ValueError(f"{type(ensemble).__name__} is not a fitted tree ensemble")
+    Xt = prep.transform(X) if prep is not None else X
+    # the input format DecisionTree.predict accepts with check_input=False
+    Xt = sp.csr_matrix(Xt, dtype=np.float32) if sp.issparse(Xt) else np.ascontiguousarray(Xt, dtype=np.float32)
+
+    out = np.empty((len(estimators), Xt.shape[0]))
+
+    def run(i):
+        out[i] = estimators[i].predict(Xt, check_input=False).reshape(Xt.shape[0], -1)[:, 0]
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count() or 1) as pool:
+        list(pool.map(run, range(len(estimators))))
+    return out
+
+
+def prediction_interval(model, X, coverage: float = 0.9, n_jobs: int | None = None):
+    """
+    (point, lower, upper) per row: the ensemble mean (what model.predict returns)
+    and the (1 - coverage) / 2 and (1 + coverage) / 2 quantiles of the trees.
+    """
+    if not 0 < coverage < 1:
+        raise ValueError("coverage must be between 0 and 1")
+    per_tree = tree_predictions(model, X, n_jobs=n_jobs)
+    lower, upper = np.quantile(per_tree, [(1 - coverage) / 2, (1 + coverage) / 2], axis=0)
+    return per_tree.mean(axis=0), lower, upper
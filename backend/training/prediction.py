@@ -1,64 +1,224 @@
+"""
+Batch-score future feature files with the saved model bundle.
+
+Inputs (CSV or Parquet) are streamed in fixed-size chunks and predictions are
+appended to the output as each chunk finishes, so memory stays bounded by
+chunk size x workers regardless of input size. Scoring uses the compiled
+ensemble next to the bundle when there is a usable one (see compiled.py):
+
+    python prediction.py asthma_forecast_2025_2027.csv --output preds.csv --workers 4
+"""
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
 import pandas as pd
-import joblib
 from pathlib import Path
 
+from compiled import CompiledEnsemble, compiled_model
+from registry import bundle_metadata, load_bundle
+
 # -----------------------------
 # CONFIG
 # -----------------------------
 MODEL_PATH = "models/best_ensemble.pkl"
 FUTURE_FILES = [
     "asthma_forecast_2025_2027.csv",
-    
+
 ]
 OUTPUT_PATH = "predictions_asthma_forecast.csv"
+CHUNK_SIZE = 100_000
+TARGET = "Predicted Asthma Prevalence %"
+LEAD_COLUMNS = ["Year", "State", TARGET]
 
-# -----------------------------
-# LOAD MODEL
-# -----------------------------
-bundle = joblib.load(MODEL_PATH)
-model = bundle["model"]
-features = bundle.get("features", [])
-cat_cols = bundle.get("cat_cols", []) or []
-with_fixed = bundle.get("with_fixed_effects", False)
 
-print(f"Loaded model trained with fixed effects = {with_fixed}")
-print(f"Numeric features: {features}")
-print(f"Categorical features: {cat_cols}")
+def _is_parquet(path) -> bool:
+    return Path(path).suffix.lower() in (".parquet", ".pq")
 
-# -----------------------------
-# LOAD AND COMBINE FUTURE DATA
-# -----------------------------
-frames = []
-for f in FUTURE_FILES:
-    df = pd.read_csv(f)
-    print(f"Loaded {f}: {df.shape}")
-    frames.append(df)
-future = pd.concat(frames, ignore_index=True)
-
-# Clean up columns
-future.columns = future.columns.str.strip()
-needed = features + cat_cols
-missing = [c for c in needed if c not in future.columns]
-if missing:
-    print(f"[WARN] Missing columns in input: {missing} → filling with NaN")
-    for c in missing:
-        future[c] = pd.NA
-
-X_future = future[needed].copy()
 
-# -----------------------------
-# PREDICT
-# -----------------------------
-preds = model.predict(X_future)
-future["Predicted Asthma Prevalence %"] = preds
+def iter_chunks(paths: list[str], chunk_size: int):
+    """(path, DataFrame) chunks of at most chunk_size rows from each input in turn."""
+    for path in paths:
+        if _is_parquet(path):
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+                yield path, batch.to_pandas()
+        else:
+            for chunk in pd.read_csv(path, chunksize=chunk_size):
+                yield path, chunk
+
+
+def needed_columns(bundle: dict) -> list[str]:
+    return list(bundle.get("features", [])) + list(bundle.get("cat_cols", []) or [])
+
+
+def load_model(model_path: str):
+    """The compiled ensemble exported next to the bundle when usable, otherwise the bundle's model."""
+    model = compiled_model(model_path)
+    return model if model is not None else load_bundle(model_path)["model"]
+
+
+def score_chunk(model_path: str, chunk: pd.DataFrame, n_jobs: int | None = None) -> pd.DataFrame:
+    """
+    Predictions for one chunk; columns the model needs but the input lacks are NaN.
+    n_jobs caps the threads a compiled ensemble scores with.
+    """
+    model = load_model(model_path)
+    chunk.columns = chunk.columns.str.strip()
+    needed = needed_columns(bundle_metadata(model_path))
+    for c in needed:
+        if c not in chunk.columns:
+            chunk[c] = np.nan
+    X = chunk[needed]
+    chunk[TARGET] = model.predict(X, n_jobs=n_jobs) if isinstance(model, CompiledEnsemble) else model.predict(X)
+    return chunk
+
+
+def _arrow_type(column: str, series: pd.Series, fixed: dict):
+    """
+    Parquet type of an output column: fixed by the model where it can be (Year,
+    numeric features, the prediction), otherwise float64 for numeric columns and
+    string for everything else, including columns that are all null so far.
+    """
+    import pyarrow as pa
+    if column in fixed:
+        return fixed[column]
+    if pd.api.types.is_numeric_dtype(series) and series.notna().any():
+        return pa.float64()
+    return pa.string()
+
+
+def _arrow_column(series: pd.Series, type_):
+    """series as an Arrow array of type_; raises ValueError if numeric values would be lost."""
+    import pyarrow as pa
+    if pa.types.is_string(type_):
+        values = series.astype(object).where(series.isna(), series.astype(str))
+        return pa.array(values, type=type_, from_pandas=True)
+    values = pd.to_numeric(series, errors="coerce")
+    lost = values.isna() & series.notna()
+    if lost.any():
+        raise ValueError(f"column {series.name!r} is numeric in earlier chunks but holds {series[lost].iloc[0]!r}")
+    return pa.array(values, type=type_, from_pandas=True)
+
+
+class _Output:
+    """
+    Appends scored chunks to a CSV or Parquet file using the first chunk's
+    column order. The Parquet schema comes from the model (see _arrow_type) rather
+    than from the first chunk's dtypes, so an int column that later gains NaNs or
+    decimals, or a column that starts out empty, does not break later chunks.
+    """
+
+    def __init__(self, path: str, bundle: dict):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.bundle = bundle
+        self.columns = None
+        self.schema = None
+        self.writer = None
+        self.rows = 0
+
+    def _fixed_types(self) -> dict:
+        import pyarrow as pa
+        fixed = {"Year": pa.int64(), TARGET: pa.float64()}
+        fixed.update({c: pa.float64() for c in self.bundle.get("features", [])})
+        return fixed
+
+    def write(self, df: pd.DataFrame):
+        if self.columns is None:
+            self.columns = [c for c in LEAD_COLUMNS if c in df.columns] + [
+                c for c in df.columns if c not in LEAD_COLUMNS
+            ]
+        df = df.reindex(columns=self.columns)
+        if _is_parquet(self.path):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self.schema is None:
+                fixed = self._fixed_types()
+                self.schema = pa.schema([(c, _arrow_type(c, df[c], fixed)) for c in self.columns])
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+            table = pa.Table.from_arrays(
+                [_arrow_column(df[f.name], f.type) for f in self.schema], schema=self.schema
+            )
+            self.writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode="w" if self.rows == 0 else "a", header=self.rows == 0, index=False)
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def score_files(
+    paths: list[str],
+    output_path: str,
+    model_path: str = MODEL_PATH,
+    chunk_size: int = CHUNK_SIZE,
+    workers: int = 1,
+) -> int:
+    """
+    Score every input row and write the predictions to output_path in input
+    order. With workers > 1 chunks are scored on a process pool, keeping at most
+    2 x workers chunks in flight. Returns the number of rows written.
+    """
+    bundle = bundle_metadata(model_path)
+    model = load_model(model_path)
+    print(f"Scoring with {'the compiled ensemble' if isinstance(model, CompiledEnsemble) else 'the pickled bundle'}")
+    print(f"Loaded model trained with fixed effects = {bundle.get('with_fixed_effects', False)}")
+    print(f"Numeric features: {bundle.get('features', [])}")
+    print(f"Categorical features: {bundle.get('cat_cols', []) or []}")
+    needed = needed_columns(bundle)
+
+    warned = set()
+
+    def chunks():
+        for path, chunk in iter_chunks(paths, chunk_size):
+            if path not in warned:
+                warned.add(path)
+                missing = [c for c in needed if c not in chunk.columns.str.strip()]
+                if missing:
+                    print(f"[WARN] Missing columns in {path}: {missing} → filling with NaN")
+            yield chunk
+
+    out = _Output(output_path, bundle)
+    try:
+        if workers <= 1:
+            for chunk in chunks():
+                out.write(score_chunk(model_path, chunk))
+        else:
+            ctx = multiprocessing.get_context("spawn")
+            # split the CPUs between the processes rather than each scoring on all of them
+            n_jobs = max(1, (os.cpu_count() or 1) // workers)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                pending = deque()
+                for chunk in chunks():
+                    pending.append(pool.submit(score_chunk, model_path, chunk, n_jobs))
+                    if len(pending) >= 2 * workers:
+                        out.write(pending.popleft().result())
+                while pending:
+                    out.write(pending.popleft().result())
+    finally:
+        out.close()
+    return out.rows
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Batch-score future feature files with the saved model")
+    parser.add_argument("inputs", nargs="*", default=FUTURE_FILES, help="CSV or Parquet files to score")
+    parser.add_argument("--model", default=MODEL_PATH, help="model bundle path")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="CSV or Parquet output path")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows scored per chunk")
+    parser.add_argument("--workers", type=int, default=1,
+                        help=f"scoring processes (0 = one per CPU, {os.cpu_count()} here)")
+    args = parser.parse_args(argv)
+
+    rows = score_files(args.inputs, args.output, model_path=args.model, chunk_size=args.chunk_size,
+                       workers=args.workers or os.cpu_count() or 1)
+    print(f"\n✅ Saved {rows} predictions → {args.output}")
 
-# Reorder for readability
-cols = ["Year", "State", "Predicted Asthma Prevalence %"] + [
-    c for c in future.columns if c not in ["Year", "State", "Predicted Asthma Prevalence %"]
-]
-future = future[cols]
 
-Path(OUTPUT_PATH).parent.mkdir(exist_ok=True)
-future.to_csv(OUTPUT_PATH, index=False)
-print(f"\n✅ Saved forecast → {OUTPUT_PATH}")
-print(future.head(10).to_string(index=False))
+if __name__ == "__main__":
+    main()
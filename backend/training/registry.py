@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import threading
+import joblib
+from pathlib import Path
+
+
+# Bundle keys that describe the model without needing it deserialized
+METADATA_KEYS = ("features", "cat_cols", "with_fixed_effects", "target")
+
+_bundles: dict[str, tuple[tuple, dict]] = {}
+_digests: dict[str, tuple[tuple, str]] = {}
+_lock = threading.Lock()
+
+
+def _version(path: str) -> tuple:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def metadata_path(model_path) -> Path:
+    """Sidecar JSON written next to a bundle: best_ensemble.pkl -> best_ensemble.meta.json"""
+    p = Path(model_path)
+    return p.with_name(f"{p.stem}.meta.json")
+
+
+def save_bundle(bundle: dict, model_path) -> Path:
+    """
+    Dump a model bundle uncompressed (so it can be memory-mapped on load) and
+    write its metadata sidecar.
+    """
+    model_path = Path(model_path)
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(bundle, model_path)
+    meta = {k: bundle[k] for k in METADATA_KEYS if k in bundle}
+    meta["model"] = type(bundle["model"]).__name__
+    metadata_path(model_path).write_text(json.dumps(meta, indent=2))
+    return model_path
+
+
+def load_bundle(model_path) -> dict:
+    """
+    The bundle at model_path, loaded once per process and reloaded when the file
+    changes. Loaded with mmap_mode="r", so numpy arrays kept as-is are shared
+    read-only pages across processes; sklearn trees copy their node tables while
+    unpickling, so for tree ensembles the saving is mostly the per-process cache.
+    Callers must not mutate the bundle.
+    """
+    key = os.path.abspath(model_path)
+    version = _version(key)
+    with _lock:
+        cached = _bundles.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        bundle = joblib.load(key, mmap_mode="r")
+        _bundles[key] = (version, bundle)
+        return bundle
+
+
+def bundle_metadata(model_path) -> dict:
+    """
+    features / cat_cols / with_fixed_effects / target of a bundle. Read from the
+    sidecar when it is at least as new as the bundle, otherwise from the bundle.
+    """
+    meta_file = metadata_path(model_path)
+    if meta_file.exists() and meta_file.stat().st_mtime_ns >= _version(model_path)[0]:
+        return json.loads(meta_file.read_text())
+    bundle = load_bundle(model_path)
+    return {k: bundle[k] for k in METADATA_KEYS if k in bundle}
+
+
+def file_sha256(path) -> str:
+    """sha256 of a file (model bundle, historical CSV), recomputed only when it changes."""
+    key = os.path.abspath(path)
+    version = _version(key)
+    with _lock:
+        cached = _digests.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+    digest = hashlib.sha256()
+    with open(key, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    with _lock:
+        _digests[key] = (version, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def clear_cache():
+    with _lock:
+        _bundles.clear()
+        _digests.clear()
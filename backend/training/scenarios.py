@@ -0,0 +1,96 @@
+import math
+import numpy as np
+import pandas as pd
+
+from backend.training.forecasting import HIST_CSV, MODEL_PKL, COUNTRY, forecast_design, load_model
+from backend.training.registry import bundle_metadata
+
+
+BASELINE = "baseline"
+
+
+def _is_number(value) -> bool:
+    # bool is an int subclass, but true/false is not a percent change
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def parse_scenarios(raw: list) -> list[dict]:
+    """
+    Validate scenario specs:
+      {"name": "pm25-20", "changes": {"Avg PM2.5": -20}, "by_year": 2030}
+    `changes` are percent changes to forecast features. With `by_year` the change
+    phases in linearly from the first forecast year and holds from by_year on;
+    without it the full change applies to every year. Raises ValueError for
+    anything else.
+    """
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("scenarios must be a non-empty list")
+    scenarios, names = [], set()
+    for i, spec in enumerate(raw):
+        if not isinstance(spec, dict):
+            raise ValueError(f"scenario {i} must be an object")
+        name = str(spec.get("name") or f"scenario_{i + 1}")
+        if name in names or name == BASELINE:
+            raise ValueError(f"duplicate or reserved scenario name: {name}")
+        changes = spec.get("changes") or {}
+        if not isinstance(changes, dict) or not all(_is_number(v) for v in changes.values()):
+            raise ValueError(f"scenario {name}: changes must map feature names to percent changes")
+        by_year = spec.get("by_year")
+        if by_year is not None and not (_is_number(by_year) and float(by_year).is_integer()):
+            raise ValueError(f"scenario {name}: by_year must be a year, got {by_year!r}")
+        names.add(name)
+        scenarios.append({"name": name, "changes": {str(k): float(v) for k, v in changes.items()},
+                          "by_year": int(by_year) if by_year is not None else None})
+    return scenarios
+
+
+def scenario_factors(years: np.ndarray, change_pct: float, by_year: int | None) -> np.ndarray:
+    """Multiplier per row for a percent change, ramped in up to by_year."""
+    if by_year is None:
+        return np.full(years.shape, 1 + change_pct / 100)
+    start = years.min()
+    span = max(by_year - start, 0)
+    phase = np.ones(years.shape) if span == 0 else np.clip((years - start) / span, 0, 1)
+    return 1 + phase * change_pct / 100
+
+
+def run_scenarios(
+    scenarios: list[dict],
+    start_year: int,
+    end_year: int,
+    hist_csv=HIST_CSV,
+    model_pkl=MODEL_PKL,
+    region_col="State",
+) -> dict:
+    """
+    Score the baseline forecast and every scenario over start_year..end_year with
+    one model.predict call on the stacked (scenario x region x year) design matrix.
+    Returns {name: DataFrame} including BASELINE, each with the prediction and its
+    change against the baseline.
+    """
+    model = load_model(model_pkl)
+    years_future = list(range(start_year, end_year + 1))
+    future, needed, trend_cols = forecast_design(years_future, hist_csv, bundle_metadata(model_pkl), region_col)
+    unknown = sorted({f for s in scenarios for f in s["changes"]} - set(trend_cols))
+    if unknown:
+        raise ValueError(f"unknown scenario features: {unknown}; use any of {trend_cols}")
+
+    names = [BASELINE] + [s["name"] for s in scenarios]
+    n = len(future)
+    stacked = pd.concat([future] * len(names), ignore_index=True)
+    stacked.insert(0, "Scenario", np.repeat(names, n))
+    years = future["Year"].to_numpy(dtype=float)
+    for i, s in enumerate(scenarios, start=1):
+        rows = slice(i * n, (i + 1) * n)
+        for feature, pct in s["changes"].items():
+            col = stacked.columns.get_loc(feature)
+            stacked.iloc[rows, col] = stacked.iloc[rows, col].to_numpy(dtype=float) * scenario_factors(years, pct, s["by_year"])
+
+    stacked["Predicted Asthma Prevalence %"] = model.predict(stacked[needed])
+    baseline = stacked["Predicted Asthma Prevalence %"].to_numpy()[:n]
+    stacked["Change vs Baseline"] = stacked["Predicted Asthma Prevalence %"].to_numpy() - np.tile(baseline, len(names))
+    if "Country" not in stacked.columns:
+        stacked["Country"] = COUNTRY
+
+    ordered = list(dict.fromkeys(["Country", "Year", region_col])) + ["Predicted Asthma Prevalence %", "Change vs Baseline"] + trend_cols
+    return {name: df.reset_index(drop=True) for name, df in stacked.groupby("Scenario", sort=False)[ordered]}
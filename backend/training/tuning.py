@@ -12,7 +12,9 @@ from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 
 from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
-import joblib
+
+from registry import save_bundle  # run from backend/training, like the relative paths below
+from compiled import compiled_path, export_ensemble
 
 # -----------------------
 # CONFIG
@@ -171,7 +173,8 @@ out_dir.mkdir(exist_ok=True)
 pd.DataFrame(results).to_csv(out_dir / "tuning_results.csv", index=False)
 
 # Save best model
-joblib.dump(
+# Uncompressed so the API can memory-map it, plus best_ensemble.meta.json for cheap metadata reads
+save_bundle(
     {
         "model": best_model,
         "features": feature_cols,
@@ -181,6 +184,8 @@ joblib.dump(
     },
     out_dir / "best_ensemble.pkl"
 )
+# Flat node arrays the forecast/scenario endpoints load and score with instead of the pickle
+export_ensemble(best_model, compiled_path(out_dir / "best_ensemble.pkl"))
 
 print("\n=== TUNING SUMMARY ===")
 for row in results:
@@ -191,4 +196,5 @@ for row in results:
     )
 print(f"\nBest by CV: {best_name} (CV R²={best_cv:.3f})")
 print(f"Saved best model → {out_dir / 'best_ensemble.pkl'}")
+print(f"Saved compiled ensemble → {compiled_path(out_dir / 'best_ensemble.pkl')}")
 print(f"Saved full tuning table → {out_dir / 'tuning_results.csv'}")